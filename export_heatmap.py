@@ -0,0 +1,322 @@
+# export_heatmap.py
+# Batch export of the multi-year heatmap as a compact standalone HTML page.
+#
+# Narrative_Project.py saves `full_layout` with the whole folded table inlined
+# and lets the browser filter and re-aggregate it on every widget change.
+# Here the cell grids and both marginals are computed up front for every
+# metric x axis mode. Year windows come from per-year prefix sums, so for any
+# (year_min, year_max) the page reads at most two rows per cell,
+# P[year_max] - P[year_min - 1], and the bindings only pick which
+# precomputed rows are shown.
+#
+#   python export_heatmap.py -o heatmap.html --compare
+
+import time
+import gzip
+import argparse
+
+import numpy as np
+import pandas as pd
+import altair as alt
+
+import storm_data
+import storm_cache
+
+MONTHS = storm_data.MONTH_NAMES
+METRIC_LABELS = ['Number of occurrence', 'Damage to properties', 'Damage to crops', 'Injuries', 'Deaths']
+AXIS_MODES = ['hour_month', 'hour_year', 'year_month']
+AXIS_LABELS = ['Hour vs Month', 'Hour vs Year', 'Year vs Month']
+
+# Column types of the precomputed CSV; ydim mixes month names and years, so it stays a string
+CSV_PARSE = {'m': 'number', 'a': 'number', 'k': 'number', 'xdim': 'number', 'yr': 'number', 'v': 'number'}
+
+
+def load_folded(clock='local'):
+    """Folded (MONTH_NAME, HOUR, YEAR, metric, value) table for every year on disk, on the local or UTC clock."""
+    all_files = [file for year in storm_data.YEARS for file in storm_data.year_files(year)]
+    if not all_files:
+        raise SystemExit(f"No Storm Events CSVs found in {storm_data.DATA_DIR}")
+
+    return storm_cache.heatmap_folds(all_files)[clock]
+
+
+def heatmap_cube(folded):
+    """(metric, month, hour, year) array of values plus the years along the last axis.
+
+    The years run from the first to the last one in the data without gaps, so
+    the prefix sums have a row for every year the sliders can pick.
+    """
+    years = np.arange(folded['YEAR'].min(), folded['YEAR'].max() + 1)
+    cube = np.zeros((len(storm_data.HEATMAP_METRICS), 12, 24, len(years)))
+    metric = folded['metric'].map({name: i for i, name in enumerate(storm_data.HEATMAP_METRICS)}).to_numpy()
+    month = folded['MONTH_NAME'].astype(str).map({name: i for i, name in enumerate(MONTHS)}).to_numpy()
+    year = np.searchsorted(years, folded['YEAR'].to_numpy())
+    np.add.at(cube, (metric, month, folded['HOUR'].to_numpy(), year), folded['value'].fillna(0).to_numpy())
+    return cube, years
+
+
+def _label(names, years, index):
+    """Labels for one grid dim: None -> '', 'yr' -> the year at `index`, else names[index]."""
+    if names is None:
+        return ''
+    if isinstance(names, str):
+        return years[index]
+    return np.asarray(names)[index]
+
+
+def _rows(values, axis, part, prefix, years, xdim=None, ydim=None):
+    """Long rows for one grid shaped (metric, *dims, year); zero values are dropped.
+
+    xdim/ydim label the grid dims in order; 'yr' labels the axis with the
+    row's own year instead of consuming a dim.
+    """
+    idx = np.nonzero(np.round(values))
+    dims = iter(idx[1:-1])
+    x = _label(xdim, years, idx[-1] if isinstance(xdim, str) else next(dims) if xdim is not None else None)
+    y = _label(ydim, years, idx[-1] if isinstance(ydim, str) else next(dims) if ydim is not None else None)
+    return pd.DataFrame({
+        'm': idx[0], 'a': axis, 'p': part, 'k': int(prefix), 'xdim': x, 'ydim': y,
+        'yr': years[idx[-1]], 'v': np.round(values[idx]).astype(np.int64),
+    })
+
+
+def _scaffold(axis, part, years, xdim=None, ydim=None):
+    """Zero rows for every position of a grid, for any metric (m=-1), so empty cells and bars still draw.
+
+    Positions on a year axis are per-year rows (k=0) and follow the year
+    window; the others always count (k=2).
+    """
+    on_year = isinstance(xdim, str) or isinstance(ydim, str)
+    x = years if isinstance(xdim, str) else [''] if xdim is None else xdim
+    y = years if isinstance(ydim, str) else [''] if ydim is None else ydim
+    grid = pd.MultiIndex.from_product([x, y], names=['xdim', 'ydim']).to_frame(index=False)
+    yr = grid['xdim' if isinstance(xdim, str) else 'ydim'] if on_year else 0
+    return pd.DataFrame({
+        'm': -1, 'a': axis, 'p': part, 'k': 0 if on_year else 2, 'xdim': grid['xdim'], 'ydim': grid['ydim'],
+        'yr': yr, 'v': 0,
+    })
+
+
+def precompute(folded):
+    """Every metric x axis mode grid and marginal as one CSV string, plus the years covered.
+
+    Rows are (m, a, p, k, xdim, ydim, yr, v): metric and axis mode indexes,
+    part ('c' cells, 't' top bars, 'l' left bars) and whether v is a prefix
+    sum through year yr (k=1), the value of year yr alone (k=0) or a zero
+    placeholder that always counts (k=2). Grids that add up the year window
+    are stored as prefix sums; grids with a year axis keep per-year values.
+    """
+    cube, years = heatmap_cube(folded)
+    prefix = cube.cumsum(axis=3)
+    hours = np.arange(24)
+    # Like the folded table, the grid spans the hours with at least one tornado in any year
+    hours_seen = hours[cube[0].sum(axis=(0, 2)) > 0]
+
+    grids = [
+        # (axis mode, part, values shaped (metric, *dims, year), prefix sums?, xdim, ydim)
+        (0, 'c', prefix.transpose(0, 2, 1, 3), True, hours, MONTHS),
+        (0, 't', prefix.sum(axis=1), True, hours, None),
+        (0, 'l', prefix.sum(axis=2), True, None, MONTHS),
+
+        (1, 'c', cube.sum(axis=1), False, hours, 'yr'),
+        (1, 't', prefix.sum(axis=1), True, hours, None),
+        (1, 'l', cube.sum(axis=(1, 2)), False, None, 'yr'),
+
+        (2, 'c', cube.sum(axis=2), False, 'yr', MONTHS),
+        (2, 't', cube.sum(axis=(1, 2)), False, 'yr', None),
+        (2, 'l', prefix.sum(axis=2), True, None, MONTHS),
+    ]
+    parts = []
+    for axis, part, values, is_prefix, xdim, ydim in grids:
+        parts.append(_scaffold(axis, part, years, hours_seen if xdim is hours else xdim, ydim))
+        parts.append(_rows(values, axis, part, is_prefix, years, xdim, ydim))
+    return pd.concat(parts, ignore_index=True).to_csv(index=False), years
+
+
+def heatmap_params(years):
+    """The notebook's bound parameters, with the year ranges limited to the data on disk."""
+    first, last = int(years[0]), int(years[-1])
+    return [
+        alt.param(name='metric', value='COUNT', bind=alt.binding_radio(
+            options=storm_data.HEATMAP_METRICS, labels=METRIC_LABELS, name='Display Metric:')),
+        alt.param(name='axis_mode', value='hour_month', bind=alt.binding_select(
+            options=AXIS_MODES, labels=AXIS_LABELS, name='Axis: ')),
+        alt.param(name='year_min', value=first, bind=alt.binding_range(min=first, max=last, name='Start Year', step=1)),
+        alt.param(name='year_max', value=last, bind=alt.binding_range(min=first, max=last, name='End Year', step=1)),
+    ]
+
+
+def precomputed_bases(years, params):
+    """Cells, top and left bases that look their rows up in the precomputed 'heatmap' dataset."""
+    metrics = str(storm_data.HEATMAP_METRICS)
+    # Placeholders always count; +1 for P[year_max], -1 for P[year_min - 1]; per-year rows count inside the window
+    weight = (
+        "datum.k === 2 ? 1 : year_min > year_max ? 0 : datum.k"
+        " ? (datum.yr === year_max ? 1 : datum.yr === year_min - 1 ? -1 : 0)"
+        " : (datum.yr >= year_min && datum.yr <= year_max ? 1 : 0)"
+    )
+    data = alt.NamedData(name='heatmap', format=alt.DataFormat(type='csv', parse=CSV_PARSE))
+
+    def base(part, field, groupby):
+        return alt.Chart(data).add_params(*params).transform_filter(
+            f"datum.p === '{part}' && (datum.m === -1 || datum.m === indexof({metrics}, metric))"
+            f" && datum.a === indexof({AXIS_MODES}, axis_mode)"
+        ).transform_calculate(
+            w=weight
+        ).transform_filter(
+            'datum.w !== 0'
+        ).transform_calculate(
+            signed='datum.v * datum.w'
+        ).transform_aggregate(
+            **{field: 'sum(signed)'},
+            groupby=groupby
+        )
+
+    return base('c', 'value', ['xdim', 'ydim']), base('t', 'total', ['xdim']), base('l', 'total', ['ydim'])
+
+
+def client_side_bases(folded, params):
+    """Bases as Narrative_Project.py builds them: filter and aggregate the folded rows in the browser."""
+    folded = folded.assign(MONTH_NAME=folded['MONTH_NAME'].astype(str))
+
+    def base(field, groupby):
+        return alt.Chart(folded).add_params(*params).transform_filter(
+            alt.datum.metric == params[0]
+        ).transform_filter(
+            "datum.YEAR >= year_min && datum.YEAR <= year_max"
+        ).transform_calculate(
+            xdim="toNumber(axis_mode === 'hour_month' || axis_mode === 'hour_year' ? datum.HOUR : datum.YEAR)",
+            ydim="axis_mode === 'hour_month' || axis_mode === 'year_month' ? datum.MONTH_NAME : toNumber(datum.YEAR)"
+        ).transform_aggregate(
+            **{field: 'sum(value)'},
+            groupby=groupby
+        )
+
+    return base('value', ['xdim', 'ydim']), base('total', ['xdim']), base('total', ['ydim'])
+
+
+def heatmap_layout(cells, top, left):
+    """Heatmap with marginal bars and row labels, composed like the notebook's full_layout."""
+    heatmap = cells.mark_rect().encode(
+        x=alt.X('xdim:O', title=None, axis=alt.Axis(labelAngle=0)),
+        y=alt.Y('ydim:O', sort=MONTHS, title=None, axis=alt.Axis(labels=False, ticks=False, grid=False)),
+        color=alt.Color('value:Q', scale=alt.Scale(scheme='blues'), title="Metric Value", legend=alt.Legend(orient='bottom')),
+        tooltip=[
+            alt.Tooltip('xdim:O', title='X'),
+            alt.Tooltip('ydim:O', title='Y'),
+            alt.Tooltip('value:Q', title='Metric Value')
+        ]
+    ).properties(width=600, height=300)
+
+    no_axis = alt.Axis(title=None, labels=False, ticks=False, grid=False)
+    bar_top = top.mark_bar().encode(
+        x=alt.X('xdim:O', title=None, axis=no_axis),
+        y=alt.Y('total:Q', title=None, axis=no_axis),
+        color=alt.Color('total:Q', scale=alt.Scale(scheme='blues'), legend=None),
+        tooltip=[alt.Tooltip('xdim:O', title='X'), alt.Tooltip('total:Q', title='Metric Value')]
+    ).properties(width=600, height=80)
+    bar_top_label = top.transform_window(
+        rank='rank(total)', sort=[alt.SortField('total', order='descending')]
+    ).transform_filter(alt.datum.rank == 1).mark_text(align='center', dy=-5, fontSize=11, fontWeight='bold').encode(
+        x=alt.X('xdim:O'), y=alt.Y('total:Q'), text=alt.Text('total:Q', format=".0f")
+    )
+
+    bar_left = left.mark_bar().encode(
+        y=alt.Y('ydim:O', title=None, sort=MONTHS, axis=no_axis),
+        x=alt.X('total:Q', title=None, scale=alt.Scale(reverse=True), axis=no_axis),
+        color=alt.Color('total:Q', scale=alt.Scale(scheme='blues'), legend=None),
+        tooltip=[alt.Tooltip('ydim:O', title='Y'), alt.Tooltip('total:Q', title='Metric Value')]
+    ).properties(width=80, height=300)
+    bar_left_label = left.transform_window(
+        rank='rank(total)', sort=[alt.SortField('total', order='descending')]
+    ).transform_filter(alt.datum.rank == 1).mark_text(align='left', dx=5, fontSize=11, fontWeight='bold', color='white').encode(
+        y=alt.Y('ydim:O'), x=alt.X('total:Q'), text=alt.Text('total:Q', format=".0f")
+    )
+
+    bar_right_labels = left.mark_bar(opacity=0).encode(
+        y=alt.Y('ydim:O', title=None, sort=MONTHS, axis=alt.Axis(title=None, ticks=False, grid=False)),
+        x=alt.value(5)
+    ).properties(width=50, height=300)
+
+    spacer = alt.Chart(pd.DataFrame({'x': [0], 'y': [0]})).mark_point(opacity=0).encode(
+        x=alt.X('x:Q', axis=no_axis),
+        y=alt.Y('y:Q', axis=no_axis)
+    ).properties(width=80, height=80)
+
+    top_row = alt.hconcat(spacer, bar_top + bar_top_label, spacing=5)
+    bottom_row = alt.hconcat(bar_left + bar_left_label, heatmap, bar_right_labels, spacing=5).resolve_scale(color='independent')
+    return alt.vconcat(top_row, bottom_row, spacing=5).resolve_scale(color='independent').configure_axis(
+        grid=False,
+        domain=False
+    ).configure_view(
+        stroke=None
+    ).configure_title(
+        fontSize=24, anchor='middle', font='Arial', color='black'
+    ).properties(
+        title="When do tornadoes occur? What is their effect?"
+    )
+
+
+def precomputed_layout(folded):
+    csv, years = precompute(folded)
+    params = heatmap_params(years)
+    return heatmap_layout(*precomputed_bases(years, params)).properties(datasets={'heatmap': csv})
+
+
+def client_side_layout(folded):
+    years = np.sort(folded['YEAR'].unique())
+    return heatmap_layout(*client_side_bases(folded, heatmap_params(years)))
+
+
+def render_seconds(chart, repeat=3):
+    """Best-of-`repeat` time to run the chart's dataflow headlessly, or None without vl-convert."""
+    try:
+        import vl_convert
+    except ImportError:
+        return None
+    spec = chart.to_json()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vl_convert.vegalite_to_svg(spec)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def describe(name, html, seconds):
+    size = len(html.encode())
+    zipped = len(gzip.compress(html.encode()))
+    timing = f", render {seconds:.2f}s" if seconds is not None else ''
+    print(f"{name:<12}{size:>12,} bytes ({zipped:,} gzipped){timing}")
+    return size, zipped, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the multi-year heatmap as a compact standalone HTML page.")
+    parser.add_argument('-o', '--output', default='heatmap.html', help="HTML file to write (default: heatmap.html)")
+    parser.add_argument('--compare', action='store_true',
+                        help="also build the notebook's client-side version and report the size and render-time gain")
+    parser.add_argument('--clock', choices=list(storm_data.HEATMAP_CLOCKS), default='local',
+                        help="hour of day in each event's local time zone or in UTC (default: local)")
+    args = parser.parse_args()
+
+    folded = load_folded(args.clock)
+    chart = precomputed_layout(folded)
+    html = chart.to_html()
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(html)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with alt.data_transformers.disable_max_rows():
+            baseline = describe('notebook', client_side_layout(folded).to_html(), render_seconds(client_side_layout(folded)))
+        compact = describe('precomputed', html, render_seconds(chart))
+        print(f"{'gain':<12}{baseline[0] / compact[0]:>11.1f}x smaller ({baseline[1] / compact[1]:.1f}x gzipped)", end='')
+        if compact[2] is not None:
+            print(f", {baseline[2] / compact[2]:.1f}x faster to render")
+        else:
+            print(" (install vl-convert-python to time rendering)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# load_test.py
+# Concurrent-session load test for streamlit_storm_dashboard.py, run headlessly
+# through Streamlit's AppTest against the CSVs in data/.
+#
+# Each simulated session is an AppTest instance on its own thread, scripted to
+# browse like a user: pick a year, select one or a few states, search, change the
+# grid size, then switch to the heatmap and play with metric, axis and year
+# range. Sessions share the process, and therefore st.cache_resource / the
+# spec and year caches, just as they do in `streamlit run`. Every rerun is
+# timed, and the dashboard's own profile traces (storm_profiling) tell how many
+# charts were rebuilt and how many years were loaded instead of served from a
+# cache shared with other sessions.
+#
+#   python load_test.py --sessions 8 --steps 12
+
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+import storm_data
+import storm_memory
+
+APP = os.path.join(storm_data.BASE_DIR, 'streamlit_storm_dashboard.py')
+STATE_VIEW, HEATMAP_VIEW = '2024 State Analysis', 'Multi-Year Heatmap'
+METRICS = ['COUNT', 'DAMAGE_PROPERTY', 'DAMAGE_CROPS', 'INJURIES', 'DEATHS']
+AXIS_MODES = ['hour_month', 'hour_year', 'year_month']
+SEARCHES = ['mobile home', 'school', 'damage', 'EF3', 'power lines']
+
+
+# ----- Session scripts -----
+def session_script(rng, years, steps):
+    """A list of (widget kind, label, value) actions; values pointing at a state are resolved at run time."""
+    year = rng.choice(years)
+    actions = [('selectbox', 'Select Year:', year)]
+    while len(actions) < steps:
+        roll = rng.random()
+        if roll < 0.35:
+            actions.append(('multiselect', 'Select States:', 'random states'))
+        elif roll < 0.45:
+            actions.append(('multiselect', 'Select States:', []))
+        elif roll < 0.55:
+            actions.append(('text_input', 'Search Narratives:', rng.choice(SEARCHES)))
+        elif roll < 0.6:
+            actions.append(('text_input', 'Search Narratives:', ''))
+        elif roll < 0.7:
+            actions.append(('radio', 'Grid Size:', 'random option'))
+        elif roll < 0.8:
+            year = rng.choice(years)
+            actions.append(('selectbox', 'Select Year:', year))
+        else:
+            # A detour through the heatmap and back
+            actions.append(('radio', 'Select View', HEATMAP_VIEW))
+            actions.append(('selectbox', 'Display Metric:', rng.choice(METRICS)))
+            actions.append(('selectbox', 'Axis:', rng.choice(AXIS_MODES)))
+            start = rng.randint(2000, 2020)
+            actions.append(('slider', 'Year Range', (start, rng.randint(start, 2024))))
+            actions.append(('radio', 'Select View', STATE_VIEW))
+    return actions[:steps]
+
+
+def find_widget(at, kind, label):
+    for widget in getattr(at, kind):
+        if widget.label == label:
+            return widget
+    return None
+
+
+def apply(at, rng, kind, label, value):
+    """Set one widget; returns False when it is not on the page in the current view."""
+    widget = find_widget(at, kind, label)
+    if widget is None:
+        return False
+    if value == 'random states':
+        value = rng.sample(widget.options, min(len(widget.options), rng.choice([1, 1, 2, 3])))
+    elif value == 'random option':
+        value = rng.choice(widget.options)
+    widget.set_value(value)
+    return True
+
+
+# ----- Runner -----
+class Session:
+    def __init__(self, index, script, seed, think, timeout):
+        self.index = index
+        self.script = script
+        self.rng = random.Random(seed)
+        self.think = think
+        self.timeout = timeout
+        self.latencies = []  # (step label, seconds) of the reruns that finished without an exception
+        self.errors = []  # (step label, exception message) of the reruns that raised
+        self.traces = []
+        self.seen = set()
+
+    def new_traces(self, at):
+        traces = at.session_state['profile_traces'] if 'profile_traces' in at.session_state else []
+        new = [trace for trace in traces if trace.id not in self.seen]
+        self.seen.update(trace.id for trace in new)
+        return new
+
+    def rerun(self, at, label):
+        start = time.perf_counter()
+        at.run(timeout=self.timeout)
+        seconds = time.perf_counter() - start
+        traces = self.new_traces(at)
+        # A rerun that raised is reported as an error and kept out of the latency and hit-rate figures
+        if at.exception:
+            self.errors.append((label, at.exception[0].value))
+        else:
+            self.latencies.append((label, seconds))
+            self.traces += traces
+
+    def run(self, start_gate):
+        at = AppTest.from_file(APP, default_timeout=self.timeout)
+        start_gate.wait()
+        # The first rerun is the page a new visitor gets, on the dashboard's default year
+        self.rerun(at, 'initial load')
+        year = None
+        for kind, label, value in self.script:
+            if self.think:
+                time.sleep(self.rng.expovariate(1 / self.think))
+            if label == 'Select Year:':
+                year = value
+            if not apply(at, self.rng, kind, label, value):
+                continue
+            self.rerun(at, label)
+            if value == STATE_VIEW and year is not None:
+                # Coming back from the heatmap recreates the year selectbox on its
+                # default, so the user picks their year again
+                apply(at, self.rng, 'selectbox', 'Select Year:', year)
+                self.rerun(at, 'Select Year:')
+        return self
+
+    def span_counts(self):
+        counts = {'charts': 0, 'spec builds': 0, 'year loads': 0, 'year reads': 0}
+        for trace in self.traces:
+            for span in trace.spans:
+                name = span['name']
+                counts['charts'] += name.startswith('chart ')
+                counts['spec builds'] += name == 'build altair'
+                counts['year loads'] += name == 'load_data_by_year'
+                counts['year reads'] += name == 'read_year_data'
+        return counts
+
+
+def percentiles(seconds):
+    if not seconds:
+        return None
+    return {f'p{q}': float(np.percentile(seconds, q)) * 1e3 for q in (50, 95, 99)}
+
+
+def report(sessions, wall, rss_before):
+    latencies = [s for session in sessions for _, s in session.latencies]
+    steady = [s for session in sessions for label, s in session.latencies if label != 'initial load']
+    counts = [session.span_counts() for session in sessions]
+    totals = {name: sum(c[name] for c in counts) for name in counts[0]}
+    peak = storm_memory.peak_rss_bytes()
+    return {
+        'sessions': len(sessions),
+        'reruns': len(latencies),
+        'errors': sum(len(session.errors) for session in sessions),
+        'failures': [{'session': session.index, 'step': label, 'error': str(error)}
+                     for session in sessions for label, error in session.errors],
+        'wall_s': wall,
+        'reruns_per_s': len(latencies) / wall,
+        'latency_ms': percentiles(latencies),
+        'latency_ms_after_first_load': percentiles(steady),
+        'peak_rss_mib': peak / 2**20 if peak else None,
+        'rss_growth_mib': (peak - rss_before) / 2**20 if peak and rss_before else None,
+        'spec_hit_rate': 1 - totals['spec builds'] / totals['charts'] if totals['charts'] else None,
+        'year_hit_rate': 1 - totals['year reads'] / totals['year loads'] if totals['year loads'] else None,
+        'per_session': [dict(session=session.index, reruns=len(session.latencies), **c)
+                        for session, c in zip(sessions, counts)],
+    }
+
+
+def print_report(result):
+    print(f"{result['sessions']} sessions, {result['reruns']} reruns in {result['wall_s']:.1f}s "
+          f"({result['reruns_per_s']:.2f} reruns/s), {result['errors']} reruns raised (left out of the figures below)")
+    for name in ('latency_ms', 'latency_ms_after_first_load'):
+        if result[name]:
+            print(f"  {name:<28}" + '  '.join(f"{q} {ms:7.0f}" for q, ms in result[name].items()))
+    if result['peak_rss_mib']:
+        print(f"  peak RSS {result['peak_rss_mib']:.0f} MiB (+{result['rss_growth_mib']:.0f} MiB during the test)")
+    for name in ('spec_hit_rate', 'year_hit_rate'):
+        if result[name] is not None:
+            print(f"  {name:<28}{result[name]:.0%}")
+    if result['failures']:
+        print("  failed reruns:")
+        for failure in result['failures']:
+            print(f"    session {failure['session']}, {failure['step']}: {failure['error']}")
+    print("  session  reruns  charts  spec builds  year loads  year reads")
+    for row in result['per_session']:
+        print(f"  {row['session']:>7}  {row['reruns']:>6}  {row['charts']:>6}  {row['spec builds']:>11}"
+              f"  {row['year loads']:>10}  {row['year reads']:>10}")
+    print("Caches are shared when spec builds and year reads stay roughly flat as sessions are added.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive N concurrent headless sessions of the dashboard and report rerun latency.")
+    parser.add_argument('--sessions', type=int, default=4, help="concurrent sessions (default: 4)")
+    parser.add_argument('--steps', type=int, default=10, help="widget changes per session (default: 10)")
+    parser.add_argument('--think', type=float, default=0.0, help="mean pause between actions in seconds (default: 0)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for the session scripts (default: 0)")
+    parser.add_argument('--timeout', type=float, default=120, help="seconds allowed per rerun (default: 120)")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    years = [year for year in storm_data.YEARS if storm_data.year_files(year)]
+    if not years:
+        raise SystemExit(f"No Storm Events CSVs found in {storm_data.DATA_DIR}")
+
+    rng = random.Random(args.seed)
+    sessions = [Session(i, session_script(rng, years, args.steps), rng.random(), args.think, args.timeout)
+                for i in range(args.sessions)]
+    rss_before = storm_memory.peak_rss_bytes()
+    start_gate = threading.Barrier(args.sessions)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        sessions = list(pool.map(lambda session: session.run(start_gate), sessions))
+    result = report(sessions, time.perf_counter() - start, rss_before)
+
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    if result['errors']:
+        raise SystemExit(f"{result['errors']} reruns raised an exception")
+
+
+if __name__ == '__main__':
+    main()
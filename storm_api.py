@@ -0,0 +1,288 @@
+# storm_api.py
+# Read-only JSON API over the aggregates behind the dashboard, for other tools.
+#
+#   GET /years                               years with data on disk
+#   GET /years/{year}/state-stats            per-state count and average intensity
+#   GET /years/{year}/monthly-trends[?state=]
+#   GET /years/{year}/ef-counts[?state=]
+#   GET /heatmap?metric=COUNT[&year_min=&year_max=&clock=utc]
+#                                            month x hour x year cube of one metric
+#
+# Year endpoints read the same 'year' entries of storm_cache as the dashboard,
+# and /heatmap the same fold as export_heatmap.py, so whichever runs first
+# warms the disk cache for the others. Tables are returned as
+# {"columns": [...], "data": [[...], ...]}.
+#
+# The ETag of a response is derived from the source files' fingerprint and the
+# request, so If-None-Match is answered with 304 before any data is loaded.
+# Encoded bodies (plain and gzip) are kept in a byte-capped LRU, and concurrent
+# requests for the same body share one computation.
+#
+#   python storm_api.py serve --port 8600
+#   python storm_api.py bench --concurrency 32 --requests 2000
+
+import os
+import time
+import gzip
+import json
+import asyncio
+import argparse
+import threading
+
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.routing import Route
+
+import storm_data
+import storm_cache
+import storm_jobs
+import export_heatmap
+
+# Bump when the shape of any response changes, so clients drop their cached copies
+API_VERSION = 1
+BODY_CACHE_MB = int(os.environ.get('STORM_API_CACHE_MB', 64))
+GZIP_MIN_BYTES = 1024
+
+
+# ----- Queries (blocking; run on the thread pool) -----
+def year_entry(year):
+    files = storm_data.year_files(year)
+    return storm_cache.cached('year', files, lambda: storm_data.clean_year_data(files))
+
+
+def table(df):
+    return {'columns': list(df.columns), 'data': json.loads(df.to_json(orient='values', date_format='iso'))}
+
+
+def by_state(df, params):
+    state = params.get('state')
+    if state is None:
+        return df
+    rows = df[df['STATE'] == state.upper()]
+    if rows.empty:
+        raise HTTPException(404, f"No rows for state {state!r}")
+    return rows
+
+
+def state_stats(year, params):
+    return table(year_entry(year)['state_stats'])
+
+
+def monthly_trends(year, params):
+    return table(by_state(year_entry(year)['monthly_trends'], params))
+
+
+def ef_counts(year, params):
+    return table(by_state(year_entry(year)['ef_counts'], params))
+
+
+def heatmap(params):
+    metric = params.get('metric', 'COUNT').upper()
+    if metric not in storm_data.HEATMAP_METRICS:
+        raise HTTPException(400, f"metric must be one of {storm_data.HEATMAP_METRICS}")
+    clock = params.get('clock', 'local').lower()
+    if clock not in storm_data.HEATMAP_CLOCKS:
+        raise HTTPException(400, f"clock must be one of {list(storm_data.HEATMAP_CLOCKS)}")
+    cube, years = export_heatmap.heatmap_cube(export_heatmap.load_folded(clock))
+    try:
+        year_min = int(params.get('year_min', years.min()))
+        year_max = int(params.get('year_max', years.max()))
+    except ValueError:
+        raise HTTPException(400, "year_min and year_max must be integers")
+    keep = (years >= year_min) & (years <= year_max)
+    values = cube[storm_data.HEATMAP_METRICS.index(metric)][:, :, keep]
+    return {
+        'metric': metric,
+        'clock': clock,
+        'months': export_heatmap.MONTHS,
+        'hours': list(range(24)),
+        'years': years[keep].tolist(),
+        'values': np.round(values, 6).tolist(),  # [month][hour][year]
+    }
+
+
+# ----- HTTP layer -----
+body_cache = storm_jobs.ByteBudgetCache(BODY_CACHE_MB * 2**20)
+_inflight = {}
+
+
+def etag_for(request, files):
+    query = '&'.join(f'{k}={v}' for k, v in sorted(request.query_params.items()))
+    return '"' + storm_cache.cache_key(files, 'api', API_VERSION, request.url.path, query) + '"'
+
+
+def encode(payload):
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return raw, gzip.compress(raw, compresslevel=6) if len(raw) >= GZIP_MIN_BYTES else None
+
+
+async def cached_body(etag, compute):
+    """(raw, gzipped) body for `etag`, computing it once however many requests ask at the same time."""
+    bodies = body_cache.get(etag)
+    if bodies is not None:
+        return bodies
+    future = _inflight.get(etag)
+    if future is None:
+        future = _inflight[etag] = asyncio.ensure_future(run_in_threadpool(lambda: encode(compute())))
+        future.add_done_callback(lambda f: _inflight.pop(etag, None))
+    bodies = await asyncio.shield(future)
+    body_cache.put(etag, bodies)
+    return bodies
+
+
+async def respond(request, files, compute):
+    if not files:
+        raise HTTPException(404, "No data files for this request")
+    etag = etag_for(request, files)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if etag in [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    raw, gzipped = await cached_body(etag, compute)
+    if gzipped is not None and 'gzip' in request.headers.get('accept-encoding', ''):
+        headers['Content-Encoding'] = 'gzip'
+        return Response(gzipped, media_type='application/json', headers=headers)
+    return Response(raw, media_type='application/json', headers=headers)
+
+
+def year_param(request):
+    try:
+        year = int(request.path_params['year'])
+    except ValueError:
+        raise HTTPException(400, "year must be an integer")
+    if year not in storm_data.YEARS:
+        raise HTTPException(404, f"year must be between {storm_data.YEARS[0]} and {storm_data.YEARS[-1]}")
+    return year
+
+
+def year_route(query):
+    async def endpoint(request):
+        year = year_param(request)
+        params = dict(request.query_params)
+        return await respond(request, storm_data.year_files(year), lambda: query(year, params))
+    return endpoint
+
+
+async def years_endpoint(request):
+    years = [year for year in storm_data.YEARS if storm_data.year_files(year)]
+    all_files = [file for year in years for file in storm_data.year_files(year)]
+    return await respond(request, all_files, lambda: {'years': years})
+
+
+async def heatmap_endpoint(request):
+    all_files = [file for year in storm_data.YEARS for file in storm_data.year_files(year)]
+    params = dict(request.query_params)
+    return await respond(request, all_files, lambda: heatmap(params))
+
+
+async def error_handler(request, exc):
+    return Response(json.dumps({'error': exc.detail}), status_code=exc.status_code, media_type='application/json')
+
+
+app = Starlette(routes=[
+    Route('/years', years_endpoint),
+    Route('/years/{year}/state-stats', year_route(state_stats)),
+    Route('/years/{year}/monthly-trends', year_route(monthly_trends)),
+    Route('/years/{year}/ef-counts', year_route(ef_counts)),
+    Route('/heatmap', heatmap_endpoint),
+], exception_handlers={HTTPException: error_handler})
+
+
+# ----- Benchmark -----
+async def fetch(reader, writer, path, headers):
+    """One GET over a kept-alive HTTP/1.1 connection; returns (status, headers, body)."""
+    lines = [f'GET {path} HTTP/1.1', 'Host: localhost'] + [f'{k}: {v}' for k, v in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    await writer.drain()
+    status_line, *header_lines = (await reader.readuntil(b'\r\n\r\n')).decode('latin1').split('\r\n')
+    response_headers = dict(line.split(': ', 1) for line in header_lines if ': ' in line)
+    response_headers = {k.lower(): v for k, v in response_headers.items()}
+    body = await reader.readexactly(int(response_headers.get('content-length', 0)))
+    return int(status_line.split()[1]), response_headers, body
+
+
+async def bench_scenario(port, paths, concurrency, total, headers, etags):
+    latencies, sizes, queue = [], [], asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(paths[i % len(paths)])
+
+    async def client():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            while not queue.empty():
+                path = queue.get_nowait()
+                request_headers = dict(headers)
+                if request_headers.pop('If-None-Match', None) and path in etags:
+                    request_headers['If-None-Match'] = etags[path]
+                start = time.perf_counter()
+                status, response_headers, body = await fetch(reader, writer, path, request_headers)
+                latencies.append(time.perf_counter() - start)
+                sizes.append(len(body))
+                if status == 200:
+                    etags.setdefault(path, response_headers['etag'])
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    wall = time.perf_counter() - start
+    return wall, np.array(latencies) * 1e3, np.mean(sizes)
+
+
+async def bench(port, concurrency, total):
+    years = [year for year in storm_data.YEARS if storm_data.year_files(year)]
+    paths = ['/years', '/heatmap?metric=COUNT', '/heatmap?metric=DEATHS&year_min=2017']
+    for year in years:
+        paths += [f'/years/{year}/state-stats', f'/years/{year}/monthly-trends',
+                  f'/years/{year}/ef-counts?state=texas']
+
+    # The first pass fills the disk and body caches (and primes the ETags used by the 304 pass)
+    scenarios = [
+        ('first requests (cold)', {'Accept-Encoding': 'identity'}, len(paths)),
+        ('warm, identity', {'Accept-Encoding': 'identity'}, total),
+        ('warm, gzip', {'Accept-Encoding': 'gzip'}, total),
+        ('If-None-Match -> 304', {'Accept-Encoding': 'gzip', 'If-None-Match': '*'}, total),
+    ]
+    etags = {}
+    print(f"{len(paths)} endpoints, {concurrency} concurrent keep-alive connections")
+    print(f"  {'scenario':<24}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'avg bytes':>11}")
+    for name, headers, count in scenarios:
+        wall, latencies, size = await bench_scenario(port, paths, min(concurrency, count), count, headers, etags)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f"  {name:<24}{count:>9}{count / wall:>9.0f}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{size:>11.0f}")
+
+
+def run_bench(args):
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=args.port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    try:
+        asyncio.run(bench(args.port, args.concurrency, args.requests))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the dashboard's aggregates as JSON, or benchmark that server.")
+    parser.add_argument('command', choices=['serve', 'bench'])
+    parser.add_argument('--host', default='127.0.0.1', help="interface to bind (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8600, help="port (default: 8600)")
+    parser.add_argument('--concurrency', type=int, default=32, help="bench: parallel connections (default: 32)")
+    parser.add_argument('--requests', type=int, default=2000, help="bench: requests per scenario (default: 2000)")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        uvicorn.run(app, host=args.host, port=args.port)
+    else:
+        run_bench(args)
+
+
+if __name__ == '__main__':
+    main()
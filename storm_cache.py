@@ -0,0 +1,97 @@
+# storm_cache.py
+# Versioned on-disk cache for cleaned data and derived aggregates.
+#
+# Entries live under .cache/disk/<name>/ and are keyed by the fingerprint of
+# the source CSVs plus CACHE_VERSION and the pandas version, so a new data
+# release, a change to the cleaning/aggregation code (bump CACHE_VERSION) or a
+# pandas upgrade all miss cleanly instead of returning stale pickles. Writes go
+# to a temporary file in the same folder and are moved into place with
+# os.replace, so readers never see a half-written entry.
+
+import os
+import pickle
+import hashlib
+import tempfile
+from collections import Counter
+
+import pandas as pd
+
+import storm_data
+
+# Bump whenever cleaning or aggregation code changes the cached values
+CACHE_VERSION = 5
+
+# Hits and misses per entry name since the process started, for the debug panel
+stats = Counter()
+
+
+def cache_key(files, *parts):
+    h = hashlib.sha1()
+    h.update(f'v{CACHE_VERSION}|pandas {pd.__version__}|{storm_data.files_fingerprint(files)}'.encode())
+    for part in parts:
+        h.update(f'|{part}'.encode())
+    return h.hexdigest()[:20]
+
+
+def entry_path(name, files, *parts):
+    return storm_data.cache_path(os.path.join('disk', name), cache_key(files, *parts), 'pkl')
+
+
+def load(name, files, *parts):
+    """Cached value, or None when there is no usable entry."""
+    path = entry_path(name, files, *parts)
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except FileNotFoundError:
+        value = None
+    except Exception:
+        # Truncated or unreadable entry: treat as a miss, it will be rewritten
+        value = None
+    stats[(name, 'hits' if value is not None else 'misses')] += 1
+    return value
+
+
+def store(value, name, files, *parts):
+    path = entry_path(name, files, *parts)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return value
+
+
+def cached(name, files, compute, *parts):
+    """Return the cached value for (name, files, parts), computing and storing it on a miss."""
+    value = load(name, files, *parts)
+    if value is None:
+        value = store(compute(), name, files, *parts)
+    return value
+
+
+def heatmap_folds(files, read=None):
+    """Month x hour x year folds of `files` for every clock, from the one 'heatmap_folds' entry.
+
+    The dashboard, the JSON API and the static export all load the folds here,
+    so the aggregate is computed and stored once. read() returns the tornado
+    rows to fold on a miss; by default only the heatmap columns are read, and
+    files that cannot be read are skipped as the dashboard's loader skips them.
+    """
+    def read_heatmap_columns():
+        usecols = sorted(set(storm_data.HEATMAP_REQUIRED_COLUMNS) | {'TOR_F_SCALE'})
+        dfs = [df for _, df, error in storm_data.read_sources(
+            files, lambda file: storm_data.read_tornado_rows(file, usecols)) if error is None]
+        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=usecols)
+
+    def compute():
+        df = storm_data.add_heatmap_columns((read or read_heatmap_columns)())
+        return {clock: storm_data.fold_heatmap(df, clock) for clock in storm_data.HEATMAP_CLOCKS}
+
+    return cached('heatmap_folds', files, compute)
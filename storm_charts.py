@@ -0,0 +1,180 @@
+# storm_charts.py
+# Turning Altair charts into Vega-Lite specs whose data lives in static files,
+# and memoizing those specs so reruns can skip building the Altair objects.
+#
+# Instead of inlining every DataFrame into the spec, each dataset is written
+# once to static/data/<sha256>.json and referenced by URL. Streamlit serves
+# static/ at app/static/ (see .streamlit/config.toml), so the browser can
+# cache a dataset across reruns and sessions, and charts that share a
+# dataset (the heatmap and its marginal bars) download it only once.
+#
+# Datasets of at most INLINE_MAX_BYTES (search hits, a few states' rows) stay
+# inline, as they are cheap to resend and would otherwise leave one file per
+# query behind. The folder is kept under STATIC_DATA_MAX_BYTES by deleting the
+# least recently used files; use is tracked through file mtimes, refreshed on
+# every write and spec cache hit.
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+import threading
+
+import altair as alt
+
+import storm_data
+import storm_jobs
+import storm_profiling
+
+STATIC_DATA_DIR = os.path.join(storm_data.BASE_DIR, 'static', 'data')
+STATIC_DATA_URL = 'app/static/data'
+STATIC_DATA_MAX_BYTES = 256 * 2**20
+INLINE_MAX_BYTES = 4096
+
+# vega_datasets' data.us_10m.url, pinned so the dashboard does not import vega_datasets for one URL
+US_10M_URL = 'https://cdn.jsdelivr.net/npm/vega-datasets@v1.29.0/data/us-10m.json'
+
+EF_SCALE_ORDER = ['EF0', 'EF1', 'EF2', 'EF3', 'EF4', 'EF5', 'EFU']
+EF_COLORS = ['#FEF001', '#FFCE03', '#FD9A01', '#FD6104', '#FF2C05', '#F00505', '#D3D3D3']
+
+
+_static_lock = threading.Lock()
+_static_bytes = 0  # size of static/data/ as of the last prune, plus files written since
+
+
+def prune_static_data(max_bytes=STATIC_DATA_MAX_BYTES):
+    """Delete the least recently used dataset files once static/data/ passes max_bytes; returns the bytes kept.
+
+    Pruning goes down to three quarters of max_bytes so it does not run again on the next write.
+    """
+    global _static_bytes
+    with _static_lock:
+        files = []
+        if os.path.isdir(STATIC_DATA_DIR):
+            with os.scandir(STATIC_DATA_DIR) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json'):
+                        st = entry.stat()
+                        files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total > max_bytes:
+            for _, size, path in sorted(files):
+                if total <= max_bytes * 3 // 4:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        _static_bytes = total
+    return total
+
+
+def touch_static_data(names):
+    """Mark dataset files as just used; False when one of them has been pruned."""
+    for name in names:
+        try:
+            os.utime(os.path.join(STATIC_DATA_DIR, name))
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def content_hashed_url(data):
+    """Altair data transformer: write the rows to a content-addressed JSON file and return its URL.
+
+    Small datasets are returned inline instead.
+    """
+    global _static_bytes
+    values = alt.to_values(data)['values']
+    payload = json.dumps(values, separators=(',', ':'), sort_keys=True, default=str).encode()
+    if len(payload) <= INLINE_MAX_BYTES:
+        return {'values': values}
+    name = hashlib.sha256(payload).hexdigest()[:24] + '.json'
+
+    path = os.path.join(STATIC_DATA_DIR, name)
+    if touch_static_data([name]):
+        return {'url': f'{STATIC_DATA_URL}/{name}', 'format': {'type': 'json'}}
+
+    os.makedirs(STATIC_DATA_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=STATIC_DATA_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    with _static_lock:
+        _static_bytes += len(payload)
+        over = _static_bytes > STATIC_DATA_MAX_BYTES
+    if over:
+        prune_static_data()
+    return {'url': f'{STATIC_DATA_URL}/{name}', 'format': {'type': 'json'}}
+
+
+alt.data_transformers.register('content_hashed_url', content_hashed_url)
+prune_static_data()
+
+# Enabling a data transformer is process-global in Altair, so conversions are serialized
+_transformer_lock = threading.Lock()
+
+
+@storm_profiling.timed('to_dict')
+def chart_spec(chart):
+    """Vega-Lite spec dict for `chart` with every inline dataset replaced by a static URL."""
+    with _transformer_lock, alt.data_transformers.enable('content_hashed_url'):
+        return chart.to_dict()
+
+
+def data_file_names(spec):
+    """Names of the static/data/ files a spec references."""
+    return sorted(set(re.findall(re.escape(STATIC_DATA_URL) + r'/([0-9a-f]+\.json)', json.dumps(spec))))
+
+
+def payload_bytes(spec):
+    """Bytes the browser fetches for a spec: the spec JSON and the static data files it references."""
+    paths = [os.path.join(STATIC_DATA_DIR, name) for name in data_file_names(spec)]
+    return {'spec_bytes': len(json.dumps(spec)),
+            'data_bytes': sum(os.path.getsize(p) for p in paths if os.path.exists(p))}
+
+
+class SpecCache(storm_jobs.ByteBudgetCache):
+    """Thread-safe LRU of finished Vega-Lite specs keyed by the inputs that produced them, capped in bytes.
+
+    Specs are shared between sessions and must not be modified by callers.
+    """
+
+    def get_or_build(self, key, build):
+        """Spec for `key`; on a miss, or when one of its data files was pruned, `build()` returns the Altair chart to convert."""
+        entry = self.get(key)
+        if entry is not None:
+            spec, names = entry
+            if touch_static_data(names):
+                return spec
+        with storm_profiling.span('build altair'):
+            chart = build()
+        spec = chart_spec(chart)
+        self.put(key, (spec, data_file_names(spec)))
+        return spec
+
+
+def animated(spec, param, values, interval_ms=800):
+    """Copy of `spec` with a Play checkbox that steps the `param` signal through `values` every interval_ms.
+
+    The step is a Vega timer event on the param's own signal, so it runs in the
+    browser with the rest of the chart, and the param's slider follows along.
+
+    `on` is not part of the Vega-Lite schema for variable params: this relies on
+    the Vega-Lite compiler copying the param's properties onto its Vega signal
+    unchanged (true for the Vega-Lite 5 and 6 bundled with Altair and Streamlit).
+    tests/test_storm_charts.py compiles the spec to check it still does.
+    """
+    values = json.dumps(list(values))
+    step = f"play ? {values}[(indexof({values}, {param}) + 1) % length({values})] : {param}"
+    params = [dict(p, on=[{'events': f'timer{{{int(interval_ms)}}}', 'update': step}]) if p.get('name') == param else p
+              for p in spec.get('params', [])]
+    play = {'name': 'play', 'value': False, 'bind': {'input': 'checkbox', 'name': '▶ Play '}}
+    return dict(spec, params=[play] + params)
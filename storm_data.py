@@ -0,0 +1,543 @@
+# storm_data.py
+# Shared file locations and ingest helpers for the NOAA Storm Events CSVs.
+# Kept free of Streamlit so offline tools can import it as well.
+#
+# Detail files may be kept plain (.csv), or as NOAA ships them gzipped
+# (.csv.gz) or recompressed with zstd (.csv.zst, needs the zstandard package).
+# Compressed sources are decompressed as a stream while pandas parses them,
+# non-tornado rows are dropped chunk by chunk, and the files of a load are
+# read on a thread pool, since zlib/zstd and the C parser release the GIL.
+
+import os
+import re
+import glob
+import hashlib
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import storm_profiling
+
+try:
+    import zstandard  # optional: only needed for .csv.zst sources
+except ImportError:
+    zstandard = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+CACHE_DIR = os.path.join(BASE_DIR, '.cache')
+
+YEARS = list(range(2000, 2025))
+
+# The 50 states by upper-case name (as in the STATE column) -> FIPS code; same table as us.states.STATES
+STATE_NAME_TO_FIPS = {
+    'ALABAMA': 1, 'ALASKA': 2, 'ARIZONA': 4, 'ARKANSAS': 5, 'CALIFORNIA': 6, 'COLORADO': 8, 'CONNECTICUT': 9,
+    'DELAWARE': 10, 'FLORIDA': 12, 'GEORGIA': 13, 'HAWAII': 15, 'IDAHO': 16, 'ILLINOIS': 17, 'INDIANA': 18,
+    'IOWA': 19, 'KANSAS': 20, 'KENTUCKY': 21, 'LOUISIANA': 22, 'MAINE': 23, 'MARYLAND': 24,
+    'MASSACHUSETTS': 25, 'MICHIGAN': 26, 'MINNESOTA': 27, 'MISSISSIPPI': 28, 'MISSOURI': 29, 'MONTANA': 30,
+    'NEBRASKA': 31, 'NEVADA': 32, 'NEW HAMPSHIRE': 33, 'NEW JERSEY': 34, 'NEW MEXICO': 35, 'NEW YORK': 36,
+    'NORTH CAROLINA': 37, 'NORTH DAKOTA': 38, 'OHIO': 39, 'OKLAHOMA': 40, 'OREGON': 41, 'PENNSYLVANIA': 42,
+    'RHODE ISLAND': 44, 'SOUTH CAROLINA': 45, 'SOUTH DAKOTA': 46, 'TENNESSEE': 47, 'TEXAS': 48, 'UTAH': 49,
+    'VERMONT': 50, 'VIRGINIA': 51, 'WASHINGTON': 53, 'WEST VIRGINIA': 54, 'WISCONSIN': 55, 'WYOMING': 56
+}
+
+# Bounding box that covers every state drawn by the albersUsa projection
+US_LAT_RANGE = (17.0, 72.0)
+US_LON_RANGE = (-180.0, -64.0)
+
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+# Preferred first when one chunk is on disk in several forms; plain CSV parses fastest
+SOURCE_COMPRESSIONS = ['', '.gz', '.zst']
+READ_CHUNK_ROWS = 100_000
+READ_WORKERS = min(8, os.cpu_count() or 1)
+# A detail file without these is skipped: the year view needs the date, the heatmap the time of day
+SOURCE_REQUIRED_COLUMNS = ['TOR_F_SCALE', 'BEGIN_DATE_TIME', 'BEGIN_TIME']
+
+
+def year_files(year):
+    """Return the sorted detail files for one year: plain, gzip or zstd CSVs, from the newest release on disk."""
+    prefix = f'StormEvents_details-ftp_v1.0_d{year}_c'
+    releases = {}  # release date -> chunk name -> compression -> path
+    for path in glob.glob(os.path.join(DATA_DIR, prefix + '*.csv*')):
+        match = re.fullmatch(re.escape(prefix) + r'(\d{8})(.*)\.csv(\.gz|\.zst)?', os.path.basename(path))
+        if match:
+            release, chunk, compression = match.group(1), match.group(2), match.group(3) or ''
+            releases.setdefault(release, {}).setdefault(chunk, {})[compression] = path
+    if not releases:
+        return []
+    chunks = releases[max(releases)].values()
+    return sorted(next(copies[c] for c in SOURCE_COMPRESSIONS if c in copies) for copies in chunks)
+
+
+def files_fingerprint(files):
+    """Short hash of file names, sizes and mtimes; changes whenever a source file does."""
+    h = hashlib.sha1()
+    for file in files:
+        st = os.stat(file)
+        h.update(f'{os.path.basename(file)}:{st.st_size}:{st.st_mtime_ns};'.encode())
+    return h.hexdigest()[:16]
+
+
+def cache_path(kind, key, ext):
+    """Path of a cache artifact, creating the cache folder on first use."""
+    folder = os.path.join(CACHE_DIR, kind)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f'{key}.{ext}')
+
+
+def artifact_path(kind, files, version, *parts):
+    """Path of a per-year .npz artifact, keyed by the source files and the artifact's format version."""
+    key = '-'.join([files_fingerprint(files), f'v{version}'] + [str(part) for part in parts])
+    return cache_path(kind, key, 'npz')
+
+
+def ensure_artifact(path, build, compressed=False):
+    """Write build()'s arrays to `path` unless it already exists.
+
+    The arrays go to a unique temporary file in the same folder that is then
+    moved into place, so concurrent builders of the same artifact (the
+    foreground run, prefetch and background jobs) never collide or leave a
+    torn file behind.
+    """
+    if not os.path.exists(path):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                (np.savez_compressed if compressed else np.savez)(f, **build())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return path
+
+
+def read_source(file, **kwargs):
+    """pd.read_csv for one detail file; the compression is inferred from the extension."""
+    if file.endswith('.zst') and zstandard is None:
+        raise ImportError(f"{os.path.basename(file)} is zstd-compressed; install the zstandard package to read it")
+    return pd.read_csv(file, encoding='latin1', on_bad_lines='skip', **kwargs)
+
+
+def read_tornado_rows(file, usecols=None):
+    """Tornado rows (those with a TOR_F_SCALE rating) of one detail file, filtered while streaming.
+
+    A file without a TOR_F_SCALE column gives an empty frame with the file's columns, for the caller to report.
+    """
+    parts = []
+    with storm_profiling.span('read_csv', file=os.path.basename(file)):
+        with read_source(file, usecols=usecols, chunksize=READ_CHUNK_ROWS) as chunks:
+            for chunk in chunks:
+                parts.append(chunk[chunk['TOR_F_SCALE'].notna()] if 'TOR_F_SCALE' in chunk.columns else chunk.iloc[:0])
+    if not parts:  # header-only file
+        return read_source(file, usecols=usecols, nrows=0)
+    return pd.concat(parts, ignore_index=True)
+
+
+def read_sources(files, read=read_tornado_rows):
+    """Yield (file, frame, error) in file order, reading on a thread pool; error is what read(file) raised, or None."""
+    def attempt(file):
+        try:
+            return file, read(file), None
+        except Exception as e:
+            return file, None, e
+
+    if len(files) <= 1:
+        yield from map(attempt, files)
+        return
+    with ThreadPoolExecutor(max_workers=min(READ_WORKERS, len(files)), thread_name_prefix='storm-read') as pool:
+        # Each task runs in a copy of the caller's context, so its spans land in the caller's trace
+        futures = [pool.submit(contextvars.copy_context().run, attempt, file) for file in files]
+        for future in futures:
+            yield future.result()
+
+
+@storm_profiling.timed()
+def read_tornadoes(files, usecols=None):
+    """Read detail files and keep only tornado rows (those with a TOR_F_SCALE rating)."""
+    if usecols is not None:
+        usecols = sorted(set(usecols) | {'TOR_F_SCALE'})
+    dfs = []
+    for file, df, error in read_sources(files, lambda file: read_tornado_rows(file, usecols)):
+        if error is not None:
+            raise error
+        dfs.append(df)
+    if not dfs:
+        return pd.DataFrame(columns=usecols)
+    return pd.concat(dfs, ignore_index=True)
+
+
+# ----- Single-year cleaning and aggregates -----
+def source_issue(file, df, error):
+    """(level, message) when one read_sources() result cannot be used, else None; shared by every loader."""
+    if error is not None:
+        return ('error', f"❌ Could not read {os.path.basename(file)}: {error}")
+    missing = [col for col in SOURCE_REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        return ('warning', f"⚠️ Missing expected columns {missing} in {os.path.basename(file)}")
+    return None
+
+
+@storm_profiling.timed()
+def read_detail_files(files):
+    """Concatenate the readable detail CSVs; returns (df, issues) with issues as (level, message) pairs."""
+    dfs, issues = [], []
+    for file, df, error in read_sources(files):
+        issue = source_issue(file, df, error)
+        if issue is not None:
+            issues.append(issue)
+        else:
+            dfs.append(df)
+
+    if not dfs:
+        return pd.DataFrame(), issues
+    return pd.concat(dfs, ignore_index=True), issues
+
+
+@storm_profiling.timed()
+def clean_tornadoes(df):
+    """Tornado rows with intensity, date, month and STATE_FIPS added; problems are left to quality_report()."""
+    df = df[~df['TOR_F_SCALE'].isna()].copy()
+    with storm_profiling.span('extract intensity'):
+        df['intensity'] = df['TOR_F_SCALE'].str.extract(r'(\d+)').astype(float)
+    with storm_profiling.span('to_datetime'):
+        df['date'] = pd.to_datetime(df['BEGIN_DATE_TIME'], format='%d-%b-%y %H:%M:%S', errors='coerce')
+    df['month'] = df['date'].dt.month
+    df['STATE_FIPS'] = df['STATE'].map(STATE_NAME_TO_FIPS)
+    return df
+
+
+# ----- Ingest-time data quality -----
+# Checks run once per year when its rows are ingested. Bit i of a row's flags
+# is set when the row fails the i-th check; views count bits over the rows
+# they show instead of rescanning strings.
+QUALITY_CHECKS = {
+    'unmapped_state': 'State outside the 50 mapped states',
+    'ef_unknown': "Unrated ('EFU')",
+    'ef_invalid': 'Missing or unrecognised rating',
+    'bad_damage': 'Unparsable damage amount',
+    'bad_time': 'Unparsable begin date or time',
+    'bad_coords': 'Missing or out-of-range begin/end point',
+}
+
+
+def _per_value(column, check):
+    """check() run on the distinct values of a column only, gathered back to its rows; NaN rows get False."""
+    codes, uniques = pd.factorize(column)
+    ok = np.append(np.asarray(check(pd.Series(uniques).astype('string').str.strip().str.upper()), dtype=bool), False)
+    return ok[codes]  # code -1 (NaN) picks the trailing False
+
+
+def _outside(df, lat_col, lon_col, allow_missing):
+    lat = pd.to_numeric(df[lat_col], errors='coerce')
+    lon = pd.to_numeric(df[lon_col], errors='coerce')
+    inside = lat.between(*US_LAT_RANGE) & lon.between(*US_LON_RANGE)
+    if allow_missing:
+        inside |= lat.isna() & lon.isna()
+    return ~inside.to_numpy()
+
+
+@storm_profiling.timed()
+def quality_report(df, file_issues=()):
+    """Validate one year of tornado rows; returns {'flags', 'by_state', 'file_issues'}.
+
+    flags holds one uint8 per row of df, by_state the rows and failures of each check per state.
+    Checks whose columns are missing are skipped; the file-level issues already say so.
+    """
+    checks = pd.DataFrame(False, index=df.index, columns=list(QUALITY_CHECKS))
+    if 'STATE' in df:
+        checks['unmapped_state'] = ~df['STATE'].isin(list(STATE_NAME_TO_FIPS)).to_numpy()
+    # String checks run on distinct values (a few dozen ratings and amounts per year), not on every row
+    if 'TOR_F_SCALE' in df:
+        checks['ef_unknown'] = _per_value(df['TOR_F_SCALE'], lambda v: v.eq('EFU'))
+        checks['ef_invalid'] = ~_per_value(df['TOR_F_SCALE'], lambda v: v.str.fullmatch(r'E?F[0-5U]'))
+    for column in ('DAMAGE_PROPERTY', 'DAMAGE_CROPS'):
+        if column in df:
+            # Same forms parse_damage() accepts: a number with an optional K or M suffix; blanks are fine
+            checks['bad_damage'] |= _per_value(df[column], lambda v: pd.to_numeric(
+                v.str.replace(r'[KM]$', '', regex=True), errors='coerce').isna())
+    if 'date' in df or 'BEGIN_DATE_TIME' in df:
+        date = df['date'] if 'date' in df else pd.to_datetime(df['BEGIN_DATE_TIME'], format='%d-%b-%y %H:%M:%S', errors='coerce')
+        checks['bad_time'] = date.isna().to_numpy()
+    if 'BEGIN_TIME' in df:
+        hhmm = pd.to_numeric(df['BEGIN_TIME'], errors='coerce')
+        checks['bad_time'] |= (hhmm.isna() | (hhmm // 100 > 23) | (hhmm % 100 > 59)).to_numpy()
+    if 'BEGIN_LAT' in df and 'BEGIN_LON' in df:
+        checks['bad_coords'] = _outside(df, 'BEGIN_LAT', 'BEGIN_LON', allow_missing=False)
+    if 'END_LAT' in df and 'END_LON' in df:
+        checks['bad_coords'] |= _outside(df, 'END_LAT', 'END_LON', allow_missing=True)
+
+    bits = checks.to_numpy(dtype=np.uint8) << np.arange(len(QUALITY_CHECKS), dtype=np.uint8)
+    states = df['STATE'].fillna('(missing)').to_numpy() if 'STATE' in df else np.full(len(df), '(unknown)')
+    by_state = checks.astype(int).assign(rows=1).groupby(states).sum()[['rows'] + list(QUALITY_CHECKS)]
+    by_state.index.name = 'STATE'
+    return {'flags': bits.sum(axis=1).astype(np.uint8), 'by_state': by_state, 'file_issues': list(file_issues)}
+
+
+def quality_summary(report):
+    """The report without its per-row flags: small enough to keep as its own cache entry."""
+    return {'by_state': report['by_state'], 'file_issues': report['file_issues']}
+
+
+def year_quality(df, file_issues):
+    """The summary kept as a year's 'quality' cache entry; every loader builds it here, so it reads the same
+    whichever of them ingests the year first."""
+    return quality_summary(quality_report(df, file_issues))
+
+
+def quality_counts(flags, rows=None):
+    """Failures of each check among flags[rows] (a mask or positions), or among all rows when rows is None."""
+    selected = flags if rows is None else flags[rows]
+    return {name: int(np.count_nonzero(selected & (1 << bit))) for bit, name in enumerate(QUALITY_CHECKS)}
+
+
+def quality_messages(report):
+    """(level, message) pairs for the sidebar: file-level issues, then states that could not be mapped."""
+    messages = list(report['file_issues'])
+    by_state = report['by_state']
+    unmapped = by_state.index[by_state['unmapped_state'] > 0].tolist()
+    if unmapped:
+        messages.append(('warning', f"⚠️ Unmapped states found: {unmapped}\n"
+                                    "ℹ️ *Note: This is likely due to missing data in the original NOAA dataset.*"))
+    return messages
+
+
+def quality_table(report):
+    """One row per check: its description, the rows failing it and their share of the year."""
+    totals = report['by_state'].sum()
+    rows = int(totals.get('rows', 0))
+    failing = [int(totals.get(name, 0)) for name in QUALITY_CHECKS]
+    return pd.DataFrame({
+        'check': list(QUALITY_CHECKS.values()),
+        'rows': failing,
+        'share': [n / rows if rows else 0.0 for n in failing],
+    })
+
+
+@storm_profiling.timed()
+def aggregate_state_stats(df):
+    # Dynamically ensure all US states are represented in the map
+    # regardless of whether they have tornadoes in the selected year
+    full_state_df = pd.DataFrame(
+        list(STATE_NAME_TO_FIPS.items()),
+        columns=["STATE", "STATE_FIPS"]
+    )
+    full_state_df["id"] = full_state_df["STATE_FIPS"]
+
+    # Aggregate tornado data per state
+    state_stats = df.groupby(["STATE", "STATE_FIPS"]).agg(
+        tornado_count=('TOR_F_SCALE', 'count'),
+        avg_intensity=('intensity', 'mean')
+    ).reset_index()
+
+    # Add `id` for merge
+    state_stats["id"] = state_stats["STATE_FIPS"]
+
+    # Merge to ensure all states are included
+    state_stats = pd.merge(
+        full_state_df,
+        state_stats,
+        on=["STATE", "STATE_FIPS", "id"],
+        how="left"
+    )
+    state_stats["tornado_count"] = state_stats["tornado_count"].fillna(0)
+    state_stats["avg_intensity"] = state_stats["avg_intensity"].fillna(0)
+    return state_stats
+
+
+@storm_profiling.timed()
+def aggregate_monthly_trends(df):
+    # Sums rather than means so states can be added up for "All States"
+    return df.groupby(["STATE", "month"]).agg(
+        count=('TOR_F_SCALE', 'count'),
+        intensity_sum=('intensity', 'sum'),
+        intensity_n=('intensity', 'count')
+    ).reset_index()
+
+
+@storm_profiling.timed()
+def aggregate_ef_counts(df):
+    return df.groupby(["STATE", "TOR_F_SCALE"]).size().reset_index(name="count")
+
+
+class StateRows:
+    """Row positions of every state in one year's frame, from the factorized STATE codes.
+
+    Any subset of states is then a gather: mask() looks the codes up in a small
+    per-state table, positions() concatenates precomputed slices of row numbers.
+    """
+
+    def __init__(self, states):
+        codes, self.states = pd.factorize(pd.Series(states), sort=True)  # missing STATE -> -1
+        self.codes = codes.astype(np.int16)
+        self.order = np.argsort(self.codes, kind='stable')
+        self.bounds = np.searchsorted(self.codes[self.order], np.arange(len(self.states) + 1))
+
+    def _codes_of(self, names):
+        codes = self.states.get_indexer(list(names))
+        return codes[codes >= 0]
+
+    def mask(self, names):
+        """Boolean mask of the rows in any of `names`."""
+        table = np.zeros(len(self.states) + 1, dtype=bool)  # the extra last slot is hit by code -1
+        table[self._codes_of(names)] = True
+        return table[self.codes]
+
+    def positions(self, names):
+        """Row positions of the rows in any of `names`, in frame order."""
+        parts = [self.order[self.bounds[c]:self.bounds[c + 1]] for c in self._codes_of(names)]
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def take(self, df, names):
+        return df.iloc[self.positions(names)]
+
+    def counts(self):
+        """Rows per state as a Series indexed by state."""
+        return pd.Series(np.diff(self.bounds), index=self.states)
+
+    def totals(self, values):
+        """Per-state sums of `values` (one per row of the frame) as a Series indexed by state."""
+        known = self.codes >= 0
+        sums = np.bincount(self.codes[known], weights=np.asarray(values, dtype=float)[known], minlength=len(self.states))
+        return pd.Series(sums, index=self.states)
+
+
+@storm_profiling.timed()
+def clean_year_data(files):
+    """Cleaned tornado rows of one year plus its aggregates; cached on disk as the 'year' entry."""
+    df, issues = read_detail_files(files)
+    if df.empty:
+        return {'df': df, 'state_stats': None, 'monthly_trends': None, 'ef_counts': None, 'state_rows': None,
+                'quality': quality_report(df, issues)}
+
+    df = clean_tornadoes(df)
+    return {
+        'df': df,
+        'state_rows': StateRows(df['STATE']),
+        'state_stats': aggregate_state_stats(df),
+        'monthly_trends': aggregate_monthly_trends(df),
+        'ef_counts': aggregate_ef_counts(df),
+        'quality': quality_report(df, issues),
+    }
+
+
+# ----- Year x state matrix for the animated map -----
+STATE_MATRIX_COLUMNS = ['STATE', 'TOR_F_SCALE']
+
+
+def state_year_stats(df, year):
+    """Tornado count and average intensity of all 50 states in one year: that year's rows of the matrix."""
+    df = df.assign(
+        intensity=df['TOR_F_SCALE'].str.extract(r'(\d+)', expand=False).astype(float),
+        STATE_FIPS=df['STATE'].map(STATE_NAME_TO_FIPS),
+    )
+    stats = aggregate_state_stats(df)
+    return pd.DataFrame({
+        'YEAR': year,
+        'id': stats['id'],
+        'STATE': stats['STATE'],
+        'tornado_count': stats['tornado_count'].astype(int),
+        'avg_intensity': stats['avg_intensity'].round(2),
+    })
+
+
+# ----- Multi-year heatmap aggregates -----
+HEATMAP_REQUIRED_COLUMNS = ['BEGIN_TIME', 'BEGIN_YEARMONTH', 'BEGIN_DAY', 'CZ_TIMEZONE', 'DAMAGE_PROPERTY',
+                            'DAMAGE_CROPS', 'INJURIES_INDIRECT', 'INJURIES_DIRECT', 'DEATHS_INDIRECT',
+                            'DEATHS_DIRECT', 'EVENT_ID']
+HEATMAP_METRICS = ['COUNT', 'DAMAGE_PROPERTY', 'DAMAGE_CROPS', 'INJURIES', 'DEATHS']
+# Which columns give month/hour/year for each heatmap clock
+HEATMAP_CLOCKS = {
+    'local': ('MONTH_NAME', 'HOUR', 'YEAR'),
+    'utc': ('MONTH_NAME_UTC', 'HOUR_UTC', 'YEAR_UTC'),
+}
+
+# UTC offsets of CZ_TIMEZONE codes without a number (older files); codes like 'CST-6' carry their own
+ZONE_OFFSETS = {
+    'AST': -4, 'EST': -5, 'EDT': -4, 'CST': -6, 'CDT': -5, 'MST': -7, 'MDT': -6, 'PST': -8, 'PDT': -7,
+    'AKST': -9, 'AKDT': -8, 'HST': -10, 'SST': -11, 'GST': 10, 'UTC': 0, 'GMT': 0,
+}
+DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def timezone_offsets(zones):
+    """UTC offset in hours for each CZ_TIMEZONE code ('CST-6' -> -6); unknown codes count as UTC.
+
+    Only the distinct codes are parsed; rows get their offset through the factorized codes.
+    """
+    codes, names = pd.factorize(zones.astype(str).str.strip().str.upper())
+    names = pd.Series(names, dtype=object)
+    table = names.str.extract(r'([+-]?\d+)$')[0].astype(float)
+    table = table.fillna(names.str.extract(r'^([A-Z]+)')[0].map(ZONE_OFFSETS)).fillna(0)
+    return np.append(table.to_numpy(dtype=int), 0)[codes]  # code -1 (missing) picks the trailing 0
+
+
+def add_utc_columns(df):
+    """HOUR_UTC, MONTH_UTC, YEAR_UTC and MONTH_NAME_UTC from the local time and CZ_TIMEZONE, in integer arithmetic."""
+    hours = df['HOUR'].to_numpy() - timezone_offsets(df['CZ_TIMEZONE'])
+    day_shift, hour = np.divmod(hours, 24)
+    year, month = df['YEAR'].to_numpy(), df['MONTH'].to_numpy()
+    day = df['BEGIN_DAY'].to_numpy() + day_shift
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = DAYS_IN_MONTH[month - 1] + ((month == 2) & leap)
+    month_index = month - 1 + (day > month_days) - (day < 1)
+    df['HOUR_UTC'] = hour
+    df['YEAR_UTC'] = year + month_index // 12
+    df['MONTH_UTC'] = month_index % 12 + 1
+    df['MONTH_NAME_UTC'] = pd.Categorical.from_codes(df['MONTH_UTC'] - 1, categories=MONTH_NAMES, ordered=True)
+    return df
+
+
+# Clean up damage fields: strings like "25.00M" -> 25000000.0
+def parse_damage(val):
+    try:
+        val = str(val).strip().upper()
+        if val.endswith("K"):
+            return float(val[:-1]) * 1e3
+        elif val.endswith("M"):
+            return float(val[:-1]) * 1e6
+        return float(val)
+    except:
+        return 0.0
+
+
+@storm_profiling.timed()
+def add_heatmap_columns(df):
+    """Derive HOUR/YEAR/MONTH/MONTH_NAME (local and UTC), parsed damage and total injuries/deaths in place."""
+    df['BEGIN_TIME'] = df['BEGIN_TIME'].astype(str).str.zfill(4)
+    df['HOUR'] = df['BEGIN_TIME'].str[:2].astype(int)
+    df['YEAR'] = df['BEGIN_YEARMONTH'].astype(str).str[:4].astype(int)
+    df['MONTH'] = df['BEGIN_YEARMONTH'].astype(str).str[4:].astype(int)
+    df['MONTH_NAME'] = pd.Categorical.from_codes(df['MONTH'] - 1, categories=MONTH_NAMES, ordered=True)
+    add_utc_columns(df)
+
+    with storm_profiling.span('parse_damage'):
+        df["DAMAGE_PROPERTY_PARSED"] = df["DAMAGE_PROPERTY"].apply(parse_damage)
+        df["DAMAGE_CROPS_PARSED"] = df["DAMAGE_CROPS"].apply(parse_damage)
+    df["INJURIES"] = df["INJURIES_INDIRECT"] + df["INJURIES_DIRECT"]
+    df["DEATHS"] = df["DEATHS_INDIRECT"] + df["DEATHS_DIRECT"]
+    return df
+
+
+@storm_profiling.timed()
+def fold_heatmap(df, clock='local'):
+    """Long-format (MONTH_NAME, HOUR, YEAR, metric, value) sums behind the heatmap, on the local or UTC clock."""
+    if clock != 'local':
+        df = df.assign(**dict(zip(HEATMAP_CLOCKS['local'], (df[col] for col in HEATMAP_CLOCKS[clock]))))
+    return df.groupby(['MONTH_NAME', 'HOUR', 'YEAR'], observed=False).agg(
+        COUNT=('EVENT_ID', 'count'),
+        DAMAGE_PROPERTY=('DAMAGE_PROPERTY_PARSED', 'sum'),
+        DAMAGE_CROPS=('DAMAGE_CROPS_PARSED', 'sum'),
+        INJURIES=('INJURIES', 'sum'),
+        DEATHS=('DEATHS', 'sum')
+    ).reset_index().melt(
+        id_vars=['MONTH_NAME', 'HOUR', 'YEAR'],
+        value_vars=HEATMAP_METRICS,
+        var_name='metric',
+        value_name='value'
+    )
@@ -0,0 +1,238 @@
+# storm_jobs.py
+# Background work for the dashboard. Nothing here touches Streamlit elements,
+# so jobs can run on worker threads outside the script run.
+
+import sys
+import types
+import itertools
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+
+class BackgroundJob:
+    """Run fn(report) on its own worker thread.
+
+    fn calls report(fraction, message) as it goes; readers poll `progress`,
+    `message` and `done()` from the script thread.
+    """
+
+    def __init__(self, fn, name='storm-job'):
+        self.progress = 0.0
+        self.message = 'Starting…'
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._future = executor.submit(fn, self._report)
+        executor.shutdown(wait=False)
+
+    def _report(self, fraction, message):
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+        self.message = message
+
+    def done(self):
+        return self._future.done()
+
+    def wait(self, timeout):
+        """Block for at most `timeout` seconds; returns done()."""
+        wait([self._future], timeout=timeout)
+        return self.done()
+
+    def result(self):
+        return self._future.result()
+
+
+def deep_bytes(value):
+    """Deep memory size of a value: DataFrames, Series, indexes and arrays, plus dicts, lists and tuples
+    of anything and the attributes of plain objects (StateRows, GridIndex and the like).
+
+    Objects reachable twice are counted twice, so this is an upper bound for shared data.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(deep_bytes(k) + deep_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(deep_bytes(v) for v in value)
+    if hasattr(value, '__dict__') and not isinstance(value, (type, types.ModuleType, types.FunctionType)):
+        return sys.getsizeof(value) + deep_bytes(vars(value))
+    return sys.getsizeof(value)
+
+
+# Global use counter, so entries can be compared for recency across caches
+_ticks = itertools.count()
+
+
+class ByteBudgetCache:
+    """Thread-safe LRU cache that evicts the least recently used entries past `max_bytes`.
+
+    `sizeof` measures a value (deep_bytes by default). Caches registered with
+    the same MemoryBudget are also trimmed, oldest entry first across all of
+    them, once their combined size passes the budget.
+    """
+
+    def __init__(self, max_bytes, sizeof=deep_bytes, budget=None):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes, last use tick)
+        self._computing = {}  # key -> lock held while get_or_compute() builds it
+        self._lock = threading.Lock()
+        if budget is not None:
+            budget.register(self)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            value, nbytes, _ = self._entries[key]
+            self._entries[key] = (value, nbytes, next(_ticks))
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        nbytes = self.sizeof(value)
+        limit = min(self.max_bytes, self.budget.max_bytes) if self.budget is not None else self.max_bytes
+        with self._lock:
+            self._entries.pop(key, None)
+            if nbytes > limit:
+                return  # would evict everything else and still not fit
+            self._entries[key] = (value, nbytes, next(_ticks))
+            while self._total_bytes() > self.max_bytes:
+                self._evict_oldest()
+        if self.budget is not None:
+            self.budget.enforce()
+
+    def get_or_compute(self, key, compute):
+        """Value for `key`, calling compute() on a miss; concurrent misses on one key compute it once."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            computing = self._computing.setdefault(key, threading.Lock())
+        with computing:
+            with self._lock:
+                entry = self._entries.get(key)  # filled by the thread we waited for; already counted as a miss
+            value = entry[0] if entry is not None else None
+            if value is None:
+                value = compute()
+                self.put(key, value)
+        with self._lock:
+            self._computing.pop(key, None)
+        return value
+
+    def total_bytes(self):
+        with self._lock:
+            return self._total_bytes()
+
+    def sizes(self):
+        """(key, nbytes) for every entry, least recently used first."""
+        with self._lock:
+            return [(key, nbytes) for key, (_, nbytes, _) in self._entries.items()]
+
+    def oldest_use(self):
+        with self._lock:
+            return next(iter(self._entries.values()))[2] if self._entries else None
+
+    def evict_oldest(self):
+        with self._lock:
+            if self._entries:
+                self._evict_oldest()
+
+    def _total_bytes(self):
+        return sum(nbytes for _, nbytes, _ in self._entries.values())
+
+    def _evict_oldest(self):
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+
+class MemoryBudget:
+    """One byte limit shared by several ByteBudgetCaches."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.caches = []
+        self._lock = threading.Lock()
+
+    def register(self, cache):
+        with self._lock:
+            self.caches.append(cache)
+
+    def total_bytes(self):
+        return sum(cache.total_bytes() for cache in self.caches)
+
+    def enforce(self):
+        """Evict the least recently used entry across all caches until the total fits."""
+        with self._lock:
+            while self.total_bytes() > self.max_bytes:
+                uses = [(cache.oldest_use(), cache) for cache in self.caches]
+                uses = [(tick, cache) for tick, cache in uses if tick is not None]
+                if not uses:
+                    break
+                min(uses, key=lambda use: use[0])[1].evict_oldest()
+
+
+class Prefetcher:
+    """Load keys into a ByteBudgetCache on a background thread ahead of use.
+
+    `load(key)` must be safe to call from a worker thread. The foreground path
+    goes through get_or_load(), which waits for an in-flight prefetch of the
+    same key instead of loading it twice.
+    """
+
+    def __init__(self, cache, load, max_workers=1):
+        self.cache = cache
+        self.load = load
+        self.requests = Counter()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+
+    def get_or_load(self, key):
+        self.requests[key] += 1
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None:
+            return future.result()
+        value = self.load(key)
+        self.cache.put(key, value)
+        return value
+
+    def popular(self, n):
+        return [key for key, _ in self.requests.most_common(n)]
+
+    def prefetch(self, keys):
+        """Queue loads for the keys that are neither cached nor in flight; never blocks."""
+        with self._lock:
+            for key in keys:
+                if key in self._pending or key in self.cache:
+                    continue
+                future = self._executor.submit(self._load, key)
+                self._pending[key] = future
+
+    def _load(self, key):
+        try:
+            value = self.load(key)
+            self.cache.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
@@ -0,0 +1,91 @@
+# storm_memory.py
+# Memory accounting for the dashboard: deep sizes of the frames each session
+# derives, process RSS, and tracemalloc snapshots taken on demand.
+#
+# Cached entries are sized by the caches themselves (storm_jobs.ByteBudgetCache);
+# this module covers what lives outside them. tracemalloc slows every
+# allocation in the process, so snapshots are only offered when
+# STORM_TRACEMALLOC=1 starts tracing at startup.
+
+import os
+import sys
+import time
+import threading
+import tracemalloc
+
+import pandas as pd
+
+from storm_jobs import deep_bytes
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TRACEMALLOC = os.environ.get('STORM_TRACEMALLOC') == '1'
+if TRACEMALLOC:
+    tracemalloc.start()
+
+
+class SessionMemory:
+    """Deep bytes of the frames each session built on its latest run, shared across sessions."""
+
+    def __init__(self, max_age=3600):
+        self.max_age = max_age
+        self._sessions = {}  # session id -> {frame name: (nbytes, recorded at)}
+        self._lock = threading.Lock()
+
+    def record(self, session, name, value):
+        nbytes = deep_bytes(value)
+        with self._lock:
+            self._sessions.setdefault(session, {})[name] = (nbytes, time.time())
+
+    def table(self):
+        """One row per session and frame; sessions silent for `max_age` seconds are dropped."""
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            for session in [s for s, frames in self._sessions.items()
+                            if max(at for _, at in frames.values()) < cutoff]:
+                del self._sessions[session]
+            rows = [(session, name, nbytes) for session, frames in self._sessions.items()
+                    for name, (nbytes, _) in frames.items()]
+        return pd.DataFrame(rows, columns=['session', 'frame', 'bytes'])
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None where the platform does not report it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, KiB on Linux
+
+
+_snapshot_lock = threading.Lock()
+_last_snapshot = None
+
+
+def snapshot_table(limit=20):
+    """Top allocation sites by size, with the change since the previous snapshot.
+
+    Needs STORM_TRACEMALLOC=1; returns None when allocations are not being traced.
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+    with _snapshot_lock:
+        previous, _last_snapshot = _last_snapshot, snapshot
+    if previous is None:
+        stats = snapshot.statistics('lineno')
+    else:
+        stats = snapshot.compare_to(previous, 'lineno')
+    rows = [{
+        'where': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+        'bytes': stat.size,
+        'change': getattr(stat, 'size_diff', stat.size),
+        'blocks': stat.count,
+    } for stat in stats[:limit]]
+    return pd.DataFrame(rows, columns=['where', 'bytes', 'change', 'blocks'])
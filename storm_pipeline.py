@@ -0,0 +1,280 @@
+# storm_pipeline.py
+# Offline, stage-based version of Narrative_Project.py.
+#
+#   ingest -> clean -> enrich -> aggregate    (per year, years run in parallel)
+#   render                                    (one page per output, run in parallel)
+#
+# Every stage output is cached on disk through storm_cache. A stage's key
+# covers the fingerprint of the source CSVs plus the code of that stage and
+# every stage before it (and storm_data.py, which they all call into), so
+# editing a chart only re-runs render and editing the cleaning code re-runs
+# clean onwards, while ingest stays cached until the CSVs change.
+#
+#   python storm_pipeline.py --years 2016 2017 --out build
+
+import os
+import time
+import hashlib
+import inspect
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import altair as alt
+
+import storm_data
+import storm_cache
+import storm_charts
+import export_heatmap
+
+STAGES = ['ingest', 'clean', 'enrich', 'aggregate', 'render']
+
+
+# ----- Stages -----
+def ingest(files):
+    return storm_data.read_detail_files(files)
+
+
+def clean(ingested):
+    df, issues = ingested
+    if df.empty:
+        return df, issues
+    df = storm_data.clean_tornadoes(df)
+    return df, storm_data.quality_messages(storm_data.quality_report(df, issues))
+
+
+def enrich(cleaned):
+    df, _ = cleaned
+    if df.empty:
+        return df
+    return storm_data.add_heatmap_columns(df.copy())
+
+
+def aggregate(enriched):
+    if enriched.empty:
+        return None
+    return {
+        'state_stats': storm_data.aggregate_state_stats(enriched),
+        'monthly_trends': storm_data.aggregate_monthly_trends(enriched),
+        'ef_counts': storm_data.aggregate_ef_counts(enriched),
+        'heatmap': storm_data.fold_heatmap(enriched),
+    }
+
+
+def state_overview_chart(df, year):
+    """The notebook's linked map / monthly / scatter / scale composition for one year."""
+    state_select = alt.selection_point(fields=['STATE'])
+    time_brush = alt.selection_interval(encodings=['x'])
+    state_tornado_stats = df.groupby(['STATE', 'STATE_FIPS']).agg(
+        tornado_count=('TOR_F_SCALE', 'count'),
+        avg_intensity=('intensity', 'mean'),
+        avg_length=('TOR_LENGTH', 'mean')
+    ).reset_index()
+    rows = df[['STATE', 'TOR_F_SCALE', 'TOR_LENGTH', 'TOR_WIDTH', 'BEGIN_DATE_TIME', 'intensity', 'month']]
+
+    map_chart = alt.Chart(alt.topo_feature(storm_charts.US_10M_URL, 'states')).mark_geoshape().encode(
+        color=alt.condition(
+            state_select,
+            alt.Color('tornado_count:Q', scale=alt.Scale(scheme='reds'), title='Tornado Count'),
+            alt.value('lightgray')
+        ),
+        stroke=alt.value('white'),
+        strokeWidth=alt.condition(state_select, alt.value(2), alt.value(0.5)),
+        tooltip=[
+            alt.Tooltip('state_name:N', title='State'),
+            alt.Tooltip('tornado_count:Q', title='Tornado Count'),
+            alt.Tooltip('avg_intensity:Q', title='Avg. Intensity', format='.1f')
+        ]
+    ).transform_lookup(
+        lookup='id',
+        from_=alt.LookupData(data=state_tornado_stats, key='STATE_FIPS',
+                             fields=['STATE', 'tornado_count', 'avg_intensity', 'avg_length'])
+    ).transform_calculate(
+        tornado_count='isValid(datum.tornado_count) ? datum.tornado_count : 0',
+        avg_intensity='isValid(datum.avg_intensity) ? datum.avg_intensity : 0',
+        state_name='isValid(datum.STATE) ? datum.STATE : "No Data"'
+    ).project(
+        type='albersUsa'
+    ).properties(
+        width=700, height=400, title=f'Tornado Events by State ({year}) - Click on states to select'
+    ).add_params(state_select)
+
+    intensity_chart = alt.Chart(rows).mark_line(point=True).encode(
+        x=alt.X('month:O', title='Month', axis=alt.Axis(labelAngle=0)),
+        y=alt.Y('average(intensity):Q', title='Average Tornado Intensity', scale=alt.Scale(domain=[0, 5])),
+        color=alt.value('orange'),
+        opacity=alt.condition(time_brush, alt.value(1), alt.value(0.7))
+    ).transform_filter(alt.datum.intensity > 0).transform_filter(state_select)
+
+    count_chart = alt.Chart(rows).mark_bar(opacity=0.5).encode(
+        x=alt.X('month:O', title='Month'),
+        y=alt.Y('count():Q', title='Number of Tornado Events', axis=alt.Axis(titleColor='steelblue')),
+        color=alt.value('steelblue')
+    ).transform_filter(state_select)
+
+    monthly_chart = alt.layer(intensity_chart, count_chart).resolve_scale(y='independent').properties(
+        width=700, height=200, title='Monthly Tornado Intensity & Event Count - Drag to select time range'
+    ).add_params(time_brush)
+
+    scatter_chart = alt.Chart(rows).mark_circle().encode(
+        x=alt.X('TOR_LENGTH:Q', title='Tornado Length (miles)'),
+        y=alt.Y('TOR_WIDTH:Q', title='Tornado Width (yards)'),
+        size=alt.Size('intensity:Q', scale=alt.Scale(range=[50, 300]), title='Intensity'),
+        color=alt.Color('TOR_F_SCALE:N', title='Tornado Scale', scale=alt.Scale(scheme='viridis')),
+        opacity=alt.condition(state_select, alt.value(0.8), alt.value(0.2)),
+        tooltip=[
+            alt.Tooltip('STATE:N', title='State'),
+            alt.Tooltip('TOR_F_SCALE:N', title='F Scale'),
+            alt.Tooltip('TOR_LENGTH:Q', title='Length (miles)', format='.2f'),
+            alt.Tooltip('TOR_WIDTH:Q', title='Width (yards)', format='.2f'),
+            alt.Tooltip('BEGIN_DATE_TIME:T', title='Date/Time')
+        ]
+    ).transform_filter(state_select).transform_filter(time_brush).properties(
+        width=350, height=300, title='Tornado Characteristics'
+    )
+
+    scale_chart = alt.Chart(rows).mark_bar().encode(
+        x=alt.X('TOR_F_SCALE:N', title='Tornado Scale'),
+        y=alt.Y('count():Q', title='Number of Tornadoes'),
+        color=alt.Color('TOR_F_SCALE:N', title='Tornado Scale', scale=alt.Scale(scheme='viridis')),
+        opacity=alt.condition(state_select, alt.value(1), alt.value(0.2))
+    ).transform_filter(state_select).transform_filter(time_brush).properties(
+        width=350, height=300, title='Tornado Counts by Scale'
+    )
+
+    no_data_text = alt.Chart(pd.DataFrame([{'text': 'Click on states in the map to see data'}])).mark_text(
+        fontSize=15, font='Arial', align='center', baseline='middle'
+    ).encode(text='text:N').transform_filter(~state_select)
+
+    return alt.vconcat(
+        map_chart,
+        alt.layer(monthly_chart, no_data_text),
+        alt.hconcat(scatter_chart, scale_chart)
+    ).resolve_scale(color=alt.ResolveMode('independent')).configure_view(stroke=None)
+
+
+def render_states(enriched, year):
+    return state_overview_chart(enriched, year).to_html()
+
+
+def render_heatmap(folded):
+    return export_heatmap.precomputed_layout(folded).to_html()
+
+
+# ----- Runner -----
+def code_hash(*objects):
+    h = hashlib.sha1()
+    for obj in objects:
+        h.update(inspect.getsource(obj).encode())
+    return h.hexdigest()[:12]
+
+
+class Pipeline:
+    """Runs the stages for a set of years, loading each output from disk when its key still matches."""
+
+    def __init__(self, years, jobs=4, force=()):
+        self.years = years
+        self.jobs = jobs
+        # Forcing a stage also forces everything downstream of it
+        self.force = set(STAGES[min(STAGES.index(name) for name in force):]) if force else set()
+        self._print_lock = threading.Lock()
+        # Stage code keys: each stage also depends on the code of the stages before it
+        year_chain = [ingest, clean, enrich, aggregate]
+        base = code_hash(storm_data)
+        self.code = {
+            fn.__name__: base + code_hash(*year_chain[:i + 1])
+            for i, fn in enumerate(year_chain)
+        }
+        self.code['render'] = self.code['aggregate'] + code_hash(state_overview_chart, render_states,
+                                                             render_heatmap, export_heatmap)
+
+    def log(self, message):
+        with self._print_lock:
+            print(message)
+
+    def stage(self, name, files, compute, *parts):
+        start = time.perf_counter()
+        key = (name, self.code[name]) + parts
+        value = None if name in self.force else storm_cache.load('pipeline', files, *key)
+        status = 'cached'
+        if value is None:
+            value = storm_cache.store(compute(), 'pipeline', files, *key)
+            status = 'computed'
+        self.log(f"  {name:<10}{' '.join(map(str, parts)):<16}{status:<10}{time.perf_counter() - start:6.2f}s")
+        return value
+
+    def run_year(self, year, until):
+        files = storm_data.year_files(year)
+        if not files:
+            self.log(f"  no files for {year}, skipping")
+            return None
+        out = {}
+        out['ingest'] = self.stage('ingest', files, lambda: ingest(files), year)
+        if until == 'ingest':
+            return out
+        out['clean'] = self.stage('clean', files, lambda: clean(out['ingest']), year)
+        for level, message in out['clean'][1]:
+            self.log(f"  {level}: {message.splitlines()[0]}")
+        if until == 'clean':
+            return out
+        out['enrich'] = self.stage('enrich', files, lambda: enrich(out['clean']), year)
+        if until == 'enrich':
+            return out
+        out['aggregate'] = self.stage('aggregate', files, lambda: aggregate(out['enrich']), year)
+        return out
+
+    def run(self, until='render', out_dir='build'):
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            results = dict(zip(self.years, pool.map(lambda y: self.run_year(y, until), self.years)))
+        results = {year: out for year, out in results.items() if out is not None}
+        if until != 'render':
+            return results
+
+        os.makedirs(out_dir, exist_ok=True)
+        tasks = []
+        for year, out in results.items():
+            if out['aggregate'] is None:
+                continue
+            files = storm_data.year_files(year)
+            tasks.append((f'states_{year}.html', files,
+                          lambda out=out, year=year: render_states(out['enrich'], year), ('states', year)))
+
+        folds = [out['aggregate']['heatmap'] for out in results.values() if out['aggregate'] is not None]
+        if folds:
+            all_files = [file for year in results for file in storm_data.year_files(year)]
+            folded = pd.concat(folds, ignore_index=True)
+            tasks.append(('heatmap.html', all_files, lambda: render_heatmap(folded), ('heatmap',)))
+
+        def render(task):
+            filename, files, compute, parts = task
+            html = self.stage('render', files, compute, *parts)
+            path = os.path.join(out_dir, filename)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(html)
+            return path
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            return list(pool.map(render, tasks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the cached ingest -> clean -> enrich -> aggregate -> render pipeline.")
+    parser.add_argument('--years', type=int, nargs='+', default=storm_data.YEARS, help="years to process (default: all)")
+    parser.add_argument('--until', choices=STAGES, default='render', help="last stage to run (default: render)")
+    parser.add_argument('--force', choices=STAGES, nargs='+', default=[], help="recompute these stages even when cached")
+    parser.add_argument('--jobs', type=int, default=4, help="parallel workers (default: 4)")
+    parser.add_argument('--out', default='build', help="folder for rendered pages (default: build)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pipeline = Pipeline(args.years, jobs=args.jobs, force=args.force)
+    result = pipeline.run(until=args.until, out_dir=args.out)
+    if args.until == 'render':
+        for path in result:
+            print(f"Wrote {path}")
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
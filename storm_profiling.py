@@ -0,0 +1,122 @@
+# storm_profiling.py
+# Lightweight span timing for the dashboard and its loaders.
+#
+# span() records a name, start offset, duration and nesting depth into the
+# trace that is active on the current thread; the dashboard opens one trace
+# per script run (and per fragment-only rerun). Work on threads without a
+# trace, such as prefetching and the heatmap job, goes to the BACKGROUND ring
+# buffer instead. Set STORM_PROFILE_JSONL to a file path to append every
+# finished span there as one JSON object per line.
+
+import os
+import json
+import time
+import uuid
+import threading
+import functools
+import contextlib
+import contextvars
+from collections import deque
+
+JSONL_PATH = os.environ.get('STORM_PROFILE_JSONL')
+
+BACKGROUND = deque(maxlen=500)
+
+_trace = contextvars.ContextVar('storm_trace', default=None)
+_depth = contextvars.ContextVar('storm_span_depth', default=0)
+_jsonl_lock = threading.Lock()
+
+
+class Trace:
+    """Spans recorded during one script or fragment run."""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.spans = []
+        self._origin = time.perf_counter()
+
+    def offset_ms(self, t):
+        return (t - self._origin) * 1e3
+
+    def jsonl(self):
+        return ''.join(json.dumps(span, default=str) + '\n' for span in self.spans)
+
+
+def _export(spans):
+    if not JSONL_PATH or not spans:
+        return
+    with _jsonl_lock, open(JSONL_PATH, 'a', encoding='utf-8') as f:
+        for span in spans:
+            f.write(json.dumps(span, default=str) + '\n')
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Time the enclosed block; the yielded dict can take extra attributes while the span is open."""
+    trace = _trace.get()
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    record = {'name': name, 'depth': depth, **attrs}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        end = time.perf_counter()
+        _depth.reset(token)
+        record['duration_ms'] = (end - start) * 1e3
+        if trace is not None:
+            record['trace'] = trace.id
+            record['start_ms'] = trace.offset_ms(start)
+            trace.spans.append(record)
+        else:
+            record['thread'] = threading.current_thread().name
+            record['at'] = time.time()
+            BACKGROUND.append(record)
+            _export([record])
+
+
+def timed(name=None):
+    """Decorator form of span(), named after the function unless `name` is given."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name or fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def begin(name):
+    """Start a trace on this thread, replacing any trace left open by an interrupted run."""
+    trace = Trace(name)
+    _trace.set(trace)
+    _depth.set(0)
+    return trace
+
+
+def end(trace):
+    trace.duration_ms = trace.offset_ms(time.perf_counter())
+    if _trace.get() is trace:
+        _trace.set(None)
+    _export(trace.spans)
+    return trace
+
+
+def traced(name, on_finish):
+    """Decorator for fragments: a span inside an active trace, otherwise a trace of its own passed to on_finish."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _trace.get() is not None:
+                with span(name):
+                    return fn(*args, **kwargs)
+            trace = begin(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                on_finish(end(trace))
+        return wrapper
+    return decorate
@@ -0,0 +1,145 @@
+# storm_rankings.py
+# Record tornadoes: top-N by deaths, injuries, property damage, length and width
+# for any year range and state, without sorting the full frames.
+#
+# While a year is ingested, the top TOP_K tornadoes of every (state, metric)
+# are picked with np.argpartition and saved as a small .npz under
+# .cache/rankings/. Layout:
+#   states            - sorted unique STATE values
+#   <col>             - one array per ROW_COLUMNS entry, the candidate rows
+#   <metric>_offsets  - candidates of states[i] are <metric>_rows[offsets[i]:offsets[i + 1]]
+#   <metric>_rows     - row numbers into the candidate table, highest value first
+# A query takes the first N of each (year, state) list, narrows each year to its
+# best N with argpartition, and merges the sorted per-year lists with heapq.merge,
+# stopping after N.
+
+import heapq
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import storm_data
+
+TOP_K = 25
+# Bump whenever build_candidates changes the saved layout or its contents
+CANDIDATES_VERSION = 1
+
+# metric -> label; DEATHS, INJURIES and DAMAGE_PROPERTY are derived in rank_values()
+RANK_METRICS = {
+    'DEATHS': 'Deaths',
+    'INJURIES': 'Injuries',
+    'DAMAGE_PROPERTY': 'Property damage ($)',
+    'TOR_LENGTH': 'Path length (miles)',
+    'TOR_WIDTH': 'Path width (yards)',
+}
+ROW_COLUMNS = ['EVENT_ID', 'YEAR', 'STATE', 'BEGIN_DATE_TIME', 'CZ_NAME', 'TOR_F_SCALE'] + list(RANK_METRICS)
+RANK_COLUMNS = ['EVENT_ID', 'BEGIN_YEARMONTH', 'STATE', 'BEGIN_DATE_TIME', 'CZ_NAME', 'TOR_F_SCALE',
+                'DEATHS_DIRECT', 'DEATHS_INDIRECT', 'INJURIES_DIRECT', 'INJURIES_INDIRECT', 'DAMAGE_PROPERTY',
+                'TOR_LENGTH', 'TOR_WIDTH']
+
+
+def rank_values(df):
+    """Frame of ROW_COLUMNS for tornado rows, with totals and parsed damage filled in."""
+    return pd.DataFrame({
+        'EVENT_ID': df['EVENT_ID'].to_numpy(dtype=np.int64),
+        'YEAR': (df['BEGIN_YEARMONTH'] // 100).to_numpy(dtype=np.int64),
+        'STATE': df['STATE'].fillna('').astype(str).to_numpy(),
+        'BEGIN_DATE_TIME': df['BEGIN_DATE_TIME'].fillna('').astype(str).to_numpy(),
+        'CZ_NAME': df['CZ_NAME'].fillna('').astype(str).to_numpy(),
+        'TOR_F_SCALE': df['TOR_F_SCALE'].fillna('').astype(str).to_numpy(),
+        'DEATHS': (df['DEATHS_DIRECT'] + df['DEATHS_INDIRECT']).to_numpy(dtype=float),
+        'INJURIES': (df['INJURIES_DIRECT'] + df['INJURIES_INDIRECT']).to_numpy(dtype=float),
+        'DAMAGE_PROPERTY': df['DAMAGE_PROPERTY'].map(storm_data.parse_damage).to_numpy(dtype=float),
+        'TOR_LENGTH': pd.to_numeric(df['TOR_LENGTH'], errors='coerce').to_numpy(dtype=float),
+        'TOR_WIDTH': pd.to_numeric(df['TOR_WIDTH'], errors='coerce').to_numpy(dtype=float),
+    })
+
+
+def top_k_rows(values, k):
+    """Positions of the k largest positive values, largest first."""
+    candidates = np.flatnonzero(values > 0)  # also drops NaN
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-values[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-values[candidates], kind='stable')]
+
+
+def build_candidates(df, k=TOP_K):
+    """Per-(state, metric) top-k candidate arrays for one year of tornado rows."""
+    rows = rank_values(df)
+    order = np.argsort(rows['STATE'].to_numpy(), kind='stable')
+    rows = rows.iloc[order].reset_index(drop=True)
+    states, starts = np.unique(rows['STATE'].to_numpy(), return_index=True)
+    bounds = np.append(starts, len(rows))
+
+    picked = {}
+    keep = set()
+    for metric in RANK_METRICS:
+        values = rows[metric].to_numpy()
+        picked[metric] = [lo + top_k_rows(values[lo:hi], k) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        keep.update(int(i) for group in picked[metric] for i in group)
+
+    # Only rows that made some list are stored; renumber the picks to match
+    keep = np.array(sorted(keep), dtype=np.int64)
+    renumber = np.full(len(rows), -1, dtype=np.int64)
+    renumber[keep] = np.arange(len(keep))
+    out = {'states': states.astype(str)}
+    for col in ROW_COLUMNS:
+        column = rows[col].to_numpy()[keep]
+        out[col] = column.astype(str) if column.dtype == object else column
+    for metric, groups in picked.items():
+        out[f'{metric}_offsets'] = np.cumsum([0] + [len(g) for g in groups]).astype(np.int64)
+        out[f'{metric}_rows'] = renumber[np.concatenate(groups)] if groups else np.zeros(0, dtype=np.int64)
+    return out
+
+
+def candidates_path(files):
+    return storm_data.artifact_path('rankings', files, CANDIDATES_VERSION, f'k{TOP_K}')
+
+
+def ensure_candidates(df, files):
+    """Write the candidate lists for `files` unless an up-to-date file is already on disk."""
+    return storm_data.ensure_artifact(candidates_path(files), lambda: build_candidates(df))
+
+
+class Rankings:
+    """Read-only view over the saved candidate lists of one or more years."""
+
+    def __init__(self, paths):
+        self.parts = []
+        for path in paths:
+            with np.load(path, allow_pickle=False) as npz:
+                part = {k: npz[k] for k in npz.files}
+            part['year'] = int(part['YEAR'][0]) if len(part['YEAR']) else None
+            self.parts.append(part)
+
+    def top(self, metric, n=10, year_range=None, state=None):
+        """Top n tornadoes by `metric` as a DataFrame of ROW_COLUMNS, highest first."""
+        if n > TOP_K:
+            raise ValueError(f"n can be at most {TOP_K}, the number of candidates kept per year and state")
+        lists = []
+        for p, part in enumerate(self.parts):
+            if part['year'] is None or (year_range and not year_range[0] <= part['year'] <= year_range[1]):
+                continue
+            offsets, rows = part[f'{metric}_offsets'], part[f'{metric}_rows']
+            groups = np.arange(len(part['states']))
+            if state is not None:
+                groups = groups[part['states'] == state]
+            # Only the first n of each state's list can still win; narrow those to the year's best n
+            starts = offsets[groups]
+            lengths = np.minimum(offsets[groups + 1] - starts, n)
+            ends = np.cumsum(lengths)
+            heads = rows[np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)]
+            keys = -part[metric][heads]
+            if len(heads) > n:
+                pick = np.argpartition(keys, n - 1)[:n]
+                heads, keys = heads[pick], keys[pick]
+            order = np.argsort(keys, kind='stable')
+            # (-value, part, row) tuples, ascending, so heapq.merge yields the highest values first
+            lists.append(zip(keys[order].tolist(), itertools.repeat(p), heads[order].tolist()))
+
+        best = list(itertools.islice(heapq.merge(*lists), n))
+        return pd.DataFrame(
+            [{col: self.parts[p][col][row].item() for col in ROW_COLUMNS} for _, p, row in best],
+            columns=ROW_COLUMNS,
+        )
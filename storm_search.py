@@ -0,0 +1,100 @@
+# storm_search.py
+# Inverted index over EVENT_NARRATIVE / EPISODE_NARRATIVE tokens -> EVENT_ID postings.
+#
+# One index is built per year while that year is ingested and saved as a
+# compressed .npz under .cache/search/. Layout (CSR style):
+#   tokens   - sorted unique tokens
+#   offsets  - postings for tokens[i] are postings[offsets[i]:offsets[i + 1]]
+#   postings - sorted EVENT_IDs per token
+#   doc_ids / doc_states - every indexed EVENT_ID (sorted) and its STATE
+
+import re
+
+import numpy as np
+import pandas as pd
+
+import storm_data
+
+TEXT_COLUMNS = ['EVENT_NARRATIVE', 'EPISODE_NARRATIVE']
+TOKEN_PATTERN = r'[a-z0-9]+'
+# "EF-4", "EF 4" and "EF4" all index as "ef4"
+EF_PATTERN = r'\b(e?f)[\s-]+(\d)\b'
+STOPWORDS = {'a', 'an', 'and', 'at', 'by', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'was', 'with'}
+
+# Bump whenever build_index changes the saved layout or its contents
+INDEX_VERSION = 1
+
+
+def tokenize(text):
+    text = re.sub(EF_PATTERN, r'\1\2', str(text).lower())
+    return [t for t in re.findall(TOKEN_PATTERN, text) if t not in STOPWORDS]
+
+
+def build_index(df):
+    """Build the postings arrays for a frame of tornado events."""
+    cols = [c for c in TEXT_COLUMNS if c in df.columns]
+    text = df[cols].fillna('').astype(str).agg(' '.join, axis=1) if cols else pd.Series('', index=df.index)
+    tokens = (
+        text.str.lower()
+        .str.replace(EF_PATTERN, r'\1\2', regex=True)
+        .str.findall(TOKEN_PATTERN)
+    )
+
+    pairs = pd.DataFrame({'token': tokens, 'EVENT_ID': df['EVENT_ID'].to_numpy()}).explode('token')
+    pairs = pairs[pairs['token'].notna() & ~pairs['token'].isin(STOPWORDS)]
+    pairs = pairs.drop_duplicates().sort_values(['token', 'EVENT_ID'])
+
+    vocab, starts = np.unique(pairs['token'].to_numpy().astype(str), return_index=True)
+    docs = df[['EVENT_ID', 'STATE']].drop_duplicates('EVENT_ID').sort_values('EVENT_ID')
+    return {
+        'tokens': vocab,
+        'offsets': np.append(starts, len(pairs)).astype(np.int64),
+        'postings': pairs['EVENT_ID'].to_numpy(dtype=np.int64),
+        'doc_ids': docs['EVENT_ID'].to_numpy(dtype=np.int64),
+        'doc_states': docs['STATE'].to_numpy().astype(str),
+    }
+
+
+def index_path(files):
+    return storm_data.artifact_path('search', files, INDEX_VERSION)
+
+
+def ensure_index(df, files):
+    """Write the index for `files` unless an up-to-date one is already on disk."""
+    return storm_data.ensure_artifact(index_path(files), lambda: build_index(df), compressed=True)
+
+
+class SearchIndex:
+    """Read-only view over one or more saved yearly indexes."""
+
+    def __init__(self, paths):
+        self.parts = []
+        for path in paths:
+            with np.load(path, allow_pickle=False) as npz:
+                self.parts.append({k: npz[k] for k in npz.files})
+
+    def _postings(self, part, token):
+        i = np.searchsorted(part['tokens'], token)
+        if i == len(part['tokens']) or part['tokens'][i] != token:
+            return part['postings'][:0]
+        return part['postings'][part['offsets'][i]:part['offsets'][i + 1]]
+
+    def search(self, query, state=None):
+        """EVENT_IDs whose narratives contain every query term, optionally within one state."""
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return np.array([], dtype=np.int64)
+
+        hits = []
+        for part in self.parts:
+            lists = sorted((self._postings(part, t) for t in terms), key=len)
+            ids = lists[0]
+            for other in lists[1:]:
+                if len(ids) == 0:
+                    break
+                ids = np.intersect1d(ids, other, assume_unique=True)
+            if state is not None and len(ids):
+                pos = np.searchsorted(part['doc_ids'], ids)
+                ids = ids[part['doc_states'][pos] == state]
+            hits.append(ids)
+        return np.concatenate(hits) if hits else np.array([], dtype=np.int64)
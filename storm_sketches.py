@@ -0,0 +1,151 @@
+# storm_sketches.py
+# Mergeable quantile sketches of damage and tornado size, for percentile
+# tooltips and summaries over any year range and state selection.
+#
+# The sketch is DDSketch-style: a positive value x lands in log bucket
+# ceil(log(x) / log(GAMMA)), and zeros get a bucket of their own. Any quantile
+# read back from the bucket counts is within RELATIVE_ERROR of the exact one,
+# and two sketches merge by adding their counts, so a selection's sketch is
+# one bincount over the stored buckets of the (year, state, month) groups it
+# covers (per key, for tooltips that need one sketch per state or month).
+#
+# One sketch file per year is written while the year is ingested, as a .npz
+# under .cache/sketches/ with sparse (state, month, bucket, count) rows per metric:
+#   states                             - sorted unique STATE values
+#   <metric>_state / _month / _bucket  - group and bucket of each row
+#   <metric>_count                     - tornadoes in that group and bucket
+
+
+import numpy as np
+import pandas as pd
+
+import storm_data
+
+SKETCH_METRICS = {
+    'DAMAGE_PROPERTY': 'Property damage ($)',
+    'DAMAGE_CROPS': 'Crop damage ($)',
+    'TOR_LENGTH': 'Path length (miles)',
+    'TOR_WIDTH': 'Path width (yards)',
+}
+SKETCH_COLUMNS = ['BEGIN_YEARMONTH', 'STATE'] + list(SKETCH_METRICS)
+
+RELATIVE_ERROR = 0.01
+GAMMA = (1 + RELATIVE_ERROR) / (1 - RELATIVE_ERROR)
+ZERO_BUCKET = np.iinfo(np.int16).min
+
+# Bump whenever build_sketches changes the saved layout or its contents
+SKETCH_VERSION = 1
+
+
+def metric_values(df, metric):
+    if metric.startswith('DAMAGE_'):
+        return df[metric].map(storm_data.parse_damage).to_numpy(dtype=float)
+    return pd.to_numeric(df[metric], errors='coerce').to_numpy(dtype=float)
+
+
+def buckets(values):
+    """Bucket index of each value; zeros and negatives share ZERO_BUCKET."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index = np.ceil(np.log(values) / np.log(GAMMA))
+    return np.where(values > 0, index, ZERO_BUCKET).astype(np.int16)
+
+
+def bucket_values(index):
+    """Representative value of each bucket, within RELATIVE_ERROR of every value in it."""
+    return np.where(index == ZERO_BUCKET, 0.0, 2 * GAMMA ** index.astype(float) / (GAMMA + 1))
+
+
+def build_sketches(df):
+    """Sparse per-(state, month) bucket counts of every SKETCH_METRICS column for one year of tornado rows."""
+    states, state_index = np.unique(df['STATE'].fillna('').astype(str).to_numpy(), return_inverse=True)
+    month = (df['BEGIN_YEARMONTH'] % 100).to_numpy(dtype=np.int8)
+    out = {'states': states.astype(str)}
+    for metric in SKETCH_METRICS:
+        values = metric_values(df, metric)
+        known = ~np.isnan(values)
+        rows = pd.DataFrame({
+            'state': state_index[known].astype(np.int16),
+            'month': month[known],
+            'bucket': buckets(values[known]),
+        }).value_counts().reset_index()
+        out[f'{metric}_state'] = rows['state'].to_numpy(dtype=np.int16)
+        out[f'{metric}_month'] = rows['month'].to_numpy(dtype=np.int8)
+        out[f'{metric}_bucket'] = rows['bucket'].to_numpy(dtype=np.int16)
+        out[f'{metric}_count'] = rows['count'].to_numpy(dtype=np.int32)
+    return out
+
+
+def sketches_path(files):
+    return storm_data.artifact_path('sketches', files, SKETCH_VERSION)
+
+
+def ensure_sketches(df, files):
+    """Write the sketches for `files` unless an up-to-date file is already on disk."""
+    return storm_data.ensure_artifact(sketches_path(files), lambda: build_sketches(df))
+
+
+class QuantileSketches:
+    """Read-only view over the saved sketches of one or more years, concatenated per metric."""
+
+    def __init__(self, paths):
+        # paths: {year: sketch file}
+        parts = {}
+        for year, path in paths.items():
+            with np.load(path, allow_pickle=False) as npz:
+                parts[year] = {k: npz[k] for k in npz.files}
+        self.states = np.unique(np.concatenate([part['states'] for part in parts.values()] or [np.array([], str)]))
+
+        self.tables = {}
+        for metric in SKETCH_METRICS:
+            columns = {'YEAR': [], 'STATE': [], 'month': [], 'bucket': [], 'count': []}
+            for year, part in parts.items():
+                to_global = np.searchsorted(self.states, part['states'])
+                columns['YEAR'].append(np.full(len(part[f'{metric}_count']), year))
+                columns['STATE'].append(to_global[part[f'{metric}_state']])
+                columns['month'].append(part[f'{metric}_month'])
+                columns['bucket'].append(part[f'{metric}_bucket'])
+                columns['count'].append(part[f'{metric}_count'])
+            table = {k: np.concatenate(v) if v else np.zeros(0, dtype=int) for k, v in columns.items()}
+
+            # Dense slots for bincount: slot 0 is the zero bucket, then every bucket from the lowest seen up
+            positive = table['bucket'] != ZERO_BUCKET
+            low = int(table['bucket'][positive].min()) if positive.any() else 0
+            high = int(table['bucket'][positive].max()) if positive.any() else 0
+            table['slot'] = np.where(positive, table['bucket'].astype(np.int64) - low + 1, 0)
+            table['slot_values'] = np.append(0.0, bucket_values(np.arange(low, high + 1)))
+            self.tables[metric] = table
+
+    def quantiles_by(self, metric, key, qs, year_range=None, state=None, months=None):
+        """One row per value of `key` ('YEAR', 'STATE', 'month' or None for one row) with a p<q> column per q.
+
+        `state` may be one state name or a list of them.
+        """
+        table = self.tables[metric]
+        keep = np.ones(len(table['count']), dtype=bool)
+        if year_range is not None:
+            keep &= (table['YEAR'] >= year_range[0]) & (table['YEAR'] <= year_range[1])
+        if state is not None:
+            names = np.atleast_1d(state)
+            names = names[np.isin(names, self.states)]
+            keep &= np.isin(table['STATE'], np.searchsorted(self.states, names))
+        if months is not None:
+            keep &= np.isin(table['month'], months)
+
+        keys = table[key][keep] if key else np.zeros(keep.sum(), dtype=int)
+        key_values, key_index = np.unique(keys, return_inverse=True)
+        width = len(table['slot_values'])
+        merged = np.bincount(key_index * width + table['slot'][keep], weights=table['count'][keep],
+                             minlength=len(key_values) * width).reshape(len(key_values), width)
+        cumulative = merged.cumsum(axis=1)
+        ranks = np.asarray(qs)[None, :] * (cumulative[:, -1:] - 1)
+        slots = (cumulative[:, None, :] > ranks[:, :, None]).argmax(axis=2)
+
+        out = pd.DataFrame(table['slot_values'][slots], columns=[f'p{round(q * 100):g}' for q in qs])
+        if key:
+            out.insert(0, key, self.states[key_values] if key == 'STATE' else key_values)
+        return out
+
+    def quantiles(self, metric, qs, year_range=None, state=None, months=None):
+        """Quantiles qs of `metric` over the whole selection; NaN when it is empty."""
+        out = self.quantiles_by(metric, None, qs, year_range, state, months)
+        return out.iloc[0].to_numpy() if len(out) else np.full(len(qs), np.nan)
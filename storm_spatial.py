@@ -0,0 +1,221 @@
+# storm_spatial.py
+# Spatial aggregation helpers for tornado coordinates (BEGIN_LAT/BEGIN_LON, END_LAT/END_LON).
+
+import numpy as np
+import pandas as pd
+
+import storm_data
+
+LAT_RANGE = storm_data.US_LAT_RANGE
+LON_RANGE = storm_data.US_LON_RANGE
+
+# Grid cell size in degrees for each zoom level
+ZOOM_LEVELS = {
+    'National (2°)': 2.0,
+    'Regional (1°)': 1.0,
+    'Local (0.5°)': 0.5,
+}
+
+
+def touchdown_density(lat, lon, cell_deg):
+    """2-D histogram of touchdown points; returns only the non-empty cells."""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    ok = np.isfinite(lat) & np.isfinite(lon)
+
+    lat_edges = np.arange(LAT_RANGE[0], LAT_RANGE[1] + cell_deg, cell_deg)
+    lon_edges = np.arange(LON_RANGE[0], LON_RANGE[1] + cell_deg, cell_deg)
+    counts, _, _ = np.histogram2d(lat[ok], lon[ok], bins=[lat_edges, lon_edges])
+
+    i, j = np.nonzero(counts)
+    return pd.DataFrame({
+        'lat': lat_edges[i] + cell_deg / 2,
+        'lon': lon_edges[j] + cell_deg / 2,
+        'count': counts[i, j].astype(int),
+    })
+
+
+def density_cells(density, cell_deg):
+    """touchdown_density() rows as GeoJSON features, one lon/lat polygon per grid cell, for mark_geoshape.
+
+    Rings run clockwise as d3-geo expects, so each polygon is the cell and not its complement.
+    """
+    half = cell_deg / 2
+    geometry = [
+        {'type': 'Polygon', 'coordinates': [[[lon - half, lat - half], [lon - half, lat + half],
+                                             [lon + half, lat + half], [lon + half, lat - half],
+                                             [lon - half, lat - half]]]}
+        for lat, lon in zip(density['lat'].tolist(), density['lon'].tolist())
+    ]
+    return density.assign(type='Feature', geometry=geometry)
+
+
+def density_levels(df):
+    """Touchdown density for every zoom level, keyed like ZOOM_LEVELS."""
+    return {
+        name: touchdown_density(df['BEGIN_LAT'], df['BEGIN_LON'], cell_deg)
+        for name, cell_deg in ZOOM_LEVELS.items()
+    }
+
+
+# Level-of-detail policy for track rendering: at national zoom only the
+# long or strong tracks are drawn, a state selection shows every track in it.
+TRACK_MIN_LENGTH = 10.0  # miles
+TRACK_MIN_EF = 2
+
+TRACK_COLUMNS = ['STATE', 'TOR_F_SCALE', 'TOR_LENGTH', 'TOR_WIDTH', 'BEGIN_LAT', 'BEGIN_LON', 'END_LAT', 'END_LON']
+
+
+def track_segments(df, thin=True):
+    """Begin/end segments of the tracks in df; thin=True keeps only long or strong ones, for the national view."""
+    tracks = df[TRACK_COLUMNS].dropna(subset=['BEGIN_LAT', 'BEGIN_LON'])
+    tracks = tracks.assign(
+        END_LAT=tracks['END_LAT'].fillna(tracks['BEGIN_LAT']),
+        END_LON=tracks['END_LON'].fillna(tracks['BEGIN_LON']),
+    )
+
+    if not thin:
+        return tracks.reset_index(drop=True)
+
+    ef = pd.to_numeric(tracks['TOR_F_SCALE'].str.extract(r'(\d)', expand=False), errors='coerce')
+    keep = (tracks['TOR_LENGTH'] >= TRACK_MIN_LENGTH) | (ef >= TRACK_MIN_EF)
+    return tracks[keep].reset_index(drop=True)
+
+
+def state_tracks(df):
+    """Track segments of one year, precomputed at ingest: the thinned national set plus every track per state."""
+    tracks = track_segments(df, thin=False)
+    return {
+        'national': track_segments(df, thin=True),
+        'states': {state: rows.reset_index(drop=True) for state, rows in tracks.groupby('STATE', sort=True)},
+    }
+
+
+def select_tracks(tracks, states):
+    """Tracks to draw for a selection: the national set for no states, else every track in the states picked."""
+    if not states:
+        return tracks['national']
+    parts = [tracks['states'][state] for state in states if state in tracks['states']]
+    return pd.concat(parts, ignore_index=True) if parts else tracks['national'].iloc[:0]
+
+
+# ----- Grid hash index for radius / bounding-box queries -----
+# Begin and end points are bucketed into GRID_CELL_DEG cells numbered row-major
+# over LAT_RANGE x LON_RANGE and sorted by cell, so the cells of one grid row
+# inside a query box are a single contiguous slice found with searchsorted.
+GRID_CELL_DEG = 0.5
+GRID_ROWS = int(np.ceil((LAT_RANGE[1] - LAT_RANGE[0]) / GRID_CELL_DEG))
+GRID_COLS = int(np.ceil((LON_RANGE[1] - LON_RANGE[0]) / GRID_CELL_DEG))
+GRID_COLUMNS = ['EVENT_ID', 'BEGIN_LAT', 'BEGIN_LON', 'END_LAT', 'END_LON']
+# Bump whenever build_grid_index changes the saved layout or cell numbering
+GRID_INDEX_VERSION = 2
+
+MILES_PER_DEG_LAT = 69.0
+EARTH_RADIUS_MILES = 3958.8
+
+
+def _grid_row_col(lat, lon):
+    # Points on or past the east/north edge (or outside the ranges) fall into
+    # the nearest edge cell; queries filter on the exact coordinates anyway.
+    row = np.clip(np.floor((lat - LAT_RANGE[0]) / GRID_CELL_DEG), 0, GRID_ROWS - 1).astype(np.int64)
+    col = np.clip(np.floor((lon - LON_RANGE[0]) / GRID_CELL_DEG), 0, GRID_COLS - 1).astype(np.int64)
+    return row, col
+
+
+def _grid_cells(lat, lon):
+    row, col = _grid_row_col(lat, lon)
+    return row * GRID_COLS + col
+
+
+def build_grid_index(df):
+    """Cell-sorted arrays of every begin/end point and its EVENT_ID."""
+    ids = df['EVENT_ID'].to_numpy(dtype=np.int64)
+    lat = np.concatenate([df['BEGIN_LAT'].to_numpy(dtype=float), df['END_LAT'].to_numpy(dtype=float)])
+    lon = np.concatenate([df['BEGIN_LON'].to_numpy(dtype=float), df['END_LON'].to_numpy(dtype=float)])
+    ids = np.concatenate([ids, ids])
+
+    ok = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon, ids = lat[ok], lon[ok], ids[ok]
+    cells = _grid_cells(lat, lon)
+    order = np.argsort(cells, kind='stable')
+    return {'cells': cells[order], 'lat': lat[order], 'lon': lon[order], 'event_ids': ids[order]}
+
+
+def grid_index_path(files):
+    return storm_data.artifact_path('spatial', files, GRID_INDEX_VERSION)
+
+
+def ensure_grid_index(df, files):
+    """Write the grid index for `files` unless an up-to-date one is already on disk."""
+    return storm_data.ensure_artifact(grid_index_path(files), lambda: build_grid_index(df))
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
+
+
+class GridIndex:
+    """Radius and bounding-box lookups over one or more saved grid indexes."""
+
+    def __init__(self, paths):
+        parts = []
+        for path in paths:
+            with np.load(path) as npz:
+                parts.append({k: npz[k] for k in npz.files})
+        if parts:
+            merged = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+            order = np.argsort(merged['cells'], kind='stable')
+            self.arrays = {k: v[order] for k, v in merged.items()}
+        else:
+            self.arrays = build_grid_index(pd.DataFrame(columns=GRID_COLUMNS))
+
+    def _candidates(self, lat_min, lat_max, lon_min, lon_max):
+        cells = self.arrays['cells']
+        if lat_min > lat_max or lon_min > lon_max:
+            return np.array([], dtype=np.int64)
+
+        (r0, r1), (c0, c1) = _grid_row_col(np.array([lat_min, lat_max]), np.array([lon_min, lon_max]))
+        slices = []
+        for row in range(r0, r1 + 1):
+            lo = np.searchsorted(cells, row * GRID_COLS + c0, side='left')
+            hi = np.searchsorted(cells, row * GRID_COLS + c1, side='right')
+            slices.append(np.arange(lo, hi))
+        return np.concatenate(slices)
+
+    def query_bbox(self, lat_min, lat_max, lon_min, lon_max):
+        """EVENT_IDs with a begin or end point inside the box."""
+        idx = self._candidates(lat_min, lat_max, lon_min, lon_max)
+        lat, lon = self.arrays['lat'][idx], self.arrays['lon'][idx]
+        inside = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        return np.unique(self.arrays['event_ids'][idx[inside]])
+
+    def query_radius(self, lat, lon, miles):
+        """EVENT_IDs with a begin or end point within `miles` of (lat, lon)."""
+        dlat = miles / MILES_PER_DEG_LAT
+        dlon = miles / (MILES_PER_DEG_LAT * max(np.cos(np.radians(lat)), 0.01))
+        idx = self._candidates(lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+        dist = haversine_miles(lat, lon, self.arrays['lat'][idx], self.arrays['lon'][idx])
+        return np.unique(self.arrays['event_ids'][idx[dist <= miles]])
+
+
+# ----- County aggregates -----
+# Bundled county TopoJSON (2016 Census cartographic boundaries), served by
+# Streamlit's static file server; geometry ids are 5-digit state+county FIPS.
+COUNTY_TOPO_URL = 'app/static/us-counties.topo.json'
+
+
+def county_aggregates(df):
+    """Per (YEAR, STATE_FIPS, CZ_FIPS) tornado totals for county-type zones."""
+    counties = df[(df['CZ_TYPE'] == 'C') & df['STATE_FIPS'].notna()]
+    stats = counties.groupby(['YEAR', 'STATE_FIPS', 'CZ_FIPS']).agg(
+        county=('CZ_NAME', 'first'),
+        state=('STATE', 'first'),
+        tornado_count=('EVENT_ID', 'count'),
+        avg_intensity=('intensity', 'mean'),
+        injuries=('INJURIES_DIRECT', 'sum'),
+        deaths=('DEATHS_DIRECT', 'sum'),
+    ).reset_index()
+    stats['id'] = stats['STATE_FIPS'].astype(int) * 1000 + stats['CZ_FIPS'].astype(int)
+    return stats
@@ -1,17 +1,17 @@
 # streamlit_storm_dashboard.py
 
-import streamlit as st
-import pandas as pd
-import altair as alt
 import os
-from vega_datasets import data as vega_data
-from vega_datasets import data
-import us
-import json
 import glob
+import time
+import uuid
+import streamlit as st
+import storm_profiling
 
 st.set_page_config(layout="wide")
-alt.data_transformers.disable_max_rows()
+
+# Span timing for this run; open the app with ?debug=1 to see the profile panel
+run_trace = storm_profiling.begin('script run')
+DEBUG = st.query_params.get('debug') == '1'
 
 st.title("🌀 Tornado Tracker: Interactive Insights Across U.S. States")
 
@@ -28,76 +28,320 @@ Use the sidebar to switch views and explore different years, metrics, or regions
 
 st.markdown("---")
 
+# pandas, Altair and the storm_* modules are imported after the header, so on a
+# cold start the page paints while they load (they are cached after the first run)
+import pandas as pd
+import altair as alt
+import storm_data
+import storm_search
+import storm_spatial
+import storm_rankings
+import storm_sketches
+import storm_jobs
+import storm_cache
+import storm_charts
+import storm_memory
 
-@st.cache_data
-def load_all_years_data():
-    dfs = []
-    for year in range(2000, 2025):  # Extended to 2024 to match data availability
-        pattern = os.path.join(os.path.dirname(__file__), 'data', f'StormEvents_details-ftp_v1.0_d{year}_c20250401_chunk_*.csv')
-        files = sorted(glob.glob(pattern))
-        if not files:
-            st.sidebar.warning(f"⚠️ No files found for year {year} with pattern {pattern}")
-            continue
+alt.data_transformers.disable_max_rows()
 
-        for file in files:
-            try:
-                df_year = pd.read_csv(file, encoding='latin1', on_bad_lines='skip')
-                if 'TOR_F_SCALE' not in df_year.columns:
-                    st.sidebar.warning(f"⚠️ 'TOR_F_SCALE' column missing in {file}")
-                    continue
-                if 'BEGIN_TIME' not in df_year.columns:
-                    st.sidebar.warning(f"⚠️ 'BEGIN_TIME' column missing in {file}")
-                    continue
-                df_year = df_year[~df_year['TOR_F_SCALE'].isna()].copy()
-                dfs.append(df_year)
-                # st.write(f"Loaded {file} with {len(df_year)} rows.")
-            except Exception as e:
-                st.sidebar.error(f"❌ Error reading {file}: {e}")
 
-    if not dfs:
-        st.error("⚠️ No data files loaded. Please check the data directory and file patterns.")
-        return pd.DataFrame()
+# Byte limits for the shared caches: each has its own cap, and together they stay under the overall budget
+CACHE_BUDGET_MB = int(os.environ.get('STORM_CACHE_BUDGET_MB', 512))
+SPEC_CACHE_MB = int(os.environ.get('STORM_SPEC_CACHE_MB', 64))
+DERIVED_CACHE_MB = int(os.environ.get('STORM_DERIVED_CACHE_MB', 256))
 
-    df = pd.concat(dfs, ignore_index=True)
-    return df
 
-def load_data_by_year(year):
-    pattern = os.path.join("data", f"StormEvents_details-ftp_v1.0_d{year}_c20250401_chunk_*.csv")
-    files = sorted(glob.glob(pattern))
+@st.cache_resource
+def memory_budget():
+    return storm_jobs.MemoryBudget(CACHE_BUDGET_MB * 2**20)
 
-    if not files:
-        st.warning(f"⚠️ No files found for year {year}")
-        return pd.DataFrame()
 
-    dfs = []
-    for file in files:
-        try:
-            df = pd.read_csv(file, on_bad_lines='skip', encoding='latin1')
-            if 'TOR_F_SCALE' not in df.columns or 'BEGIN_DATE_TIME' not in df.columns:
-                st.sidebar.warning(f"Missing expected columns in: {os.path.basename(file)}")
-                continue
-            dfs.append(df)
-        except Exception as e:
-            st.sidebar.error(f"❌ Could not read {os.path.basename(file)}: {e}")
-
-    if not dfs:
-        return pd.DataFrame()
+@st.cache_resource
+def spec_cache():
+    return storm_charts.SpecCache(SPEC_CACHE_MB * 2**20, budget=memory_budget())
 
-    df = pd.concat(dfs, ignore_index=True)
-    df = df[~df['TOR_F_SCALE'].isna()].copy()
-    df['intensity'] = df['TOR_F_SCALE'].str.extract('(\d+)').astype(float)
-    df['date'] = pd.to_datetime(df['BEGIN_DATE_TIME'], format='%d-%b-%y %H:%M:%S', errors='coerce')
-    df['month'] = df['date'].dt.month
-    state_name_to_fips = {state.name.upper(): int(state.fips) for state in us.states.STATES}
-    df['STATE_FIPS'] = df['STATE'].map(state_name_to_fips)
 
-    unmapped_states = df[df['STATE_FIPS'].isna()]['STATE'].unique()
-    if len(unmapped_states) > 0:
-        st.sidebar.warning(f"⚠️ Unmapped states found: {list(unmapped_states)}\n"
-                           "ℹ️ *Note: This is likely due to missing data in the original NOAA dataset.*")
+@st.cache_resource
+def derived_cache():
+    # Indexes, sketches and aggregates loaded from disk, keyed by what they were built from; an evicted
+    # entry is reloaded from its on-disk artifact on next use
+    return storm_jobs.ByteBudgetCache(DERIVED_CACHE_MB * 2**20, budget=memory_budget())
 
+
+@st.cache_resource
+def session_memory():
+    return storm_memory.SessionMemory()
+
+
+def track_frame(name, df):
+    # Record the deep size of a frame this session derived, for the debug panel's memory section
+    session = st.session_state.setdefault('memory_session', uuid.uuid4().hex[:8])
+    session_memory().record(session, name, df)
     return df
 
+
+def show_chart(key, build, use_container_width=True):
+    # `key` must cover every input of build(): on a hit the Altair chart is not built at all.
+    # Datasets go out as content-addressed static files rather than inline rows.
+    with storm_profiling.span(f'chart {key[0]}') as record:
+        spec = spec_cache().get_or_build(key, build)
+        if DEBUG:
+            record.update(storm_charts.payload_bytes(spec))
+        with storm_profiling.span('st.vega_lite_chart'):
+            st.vega_lite_chart(spec, use_container_width=use_container_width)
+
+
+def show_animation(key, build, param, values, use_container_width=True):
+    # Like show_chart, plus a Play checkbox that steps `param` through `values` in the browser
+    with storm_profiling.span(f'chart {key[0]}') as record:
+        spec = spec_cache().get_or_build(key, build)
+        if DEBUG:
+            record.update(storm_charts.payload_bytes(spec))
+        with storm_profiling.span('st.vega_lite_chart'):
+            st.vega_lite_chart(storm_charts.animated(spec, param, values), use_container_width=use_container_width)
+
+
+def keep_trace(trace):
+    # Last few traces of this session, for the debug panel
+    traces = st.session_state.setdefault('profile_traces', [])
+    traces.append(trace)
+    del traces[:-10]
+
+
+@storm_profiling.timed()
+def load_all_years_data(progress=None):
+    # No st.* calls in here: this runs on a background thread, so problems are
+    # returned as (level, message) pairs and shown in the sidebar by the caller.
+    issues = []
+    year_of = {}
+    for year in storm_data.YEARS:  # Extended to 2024 to match data availability
+        files = storm_data.year_files(year)
+        if not files:
+            issues.append(('warning', f"⚠️ No files found for year {year} in {storm_data.DATA_DIR}"))
+        year_of.update((file, year) for file in files)
+
+    # Every year's files go through one thread pool, so single-file (.csv.gz) years decompress in parallel
+    year_dfs, file_issues = {}, {}
+    for i, (file, df_year, error) in enumerate(storm_data.read_sources(list(year_of))):
+        year = year_of[file]
+        if progress:
+            progress(i / len(year_of), f"Loading {year} storm events…")
+        issue = storm_data.source_issue(file, df_year, error)
+        if issue is not None:
+            file_issues.setdefault(year, []).append(issue)
+        else:
+            year_dfs.setdefault(year, []).append(df_year)
+
+    for year in sorted(set(year_of.values())):
+        files = storm_data.year_files(year)
+        df_year = pd.concat(year_dfs[year], ignore_index=True) if year in year_dfs else pd.DataFrame()
+        if year in year_dfs:
+            storm_search.ensure_index(df_year, files)
+            storm_spatial.ensure_grid_index(df_year, files)
+            storm_rankings.ensure_candidates(df_year, files)
+            storm_sketches.ensure_sketches(df_year, files)
+        # The year's quality report is validated once; later loads (and the year view) reuse it
+        report = storm_cache.cached('quality', files, lambda: storm_data.year_quality(df_year, file_issues.get(year, [])))
+        issues.extend(storm_data.quality_messages(report))
+
+    if not year_dfs:
+        return pd.DataFrame(), issues
+
+    df = pd.concat([df for dfs in year_dfs.values() for df in dfs], ignore_index=True)
+    return df, issues
+
+class HeatmapUnavailable(Exception):
+    """Raised while loading the heatmap rows when there is nothing usable to fold."""
+
+def archive_issues():
+    # Sidebar messages for the whole archive from the per-year quality entries; years not ingested yet have none
+    issues = []
+    for year in storm_data.YEARS:
+        files = storm_data.year_files(year)
+        if not files:
+            issues.append(('warning', f"⚠️ No files found for year {year} in {storm_data.DATA_DIR}"))
+            continue
+        report = storm_cache.load('quality', files)
+        if report is not None:
+            issues.extend(storm_data.quality_messages(report))
+    return issues
+
+@storm_profiling.timed()
+def load_heatmap_data(progress=None):
+    """
+    Load every year and fold it for the heatmap, once per clock (local and UTC hours).
+    Returns (folds, issues, error); folds maps clock -> folded table, or is None when error explains why.
+    """
+    all_files = [file for year in storm_data.YEARS for file in storm_data.year_files(year)]
+
+    def read():
+        # On a miss the years are ingested in full, so their indexes and quality reports are written too
+        df, _ = load_all_years_data(progress)
+        if df.empty:
+            raise HeatmapUnavailable("No data available to display the heatmap. Please ensure data files are correctly placed in the 'data' directory.")
+        missing_columns = [col for col in storm_data.HEATMAP_REQUIRED_COLUMNS if col not in df.columns]
+        if missing_columns:
+            raise HeatmapUnavailable(f"Missing required columns: {missing_columns}. Cannot generate heatmap.")
+        if progress:
+            progress(1.0, "Aggregating by month, hour and year…")
+        return df
+
+    if not all_files:
+        return None, archive_issues(), "No data available to display the heatmap. Please ensure data files are correctly placed in the 'data' directory."
+    try:
+        folds = storm_cache.heatmap_folds(all_files, read)
+    except HeatmapUnavailable as e:
+        return None, archive_issues(), str(e)
+    return folds, archive_issues(), None
+
+@st.cache_resource
+def heatmap_data_job():
+    # Started once per process and shared by every session
+    return storm_jobs.BackgroundJob(load_heatmap_data, name='heatmap-load')
+
+@storm_profiling.timed()
+def read_year_data(year):
+    # Runs on the prefetch thread as well as in the script, so no st.* calls here
+    files = storm_data.year_files(year)
+    entry = dict(storm_cache.cached('year', files, lambda: storm_data.clean_year_data(files)), tracks=None)
+    if not entry['df'].empty:
+        storm_search.ensure_index(entry['df'], files)
+        storm_spatial.ensure_grid_index(entry['df'], files)
+        storm_rankings.ensure_candidates(entry['df'], files)
+        storm_sketches.ensure_sketches(entry['df'], files)
+        storm_cache.cached('state_year', files, lambda: storm_data.state_year_stats(entry['df'], year))
+        # Track segments per state, next to state_rows; a selection concatenates its states' frames
+        entry = dict(entry, tracks=storm_cache.cached('tracks', files, lambda: storm_spatial.state_tracks(entry['df'])))
+    storm_cache.cached('quality', files, lambda: storm_data.year_quality(entry['df'], entry['quality']['file_issues']))
+    return entry
+
+# Memory budget for loaded years kept in the shared year cache
+YEAR_CACHE_BUDGET_MB = int(os.environ.get("STORM_YEAR_CACHE_MB", "256"))
+
+@st.cache_resource
+def year_prefetcher():
+    # One cache of loaded years for all sessions; entries are shared, so never modify them in place
+    cache = storm_jobs.ByteBudgetCache(YEAR_CACHE_BUDGET_MB * 2**20, budget=memory_budget())
+    return storm_jobs.Prefetcher(cache, read_year_data)
+
+@storm_profiling.timed()
+def load_data_by_year(year):
+    if not storm_data.year_files(year):
+        st.warning(f"⚠️ No files found for year {year}")
+        return {'df': pd.DataFrame(), 'state_stats': None, 'monthly_trends': None, 'ef_counts': None,
+                'state_rows': None, 'tracks': None, 'quality': None}
+
+    year_data = year_prefetcher().get_or_load(year)
+    show_quality(year, year_data['quality'])
+    return year_data
+
+def show_quality(year, report):
+    # Everything here comes from the report written when the year was ingested; no rows are scanned
+    for level, message in storm_data.quality_messages(report):
+        getattr(st.sidebar, level)(message)
+    with st.sidebar.expander(f"🩺 Data Quality – {year}"):
+        st.dataframe(storm_data.quality_table(report), hide_index=True, column_config={
+            'check': st.column_config.TextColumn("Check"),
+            'rows': st.column_config.NumberColumn("Rows", format="%d"),
+            'share': st.column_config.NumberColumn("Share", format="percent"),
+        })
+
+def prefetch_nearby_years(year):
+    # Warm the neighbouring and most requested years so the next selection is a cache hit
+    prefetcher = year_prefetcher()
+    candidates = [year - 1, year + 1] + prefetcher.popular(3)
+    prefetcher.prefetch([y for y in candidates if y != year and y in storm_data.YEARS and storm_data.year_files(y)])
+
+@storm_profiling.timed()
+def load_touchdown_density(files, df):
+    # Binned once per year's files and kept in the disk cache; the in-memory copy is keyed on their fingerprint
+    return derived_cache().get_or_compute(
+        ('touchdown_density', storm_data.files_fingerprint(files)),
+        lambda: storm_cache.cached('touchdown_density', files, lambda: storm_spatial.density_levels(df)))
+
+@storm_profiling.timed()
+def load_county_stats(files, year, df):
+    # Aggregated once per year's files and kept in the disk cache, like load_touchdown_density
+    return derived_cache().get_or_compute(
+        ('county_stats', storm_data.files_fingerprint(files)),
+        lambda: storm_cache.cached('county_stats', files, lambda: storm_spatial.county_aggregates(df.assign(YEAR=year))))
+
+@storm_profiling.timed()
+def load_search_index(path):
+    # path is fingerprinted, so a data change loads a new index
+    return derived_cache().get_or_compute(('search_index', path), lambda: storm_search.SearchIndex([path]))
+
+def archive_fingerprint():
+    # Changes whenever any year's files do (new release, added or replaced file), so archive-wide loaders rebuild
+    return storm_data.files_fingerprint([file for year in storm_data.YEARS for file in storm_data.year_files(year)])
+
+@storm_profiling.timed()
+def load_spatial_index(fingerprint):
+    return derived_cache().get_or_compute(('spatial_index', fingerprint), build_spatial_index)
+
+def build_spatial_index():
+    # Grid index over every year in the archive; years not ingested yet are indexed from their coordinates only
+    paths = []
+    for year in storm_data.YEARS:
+        files = storm_data.year_files(year)
+        if not files:
+            continue
+        path = storm_spatial.grid_index_path(files)
+        if not os.path.exists(path):
+            storm_spatial.ensure_grid_index(storm_data.read_tornadoes(files, storm_spatial.GRID_COLUMNS), files)
+        paths.append(path)
+    return storm_spatial.GridIndex(paths)
+
+@storm_profiling.timed()
+def load_rankings(fingerprint):
+    return derived_cache().get_or_compute(('rankings', fingerprint), build_rankings)
+
+def build_rankings():
+    # Top-K candidates of every year in the archive; years not ingested yet are read for the ranked columns only
+    paths = []
+    for year in storm_data.YEARS:
+        files = storm_data.year_files(year)
+        if not files:
+            continue
+        path = storm_rankings.candidates_path(files)
+        if not os.path.exists(path):
+            storm_rankings.ensure_candidates(storm_data.read_tornadoes(files, storm_rankings.RANK_COLUMNS), files)
+        paths.append(path)
+    return storm_rankings.Rankings(paths)
+
+@storm_profiling.timed()
+def load_sketches(fingerprint):
+    return derived_cache().get_or_compute(('sketches', fingerprint), build_sketches)
+
+def build_sketches():
+    # Quantile sketches of every year in the archive, built the same way as build_rankings()
+    paths = {}
+    for year in storm_data.YEARS:
+        files = storm_data.year_files(year)
+        if not files:
+            continue
+        path = storm_sketches.sketches_path(files)
+        if not os.path.exists(path):
+            storm_sketches.ensure_sketches(storm_data.read_tornadoes(files, storm_sketches.SKETCH_COLUMNS), files)
+        paths[year] = path
+    return storm_sketches.QuantileSketches(paths)
+
+@storm_profiling.timed()
+def load_state_matrix(fingerprint):
+    return derived_cache().get_or_compute(('state_matrix', fingerprint), build_state_matrix)
+
+def build_state_matrix():
+    # Year x state counts and intensity for the whole archive, one small storm_cache entry per year;
+    # years not loaded yet are read for the two columns needed
+    frames = []
+    for year in storm_data.YEARS:
+        files = storm_data.year_files(year)
+        if files:
+            frames.append(storm_cache.cached('state_year', files, lambda: storm_data.state_year_stats(
+                storm_data.read_tornadoes(files, storm_data.STATE_MATRIX_COLUMNS), year)))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+@storm_profiling.timed()
 def load_temperature_data():
     """
     Load annual US temperature data from a single CSV file.
@@ -166,38 +410,8 @@ if view_mode == '2024 State Analysis':
     # --- MAP SECTION SETUP ---
     available_years = list(range(2000, 2025))
     selected_year = st.sidebar.selectbox("Select Year:", available_years, index=available_years.index(2024))
-    df = load_data_by_year(selected_year)
-
-    all_states = sorted(df["STATE"].dropna().unique().tolist())
-    st.sidebar.markdown("### State Filters")
-    selected_state = st.sidebar.selectbox("Select State:", ["All States"] + all_states)
-
-    # Dynamically ensure all US states are represented in the map
-    # regardless of whether they have tornadoes in the selected year
-    full_state_df = pd.DataFrame(
-        [(state.name.upper(), int(state.fips)) for state in us.states.STATES],
-        columns=["STATE", "STATE_FIPS"]
-    )
-    full_state_df["id"] = full_state_df["STATE_FIPS"]
-
-    # Aggregate tornado data per state
-    state_stats = df.groupby(["STATE", "STATE_FIPS"]).agg(
-        tornado_count=('TOR_F_SCALE', 'count'),
-        avg_intensity=('intensity', 'mean')
-    ).reset_index()
-
-    # Add `id` for merge
-    state_stats["id"] = state_stats["STATE_FIPS"]
-
-    # Merge to ensure all states are included
-    state_stats = pd.merge(
-        full_state_df,
-        state_stats,
-        on=["STATE", "STATE_FIPS", "id"],
-        how="left"
-    )
-    state_stats["tornado_count"] = state_stats["tornado_count"].fillna(0)
-    state_stats["avg_intensity"] = state_stats["avg_intensity"].fillna(0)
+    year_data = load_data_by_year(selected_year)
+    df = year_data['df']
 
     # --- MAP SECTION ---
     st.markdown("""
@@ -206,314 +420,614 @@ if view_mode == '2024 State Analysis':
     Welcome to the Tornado Tracker Dashboard — an interactive data exploration tool that reveals patterns in U.S. tornado activity.
     
     ### 🔍 How to Use
-    - Use the **sidebar** to select a specific **year** and **state**
+    - Use the **sidebar** to select a specific **year** and one or more **states**
     - Hover over visualizations to view detailed statistics
     - Explore monthly, geographic, and scale-based patterns
     
     """)
     
-    st.subheader(f"1️⃣ Geographic Distribution – {selected_state}, {selected_year}")
-    st.markdown("""
-    This map shows the number of tornadoes per state. Darker red shades indicate higher counts. Hover over a state to view:
-    - **Total tornadoes**
-    - **Average intensity** (based on EF scale)
-    
-    🕵️‍♂️ **Tip**: Gray areas had **no recorded tornadoes** during the selected year.
-    """)
+    states_geo = alt.topo_feature(storm_charts.US_10M_URL, 'states')
+
+    # Sections below are fragments: a widget change reruns only the fragment that owns it.
+    # Their inputs from the full run are passed in explicitly, so year-level data is not recomputed.
+    @st.fragment
+    @storm_profiling.traced('render_state_sections', keep_trace)
+    def render_state_sections(year_data, selected_year):
+        df, state_stats, state_rows = year_data['df'], year_data['state_stats'], year_data['state_rows']
+        if state_rows is None:
+            st.info(f"ℹ️ No tornado data is available for {selected_year}. Pick another year in the sidebar.")
+            return
+        st.sidebar.markdown("### State Filters")
+        # Sorted, so the same states picked in any order share cached charts; empty means all states
+        selected_states = sorted(st.sidebar.multiselect("Select States:", state_rows.states.tolist(), placeholder="All States"))
+        states_key = tuple(selected_states)
+        if not selected_states:
+            state_label = "All States"
+        elif len(selected_states) <= 3:
+            state_label = ", ".join(selected_states)
+        else:
+            state_label = f"{len(selected_states)} states"
+        search_query = st.sidebar.text_input("Search Narratives:", placeholder='e.g. mobile home, school, EF4')
+
+        st.sidebar.markdown("### Distance Filter")
+        use_radius = st.sidebar.checkbox("Only tornadoes near a point")
+        if use_radius:
+            center_lat = st.sidebar.number_input("Latitude:", min_value=17.0, max_value=72.0, value=35.47, format="%.4f")
+            center_lon = st.sidebar.number_input("Longitude:", min_value=-180.0, max_value=-64.0, value=-97.52, format="%.4f")
+            radius_miles = st.sidebar.slider("Radius (miles):", min_value=5, max_value=300, value=50, step=5)
 
-    states_geo = alt.topo_feature(data.us_10m.url, 'states')
+        st.subheader(f"1️⃣ Geographic Distribution – {state_label}, {selected_year}")
+        st.markdown("""
+        This map shows the number of tornadoes per state. Darker red shades indicate higher counts. Hover over a state to view:
+        - **Total tornadoes**
+        - **Average intensity** (based on EF scale)
+        - **Median and 90th percentile** property damage, and the median path length
     
+        🕵️‍♂️ **Tip**: Gray areas had **no recorded tornadoes** during the selected year.
 
-    map_chart = alt.Chart(states_geo).mark_geoshape().encode(
-        color=alt.condition(
-            alt.datum.tornado_count > 0,
-            alt.Color('tornado_count:Q', scale=alt.Scale(scheme='reds'), title='Tornado Count'),
-            alt.value('lightgray')  # gray fallback for no tornadoes
-        ),
-        tooltip=[
-            alt.Tooltip('STATE:N', title='State'),
-            alt.Tooltip('tornado_count:Q', title='Tornado Count'),
-            alt.Tooltip('avg_intensity:Q', title='Avg Intensity')
-        ]
-    ).transform_lookup(
-        lookup='id',
-        from_=alt.LookupData(state_stats, key='id', fields=['STATE', 'tornado_count', 'avg_intensity'])
-    ).project(
-        type='albersUsa'
-    ).properties(width=800, height=500)
-
-    st.altair_chart(map_chart, use_container_width=True)
+        Black lines trace tornado **paths**, thicker for wider tornadoes. With **All States** selected only tracks of at least
+        10 miles or EF2+ are drawn; select states in the sidebar to see every track there.
+        """)
 
-    st.markdown("""
-    ## 🌪️ Tornado Impacts Across Key Regions
+        def build_map():
+            # Per-state percentiles from the year's quantile sketches, merged into a copy of the shared stats
+            sketches = load_sketches(archive_fingerprint())
+            damage = sketches.quantiles_by('DAMAGE_PROPERTY', 'STATE', [0.5, 0.9], year_range=(selected_year, selected_year))
+            length = sketches.quantiles_by('TOR_LENGTH', 'STATE', [0.5], year_range=(selected_year, selected_year))
+            map_stats = state_stats.merge(
+                damage.rename(columns={'p50': 'damage_p50', 'p90': 'damage_p90'}), on='STATE', how='left'
+            ).merge(length.rename(columns={'p50': 'length_p50'}), on='STATE', how='left')
+
+            state_shapes = alt.Chart(states_geo).mark_geoshape().encode(
+                color=alt.condition(
+                    alt.datum.tornado_count > 0,
+                    alt.Color('tornado_count:Q', scale=alt.Scale(scheme='reds'), title='Tornado Count'),
+                    alt.value('lightgray')  # gray fallback for no tornadoes
+                ),
+                tooltip=[
+                    alt.Tooltip('STATE:N', title='State'),
+                    alt.Tooltip('tornado_count:Q', title='Tornado Count'),
+                    alt.Tooltip('avg_intensity:Q', title='Avg Intensity'),
+                    alt.Tooltip('damage_p50:Q', title='Median Damage ($)', format=',.0f'),
+                    alt.Tooltip('damage_p90:Q', title='90th Pct Damage ($)', format=',.0f'),
+                    alt.Tooltip('length_p50:Q', title='Median Length (miles)', format='.1f')
+                ]
+            ).transform_lookup(
+                lookup='id',
+                from_=alt.LookupData(map_stats, key='id', fields=['STATE', 'tornado_count', 'avg_intensity',
+                                                                   'damage_p50', 'damage_p90', 'length_p50'])
+            )
+
+            # Tornado tracks, thinned to long/strong tracks unless states are selected
+            tracks = storm_spatial.select_tracks(year_data['tracks'], selected_states)
+            track_lines = alt.Chart(tracks).mark_rule(color='black', opacity=0.6).encode(
+                longitude='BEGIN_LON:Q',
+                latitude='BEGIN_LAT:Q',
+                longitude2='END_LON:Q',
+                latitude2='END_LAT:Q',
+                strokeWidth=alt.StrokeWidth('TOR_WIDTH:Q', scale=alt.Scale(range=[0.5, 4]), title='Width (yards)'),
+                tooltip=[
+                    alt.Tooltip('STATE:N', title='State'),
+                    alt.Tooltip('TOR_F_SCALE:N', title='EF Scale'),
+                    alt.Tooltip('TOR_LENGTH:Q', title='Length (miles)', format='.1f'),
+                    alt.Tooltip('TOR_WIDTH:Q', title='Width (yards)')
+                ]
+            )
+
+            map_chart = alt.layer(state_shapes, track_lines).project(
+                type='albersUsa'
+            ).properties(width=800, height=500)
+            return map_chart
+
+        show_chart(('state_map', selected_year, states_key), build_map, use_container_width=True)
+
+        # --- COUNTY DRILL-DOWN SECTION ---
+        st.subheader(f"🗺️ County Drill-Down – {state_label}, {selected_year}")
+        st.markdown("""
+        Tornado counts per **county**. Select states in the sidebar to zoom in; gray counties had no recorded tornadoes.
+        """)
+
+        def build_county_map():
+            files = storm_data.year_files(selected_year)
+            county_stats = load_county_stats(files, selected_year, df)
+            county_fields = ['county', 'state', 'tornado_count', 'avg_intensity', 'injuries', 'deaths']
+            counties_geo = alt.Data(url=storm_spatial.COUNTY_TOPO_URL, format=alt.DataFormat(type='topojson', feature='counties'))
+
+            county_map = alt.Chart(counties_geo).mark_geoshape(stroke='white', strokeWidth=0.3).encode(
+                color=alt.condition(
+                    alt.datum.tornado_count > 0,
+                    alt.Color('tornado_count:Q', scale=alt.Scale(scheme='reds'), title='Tornado Count'),
+                    alt.value('lightgray')
+                ),
+                tooltip=[
+                    alt.Tooltip('county:N', title='County'),
+                    alt.Tooltip('state:N', title='State'),
+                    alt.Tooltip('tornado_count:Q', title='Tornado Count'),
+                    alt.Tooltip('avg_intensity:Q', title='Avg Intensity', format='.2f'),
+                    alt.Tooltip('injuries:Q', title='Injuries'),
+                    alt.Tooltip('deaths:Q', title='Deaths')
+                ]
+            ).transform_lookup(
+                lookup='id',
+                from_=alt.LookupData(county_stats[['id'] + county_fields], key='id', fields=county_fields)
+            ).transform_calculate(
+                tornado_count='datum.tornado_count || 0'  # keep counties without tornadoes as gray shapes
+            )
+
+            if selected_states:
+                state_fips = [storm_data.STATE_NAME_TO_FIPS.get(state, -1) for state in selected_states]
+                county_map = county_map.transform_filter(
+                    f"indexof({state_fips}, floor(datum.id / 1000)) >= 0"
+                )
+
+            return county_map.project(type='albersUsa').properties(width=800, height=500)
+
+        show_chart(('county_map', selected_year, states_key), build_county_map, use_container_width=True)
+
+        st.markdown("""
+        ## 🌪️ Tornado Impacts Across Key Regions
     
-    Tornadoes cause devastating impacts across many U.S. regions. In 2024, several areas were particularly affected:
+        Tornadoes cause devastating impacts across many U.S. regions. In 2024, several areas were particularly affected:
     
-    ### ⚠️ Areas of Significant Tornado Activity:
-    - **Oklahoma** experienced some of the highest tornado activity nationwide, with numerous strong and long-tracked tornadoes causing damage across both rural and urban communities.
-    - **Illinois** also faced an unusually active season. Tornadoes struck parts of the state that are typically vulnerable, affecting towns, farmland, and suburbs alike.
-    - **Miami and parts of southern Florida** recorded several tornado events, mainly weaker tornadoes (EF0–EF1), often connected to tropical weather systems. Even lower-rated tornadoes can cause serious damage, especially in densely populated areas.
+        ### ⚠️ Areas of Significant Tornado Activity:
+        - **Oklahoma** experienced some of the highest tornado activity nationwide, with numerous strong and long-tracked tornadoes causing damage across both rural and urban communities.
+        - **Illinois** also faced an unusually active season. Tornadoes struck parts of the state that are typically vulnerable, affecting towns, farmland, and suburbs alike.
+        - **Miami and parts of southern Florida** recorded several tornado events, mainly weaker tornadoes (EF0–EF1), often connected to tropical weather systems. Even lower-rated tornadoes can cause serious damage, especially in densely populated areas.
     
-    ### 🏛️ Impact Across the Midwest
-    The most active region, often referred to as "**Tornado Alley**," spans much of the **Midwest**, including states like Missouri, Kansas, and Iowa. This region as a whole continued to face heightened tornado risks in 2024. This reflects ongoing patterns where warm, moist air from the Gulf meets cold, dry air from Canada, creating the perfect conditions for severe storms ([American Meteorological Society, 2022](https://journals.ametsoc.org/view/journals/wefo/36/6/WAF-D-21-0087.1.xml)).
+        ### 🏛️ Impact Across the Midwest
+        The most active region, often referred to as "**Tornado Alley**," spans much of the **Midwest**, including states like Missouri, Kansas, and Iowa. This region as a whole continued to face heightened tornado risks in 2024. This reflects ongoing patterns where warm, moist air from the Gulf meets cold, dry air from Canada, creating the perfect conditions for severe storms ([American Meteorological Society, 2022](https://journals.ametsoc.org/view/journals/wefo/36/6/WAF-D-21-0087.1.xml)).
 
-    🔎 Use the interactive maps and charts above to explore how tornado frequency and intensity varied across states and months.
-    """)
+        🔎 Use the interactive maps and charts above to explore how tornado frequency and intensity varied across states and months.
+        """)
 
 
-    # Filtered Data
-    def filter_state(df, selected_state):
-        return df if selected_state == "All States" else df[df["STATE"] == selected_state]
+        # Filtered Data
+        def filter_aggregate(table):
+            # The per-state aggregates have a few hundred rows, so a plain isin is enough here
+            return table if not selected_states else table[table["STATE"].isin(selected_states)]
+
+        # Narrative search results feed the scatter and EF scale charts
+        details_mask = None
+        if search_query.strip():
+            search_index = load_search_index(storm_search.index_path(storm_data.year_files(selected_year)))
+            details_mask = df["EVENT_ID"].isin(search_index.search(search_query)).to_numpy()
+        if use_radius:
+            near_ids = load_spatial_index(archive_fingerprint()).query_radius(center_lat, center_lon, radius_miles)
+            near = df["EVENT_ID"].isin(near_ids).to_numpy()
+            details_mask = near if details_mask is None else details_mask & near
+        df_details = df if details_mask is None else df[details_mask]
+        # Everything that narrowed df_details; part of the spec cache keys below
+        details_key = (search_query.strip(), (center_lat, center_lon, radius_miles) if use_radius else None)
+
+        # Rows of the selected states among df_details, gathered through the year's StateRows index
+        if not selected_states:
+            selected_rows = details_mask
+        elif details_mask is None:
+            selected_rows = state_rows.positions(selected_states)
+        else:
+            selected_rows = details_mask & state_rows.mask(selected_states)
+        df_selected = df if selected_rows is None else df.iloc[selected_rows]
 
-    # --- Monthly Trend Chart ---
+        # --- Monthly Trend Chart ---
 
-    st.subheader(f"2️⃣ Monthly Tornado Trends – {selected_state}")
-    st.markdown("""
-    This chart shows how tornado **frequency** and **intensity** change throughout the year.
+        st.subheader(f"2️⃣ Monthly Tornado Trends – {state_label}")
+        st.markdown("""
+        This chart shows how tornado **frequency** and **intensity** change throughout the year.
     
-    - **Bars** = Number of tornadoes per month
-    - **Orange line** = Average tornado intensity (EF scale)
+        - **Bars** = Number of tornadoes per month
+        - **Orange line** = Average tornado intensity (EF scale)
     
-    Use the brush tool to highlight specific months!
-    """)
-
-    st.subheader(f"2️⃣ Monthly Tornado Trends – {selected_state}")
-    df_trend = filter_state(df, selected_state)
-    brush = alt.selection_interval(encodings=["x"])
+        Use the brush tool to highlight specific months!
+        """)
 
-    intensity = alt.Chart(df_trend).mark_line(point=True).encode(
-        x=alt.X("month:O", axis=alt.Axis(labelAngle=0)),  # Rotate x-axis labels horizontal
-        y=alt.Y("average(intensity):Q", axis=alt.Axis(titleColor="orange")),  # Y-axis title color
-        color=alt.value("orange"),
-        opacity=alt.condition(brush, alt.value(1), alt.value(0.3))
-    ).add_params(brush)
+        st.subheader(f"2️⃣ Monthly Tornado Trends – {state_label}")
 
-    count = alt.Chart(df_trend).mark_bar(opacity=0.5).encode(
-        x=alt.X("month:O", axis=alt.Axis(labelAngle=0)),
-        y=alt.Y("count():Q", axis=alt.Axis(titleColor="steelblue")),  # Y-axis title color
-        color=alt.value("steelblue")
-    )
+        def build_monthly_chart():
+            df_trend = filter_aggregate(year_data['monthly_trends']).groupby("month", as_index=False)[
+                ["count", "intensity_sum", "intensity_n"]
+            ].sum()
+            df_trend["avg_intensity"] = df_trend["intensity_sum"] / df_trend["intensity_n"]
+            damage = load_sketches(archive_fingerprint()).quantiles_by(
+                'DAMAGE_PROPERTY', 'month', [0.5, 0.9], year_range=(selected_year, selected_year),
+                state=selected_states or None,
+            )
+            df_trend = df_trend.merge(damage.rename(columns={'p50': 'damage_p50', 'p90': 'damage_p90'}),
+                                      on='month', how='left')
+            track_frame('df_trend', df_trend)
+            brush = alt.selection_interval(encodings=["x"])
+
+            intensity = alt.Chart(df_trend).mark_line(point=True).encode(
+                x=alt.X("month:O", axis=alt.Axis(labelAngle=0)),  # Rotate x-axis labels horizontal
+                y=alt.Y("avg_intensity:Q", title="Average of intensity", axis=alt.Axis(titleColor="orange")),  # Y-axis title color
+                color=alt.value("orange"),
+                opacity=alt.condition(brush, alt.value(1), alt.value(0.3))
+            ).add_params(brush)
+
+            count = alt.Chart(df_trend).mark_bar(opacity=0.5).encode(
+                x=alt.X("month:O", axis=alt.Axis(labelAngle=0)),
+                y=alt.Y("count:Q", title="Count of Records", axis=alt.Axis(titleColor="steelblue")),  # Y-axis title color
+                color=alt.value("steelblue"),
+                tooltip=[
+                    alt.Tooltip("month:O", title="Month"),
+                    alt.Tooltip("count:Q", title="Tornadoes"),
+                    alt.Tooltip("damage_p50:Q", title="Median Damage ($)", format=",.0f"),
+                    alt.Tooltip("damage_p90:Q", title="90th Pct Damage ($)", format=",.0f")
+                ]
+            )
+            return (intensity + count).resolve_scale(y="independent").properties(width=800, height=250)
 
-    st.altair_chart((intensity + count).resolve_scale(y="independent").properties(width=800, height=250), use_container_width=True)
+        show_chart(('monthly', selected_year, states_key), build_monthly_chart, use_container_width=True)
 
-    # --- Scatter Chart ---
-    st.subheader(f"3️⃣ Tornado Size: Length vs. Width – {selected_state}")
-    st.markdown("""
-    Each dot represents a tornado's **path length** and **width**.
+        # --- Scatter Chart ---
+        st.subheader(f"3️⃣ Tornado Size: Length vs. Width – {state_label}")
+        st.markdown("""
+        Each dot represents a tornado's **path length** and **width**.
     
-    - **Orange**: Tornadoes from the selected state (if selected in sidebar)
-    - **Gray**: All other tornadoes in the U.S. in the selected year
+        - **Orange**: Tornadoes from the selected state (one color per state when several are selected)
+        - **Gray**: All other tornadoes in the U.S. in the selected year
     
-    Use this to spot unusually large or narrow tornadoes!
-    """)
-
-    st.subheader(f"3️⃣ Tornado Size: Length vs. Width – {selected_state}")
+        Use this to spot unusually large or narrow tornadoes!
+        """)
 
-    # Define color condition based on whether a state is selected
-    if selected_state == "All States":
-        color = alt.value("orange")
-    else:
-        color = alt.condition(
-            alt.datum.STATE == selected_state,
-            alt.value("orange"),
-            alt.value("lightgray")
-        )
+        st.subheader(f"3️⃣ Tornado Size: Length vs. Width – {state_label}")
+        if search_query.strip():
+            st.info(f"🔍 {len(df_selected)} tornadoes in {state_label} match \"{search_query}\"")
+        if use_radius:
+            st.info(f"📍 {len(df_selected)} tornadoes in {selected_year} within {radius_miles} miles of "
+                    f"({center_lat:.2f}, {center_lon:.2f}); {len(near_ids)} across all years since 2000")
+
+        def build_scatter():
+            # Define color condition based on which states are selected
+            selected = alt.FieldOneOfPredicate(field="STATE", oneOf=selected_states)
+            if not selected_states:
+                color = alt.value("orange")
+            elif len(selected_states) == 1:
+                color = alt.condition(selected, alt.value("orange"), alt.value("lightgray"))
+            else:
+                color = alt.condition(
+                    selected,
+                    alt.Color("STATE:N", scale=alt.Scale(domain=selected_states), title="State"),
+                    alt.value("lightgray")
+                )
         
-    scatter_base = alt.Chart(df).mark_circle(size=60).encode(
-        x=alt.X("TOR_LENGTH:Q", title='Length'),
-        y=alt.Y("TOR_WIDTH:Q", title='Width'),
-        color=color,
-        opacity = alt.value(0.7),
-        tooltip=["STATE", "TOR_LENGTH", "TOR_WIDTH", "TOR_F_SCALE"]
-    ).properties(width=400, height=300)
+            scatter_base = alt.Chart(df_details).mark_circle(size=60).encode(
+                x=alt.X("TOR_LENGTH:Q", title='Length'),
+                y=alt.Y("TOR_WIDTH:Q", title='Width'),
+                color=color,
+                opacity = alt.value(0.7),
+                tooltip=["STATE", "TOR_LENGTH", "TOR_WIDTH", "TOR_F_SCALE"]
+            ).properties(width=400, height=300)
+            return scatter_base
 
-    st.altair_chart(scatter_base, use_container_width=True)
+        show_chart(('scatter', selected_year, states_key, details_key), build_scatter, use_container_width=True)
 
 
-    # --- Scale Bar Chart ---
+        # --- Scale Bar Chart ---
 
-    st.subheader(f"4️⃣ Tornado Frequency by Fujita Scale – {selected_state}")
-    st.markdown("""
-    The Enhanced Fujita (EF) scale classifies tornadoes by wind damage:
+        st.subheader(f"4️⃣ Tornado Frequency by Fujita Scale – {state_label}")
+        st.markdown("""
+        The Enhanced Fujita (EF) scale classifies tornadoes by wind damage:
 
-    - **EF0–EF1**: Weak (light to moderate damage)
-    - **EF2–EF3**: Strong (considerable damage)
-    - **EF4–EF5**: Violent (devastating to incredible damage)
-    - **EFU**: Unrated / Unknown
+        - **EF0–EF1**: Weak (light to moderate damage)
+        - **EF2–EF3**: Strong (considerable damage)
+        - **EF4–EF5**: Violent (devastating to incredible damage)
+        - **EFU**: Unrated / Unknown
 
-    This bar chart shows how tornadoes in the selected state are distributed by EF scale.
-    """)
+        This bar chart shows how tornadoes in the selected state are distributed by EF scale.
+        With several states selected, each EF category has one bar per state.
+        """)
+
+        # Filter the data for the selected state
+        df_scale = track_frame('df_scale', df_selected)
+
+        # Unrated and unrecognised EF values, counted from the year's ingest-time quality flags
+        quality = storm_data.quality_counts(year_data['quality']['flags'], selected_rows)
+
+        if quality['ef_invalid'] > 0 or quality['ef_unknown'] > 0:
+            st.warning(f"""
+            ⚠️ Some tornado records are missing Enhanced Fujita (EF) scale ratings in the selected state or year.
+            These tornadoes are either unrated ('EFU': {quality['ef_unknown']}) or have missing information
+            ({quality['ef_invalid']}), which may cause gaps in the graph.
+            """)
+
+        def build_scale_chart():
+            # Define full EF scale order
+
+            # Prepare full data with all EF categories represented; use the precomputed
+            # counts unless a narrative search or distance filter narrowed the rows
+            if df_details is df:
+                df_scale_counts = filter_aggregate(year_data['ef_counts'])
+            else:
+                df_scale_counts = df_scale.groupby(["STATE", "TOR_F_SCALE"]).size().reset_index(name="count")
+
+            if len(selected_states) > 1:
+                # One bar per selected state in every EF category, colored like the scatter plot
+                df_scale_full = pd.MultiIndex.from_product(
+                    [selected_states, storm_charts.EF_SCALE_ORDER], names=["STATE", "TOR_F_SCALE"]
+                ).to_frame(index=False).merge(df_scale_counts, on=["STATE", "TOR_F_SCALE"], how="left").fillna(0)
+                return alt.Chart(df_scale_full).mark_bar().encode(
+                    x=alt.X("TOR_F_SCALE:N", title="EF Scale", axis=alt.Axis(labelAngle=0)),
+                    xOffset="STATE:N",
+                    y=alt.Y("count:Q", title="Number of Tornadoes"),
+                    color=alt.Color("STATE:N", scale=alt.Scale(domain=selected_states), title="State"),
+                    tooltip=["STATE:N", "TOR_F_SCALE:N", "count:Q"]
+                ).properties(width=400, height=300)
+
+            df_scale_counts = df_scale_counts.groupby("TOR_F_SCALE", as_index=False)["count"].sum()
+
+            # Merge with full EF scale list to ensure all categories appear
+            df_scale_full = pd.DataFrame({"TOR_F_SCALE": storm_charts.EF_SCALE_ORDER}).merge(
+                df_scale_counts,
+                on="TOR_F_SCALE",
+                how="left"
+            ).fillna(0)
+
+            # Create the bar chart
+            scale_chart = alt.Chart(df_scale_full).mark_bar().encode(
+                x=alt.X("TOR_F_SCALE:N", title="EF Scale", axis=alt.Axis(labelAngle=0)),
+                y=alt.Y("count:Q", title="Number of Tornadoes"),
+                color=alt.Color("TOR_F_SCALE:N",
+                                legend=None,
+                                scale=alt.Scale(
+                                    domain=storm_charts.EF_SCALE_ORDER,
+                                    range=storm_charts.EF_COLORS
+                                )
+                ),
+                tooltip=["TOR_F_SCALE:N", "count:Q"]
+            ).properties(width=400, height=300)
+            return scale_chart
+
+        # Display the chart
+        show_chart(('ef_scale', selected_year, states_key, details_key), build_scale_chart, use_container_width=True)
+
+        # --- State Comparison ---
+        if len(selected_states) > 1:
+            st.subheader(f"5️⃣ State Comparison – {selected_year}")
+            st.markdown("The selected states side by side, over every tornado of the year.")
+
+            # Per-state sums are bincounts over the state codes; damage percentiles come from the sketches
+            comparison = pd.DataFrame({
+                'Tornadoes': state_rows.counts(),
+                'Avg Intensity': state_rows.totals(df['intensity'].fillna(0)) / state_rows.totals(df['intensity'].notna()),
+                'Deaths': state_rows.totals(df['DEATHS_DIRECT'] + df['DEATHS_INDIRECT']),
+                'Injuries': state_rows.totals(df['INJURIES_DIRECT'] + df['INJURIES_INDIRECT']),
+            }).loc[selected_states]
+            damage = load_sketches(archive_fingerprint()).quantiles_by('DAMAGE_PROPERTY', 'STATE', [0.5, 0.9],
+                                                  year_range=(selected_year, selected_year), state=selected_states)
+            comparison = comparison.join(damage.set_index('STATE').rename(
+                columns={'p50': 'Median Damage ($)', 'p90': '90th Pct Damage ($)'}))
+            st.dataframe(comparison, column_config={
+                'Tornadoes': st.column_config.NumberColumn(format="%d"),
+                'Avg Intensity': st.column_config.NumberColumn(format="%.2f"),
+                'Deaths': st.column_config.NumberColumn(format="%d"),
+                'Injuries': st.column_config.NumberColumn(format="%d"),
+                'Median Damage ($)': st.column_config.NumberColumn(format="dollar"),
+                '90th Pct Damage ($)': st.column_config.NumberColumn(format="dollar"),
+            })
+
+            def build_comparison_chart():
+                df_compare = filter_aggregate(year_data['monthly_trends'])
+                return alt.Chart(df_compare).mark_line(point=True).encode(
+                    x=alt.X("month:O", title="Month", axis=alt.Axis(labelAngle=0)),
+                    y=alt.Y("count:Q", title="Number of Tornadoes"),
+                    color=alt.Color("STATE:N", scale=alt.Scale(domain=selected_states), title="State"),
+                    tooltip=["STATE:N", "month:O", "count:Q"]
+                ).properties(width=800, height=250)
+
+            show_chart(('compare_monthly', selected_year, states_key), build_comparison_chart, use_container_width=True)
+
+    @st.fragment
+    @storm_profiling.traced('render_density_map', keep_trace)
+    def render_density_map(df, selected_year):
+        if df.empty:
+            return  # render_state_sections already says the year has no data
+        st.subheader(f"🎯 Touchdown Density – {selected_year}")
+        st.markdown("""
+        Each cell is a latitude/longitude grid cell colored by the number of tornado **touchdowns** (starting points) inside it.
+        Pick a finer grid to zoom in on local clusters.
+        """)
+
+        zoom_level = st.radio("Grid Size:", list(storm_spatial.ZOOM_LEVELS), horizontal=True)
 
-    # Filter the data for the selected state
-    df_scale = filter_state(df, selected_state)
+        def build_density_map():
+            files = storm_data.year_files(selected_year)
+            density = load_touchdown_density(files, df)[zoom_level]
 
-    # Check for missing EF values
-    missing_ef = df_scale["TOR_F_SCALE"].isna().sum()
-    unknown_ef = df_scale["TOR_F_SCALE"].eq('EFU').sum()
+            states_outline = alt.Chart(states_geo).mark_geoshape(fill='whitesmoke', stroke='white')
+            cells = storm_spatial.density_cells(density, storm_spatial.ZOOM_LEVELS[zoom_level])
+            density_cells = alt.Chart(cells).mark_geoshape(opacity=0.85, stroke=None).encode(
+                color=alt.Color('count:Q', scale=alt.Scale(scheme='orangered'), title='Touchdowns'),
+                tooltip=[
+                    alt.Tooltip('lat:Q', title='Latitude', format='.1f'),
+                    alt.Tooltip('lon:Q', title='Longitude', format='.1f'),
+                    alt.Tooltip('count:Q', title='Touchdowns')
+                ]
+            )
+
+            density_map = alt.layer(states_outline, density_cells).project(
+                type='albersUsa'
+            ).properties(width=800, height=500)
+            return density_map
+
+        show_chart(('density', selected_year, zoom_level), build_density_map, use_container_width=True)
+
+    @st.fragment
+    @storm_profiling.traced('render_records', keep_trace)
+    def render_records():
+        st.subheader("🏆 Record Tornadoes")
+        st.markdown("The most extreme tornadoes on record for any span of years, nationwide or in one state.")
+
+        col_metric, col_state, col_n = st.columns([2, 2, 1])
+        metric = col_metric.selectbox("Rank by:", list(storm_rankings.RANK_METRICS),
+                                      format_func=storm_rankings.RANK_METRICS.get)
+        state = col_state.selectbox("In:", ["All States"] + list(storm_data.STATE_NAME_TO_FIPS), key='records_state')
+        n = col_n.number_input("Top:", min_value=1, max_value=storm_rankings.TOP_K, value=10)
+        year_range = st.slider("Years:", min_value=storm_data.YEARS[0], max_value=storm_data.YEARS[-1],
+                               value=(storm_data.YEARS[0], storm_data.YEARS[-1]), key='records_years')
+
+        records = load_rankings(archive_fingerprint()).top(metric, n, year_range, None if state == "All States" else state)
+        if records.empty:
+            st.info("No tornadoes with a recorded value in this selection.")
+            return
+        records = records.rename(columns={
+            'YEAR': 'Year', 'BEGIN_DATE_TIME': 'Began', 'STATE': 'State', 'CZ_NAME': 'County/Zone',
+            'TOR_F_SCALE': 'EF', **storm_rankings.RANK_METRICS,
+        })
+        label = storm_rankings.RANK_METRICS[metric]
+        others = [v for k, v in storm_rankings.RANK_METRICS.items() if k != metric]
+        st.dataframe(
+            records[['Year', 'Began', 'State', 'County/Zone', 'EF', label] + others],
+            hide_index=True,
+            column_config={
+                'Year': st.column_config.NumberColumn(format="%d"),
+                'Property damage ($)': st.column_config.NumberColumn(format="dollar"),
+            },
+        )
 
-    if missing_ef > 0 or unknown_ef > 0:
-        st.warning("""
-        ⚠️ Some tornado records are missing Enhanced Fujita (EF) scale ratings in the selected state or year.
-        These tornadoes are either unrated ('EFU') or have missing information, which may cause gaps in the graph.
+        st.markdown("**Typical tornadoes in this selection** (percentiles, within 1% of the exact values)")
+        sketches = load_sketches(archive_fingerprint())
+        percentiles = pd.DataFrame(
+            [sketches.quantiles(m, [0.5, 0.9, 0.99], year_range, None if state == "All States" else state)
+             for m in storm_sketches.SKETCH_METRICS],
+            index=list(storm_sketches.SKETCH_METRICS.values()), columns=['Median', '90th', '99th'],
+        )
+        st.dataframe(percentiles, column_config={
+            col: st.column_config.NumberColumn(format="localized") for col in percentiles.columns
+        })
+
+    @st.fragment
+    @storm_profiling.traced('render_state_animation', keep_trace)
+    def render_state_animation():
+        matrix = load_state_matrix(archive_fingerprint())
+        if matrix.empty:
+            return
+        years = sorted(matrix['YEAR'].unique().tolist())
+        st.subheader(f"⏯️ Tornadoes by State, {years[0]}–{years[-1]}")
+        st.markdown("""
+        Tick **Play** below the map to step it through the years, or drag the year slider.
+        The year × state table is downloaded once, so every frame is drawn in the browser without a rerun.
         """)
 
-    # Define full EF scale order
-    ef_scale_order = ['EF0', 'EF1', 'EF2', 'EF3', 'EF4', 'EF5', 'EFU']
-
-    # Prepare full data with all EF categories represented
-    df_scale_counts = df_scale["TOR_F_SCALE"].value_counts().reset_index()
-    df_scale_counts.columns = ["TOR_F_SCALE", "count"]
-
-    # Merge with full EF scale list to ensure all categories appear
-    df_scale_full = pd.DataFrame({"TOR_F_SCALE": ef_scale_order}).merge(
-        df_scale_counts,
-        on="TOR_F_SCALE",
-        how="left"
-    ).fillna(0)
-
-    # Create the bar chart
-    scale_chart = alt.Chart(df_scale_full).mark_bar().encode(
-        x=alt.X("TOR_F_SCALE:N", title="EF Scale", axis=alt.Axis(labelAngle=0)),
-        y=alt.Y("count:Q", title="Number of Tornadoes"),
-        color=alt.Color("TOR_F_SCALE:N",
-                        legend=None,
-                        scale=alt.Scale(
-                            domain=ef_scale_order,
-                            range=['#FEF001', '#FFCE03', '#FD9A01', '#FD6104', '#FF2C05', '#F00505', '#D3D3D3']
-                        )
-        ),
-        tooltip=["TOR_F_SCALE:N", "count:Q"]
-    ).properties(width=400, height=300)
-
-    # Display the chart
-    st.altair_chart(scale_chart, use_container_width=True)
+        def build_animation():
+            year = alt.param(name='year', value=years[-1],
+                             bind=alt.binding_range(min=years[0], max=years[-1], step=1, name='Year '))
+            return alt.Chart(matrix).mark_geoshape(stroke='white', strokeWidth=0.5).encode(
+                shape='geo:G',
+                color=alt.condition(
+                    alt.datum.tornado_count > 0,
+                    # One color scale for every year, so frames are comparable
+                    alt.Color('tornado_count:Q', scale=alt.Scale(scheme='reds', domain=[0, int(matrix['tornado_count'].max())]),
+                              title='Tornado Count'),
+                    alt.value('lightgray')
+                ),
+                tooltip=[
+                    alt.Tooltip('STATE:N', title='State'),
+                    alt.Tooltip('YEAR:O', title='Year'),
+                    alt.Tooltip('tornado_count:Q', title='Tornado Count'),
+                    alt.Tooltip('avg_intensity:Q', title='Avg Intensity')
+                ]
+            ).transform_filter(
+                alt.datum.YEAR == year
+            ).transform_lookup(
+                lookup='id',
+                from_=alt.LookupData(states_geo, key='id'),
+                as_='geo'
+            ).add_params(year).project(type='albersUsa').properties(width=800, height=450)
+
+        show_animation(('state_animation', tuple(years)), build_animation, 'year', years)
+
+    render_state_sections(year_data, selected_year)
+    render_density_map(df, selected_year)
+    render_records()
+    render_state_animation()
+    prefetch_nearby_years(selected_year)
 
     # Footer
     st.markdown("---")
     st.caption("Data: NOAA Storm Events 2024 | Interactive Dashboard built with Streamlit & Altair")
 # ========== VIEW 2: MULTI-YEAR HEATMAP ==========
 else:
-    # HEATMAP
-    df = load_all_years_data()
-
-    if df.empty:
-        st.error("No data available to display the heatmap. Please ensure data files are correctly placed in the 'data' directory.")
-    else:
-
-        st.title("🌪️ When do tornadoes occur?")
-        st.markdown("""
-        #### ⚠️ The 2011 Super Outbreak 
-        The year 2011 stands out as one of the most catastrophic tornado seasons in U.S. history, marked by an extraordinary level of tornado activity and devastation. Central to this was the [April 25–28 Super Outbreak](https://www.weather.gov/bmx/event_04272011), which unleashed **360 tornadoes across 21 states**, including four EF5 tornadoes—the highest rating on the Enhanced Fujita scale. On April 27 alone, a record-shattering **219 tornadoes** were confirmed, making it the most active tornado day ever recorded. The human toll was staggering, with **324 tornado-related deaths**, **238 of which occurred in Alabama alone**, and an additional **24 fatalities** caused by related thunderstorm events. April 2011 saw a total of **758 tornadoes**, making it the **single most active tornado month** in U.S. history. This unparalleled outbreak not only redefined the scale of tornado disasters but also revealed how a short window of extreme weather can account for a significant portion of yearly destruction and loss of life.
+    st.title("🌪️ When do tornadoes occur?")
+    st.markdown("""
+    #### ⚠️ The 2011 Super Outbreak 
+    The year 2011 stands out as one of the most catastrophic tornado seasons in U.S. history, marked by an extraordinary level of tornado activity and devastation. Central to this was the [April 25–28 Super Outbreak](https://www.weather.gov/bmx/event_04272011), which unleashed **360 tornadoes across 21 states**, including four EF5 tornadoes—the highest rating on the Enhanced Fujita scale. On April 27 alone, a record-shattering **219 tornadoes** were confirmed, making it the most active tornado day ever recorded. The human toll was staggering, with **324 tornado-related deaths**, **238 of which occurred in Alabama alone**, and an additional **24 fatalities** caused by related thunderstorm events. April 2011 saw a total of **758 tornadoes**, making it the **single most active tornado month** in U.S. history. This unparalleled outbreak not only redefined the scale of tornado disasters but also revealed how a short window of extreme weather can account for a significant portion of yearly destruction and loss of life.
 
-        Building on lessons from historic events like 2011, it becomes clear that uncovering temporal and seasonal tornado patterns is crucial for both understanding and preparedness. Tornadoes are among the most destructive natural phenomena, and their behavior—when examined over time and across impact metrics—can provide key insights into risk. This interactive visualization allows users to explore tornado occurrences and their effects across time, seasonality, and different impact dimensions, unlocking patterns that are often hidden in raw data.
-        """)
+    Building on lessons from historic events like 2011, it becomes clear that uncovering temporal and seasonal tornado patterns is crucial for both understanding and preparedness. Tornadoes are among the most destructive natural phenomena, and their behavior—when examined over time and across impact metrics—can provide key insights into risk. This interactive visualization allows users to explore tornado occurrences and their effects across time, seasonality, and different impact dimensions, unlocking patterns that are often hidden in raw data.
+    """)
 
-        st.markdown("---")
+    st.markdown("---")
 
-        st.markdown("""
-        #### 📊 How to Use the Heatmap
-        This interactive heatmap helps you explore when tornadoes happen, how intense they are, and how their impact varies across different timeframes and dimensions. Here's how you can navigate it:
+    st.markdown("""
+    #### 📊 How to Use the Heatmap
+    This interactive heatmap helps you explore when tornadoes happen, how intense they are, and how their impact varies across different timeframes and dimensions. Here's how you can navigate it:
         
-        - 1️⃣ Select Time Duration (Which years do you want to analyze):
-             Use the year range slider to focus on a specific period—from 2000 to 2024. Whether you're interested in a single year or long-term trends, this control lets you zoom in or out as needed.
+    - 1️⃣ Select Time Duration (Which years do you want to analyze):
+         Use the year range slider to focus on a specific period—from 2000 to 2024. Whether you're interested in a single year or long-term trends, this control lets you zoom in or out as needed.
 
-        - 2️⃣ Switch Between Time Axes (Choose how you want to explore time):
-            - Hour vs. Month: When during the day do tornadoes most commonly occur in each month?
-            - Year vs. Month: How has tornado activity changed across months over the years?
-            - Hour vs. Year: Are tornadoes happening at different times of day in recent years?
+    - 2️⃣ Switch Between Time Axes (Choose how you want to explore time):
+        - Hour vs. Month: When during the day do tornadoes most commonly occur in each month?
+        - Year vs. Month: How has tornado activity changed across months over the years?
+        - Hour vs. Year: Are tornadoes happening at different times of day in recent years?
 
-        - 3️⃣ Choose a Metric (What kind of impact do you want to examine):
-            Toggle between: Number of tornadoes, Injuries, Deaths, Property Damage, and Crop damage.
+    - 3️⃣ Choose a Metric (What kind of impact do you want to examine):
+        Toggle between: Number of tornadoes, Injuries, Deaths, Property Damage, and Crop damage.
 
-        - 4️⃣ Hover over heatmap cells or bar charts for detailed values
+    - 4️⃣ Hover over heatmap cells or bar charts for detailed values
                     
-        These tools allow you to uncover patterns that go beyond what’s visible in static charts. Whether you're studying trends, investigating specific years, or simply exploring out of curiosity, the heatmap offers a flexible way to ask and answer deeper questions.
-        """)
+    These tools allow you to uncover patterns that go beyond what’s visible in static charts. Whether you're studying trends, investigating specific years, or simply exploring out of curiosity, the heatmap offers a flexible way to ask and answer deeper questions.
+    """)
         
-        st.markdown("---")
-
-        st.markdown("""
-        #### 🔎 Questions You Might Want To Explore:
-        - Do tornadoes occur more often at night or in the afternoon?
-        - Has tornado damage increased in the last decade?
-        - Which month sees the most tornado-related deaths?
-        - What are the most dangerous hours across all years?
-        """)
-
-        st.markdown("---")
+    st.markdown("---")
 
-        required_columns = ['BEGIN_TIME', 'BEGIN_YEARMONTH', 'DAMAGE_PROPERTY', 'DAMAGE_CROPS', 'INJURIES_INDIRECT', 'INJURIES_DIRECT', 'DEATHS_INDIRECT', 'DEATHS_DIRECT', 'EVENT_ID']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            st.error(f"Missing required columns: {missing_columns}. Cannot generate heatmap.")
-        else:
-            # Time parsing
-            df['BEGIN_TIME'] = df['BEGIN_TIME'].astype(str).str.zfill(4)
-            df['HOUR'] = df['BEGIN_TIME'].str[:2].astype(int)
-            df['YEAR'] = df['BEGIN_YEARMONTH'].astype(str).str[:4].astype(int)
-            df['MONTH'] = df['BEGIN_YEARMONTH'].astype(str).str[4:].astype(int)
-            df['MONTH_NAME'] = pd.to_datetime(df['MONTH'], format='%m').dt.strftime('%b')
-            df['MONTH_NAME'] = pd.Categorical(
-                df['MONTH_NAME'],
-                categories=['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'],
-                ordered=True
-            )
+    st.markdown("""
+    #### 🔎 Questions You Might Want To Explore:
+    - Do tornadoes occur more often at night or in the afternoon?
+    - Has tornado damage increased in the last decade?
+    - Which month sees the most tornado-related deaths?
+    - What are the most dangerous hours across all years?
+    """)
 
-            # Clean up damage fields
-            def parse_damage(val):
-                try:
-                    val = str(val).strip().upper()
-                    if val.endswith("K"):
-                        return float(val[:-1]) * 1e3
-                    elif val.endswith("M"):
-                        return float(val[:-1]) * 1e6
-                    return float(val)
-                except:
-                    return 0.0
-
-            df["DAMAGE_PROPERTY_PARSED"] = df["DAMAGE_PROPERTY"].apply(parse_damage)
-            df["DAMAGE_CROPS_PARSED"] = df["DAMAGE_CROPS"].apply(parse_damage)
-            df["INJURIES"] = df["INJURIES_INDIRECT"] + df["INJURIES_DIRECT"]
-            df["DEATHS"] = df["DEATHS_INDIRECT"] + df["DEATHS_DIRECT"]
-
-            # Fold the data
-            folded = df.groupby(['MONTH_NAME', 'HOUR', 'YEAR']).agg(
-                COUNT=('EVENT_ID', 'count'),
-                DAMAGE_PROPERTY=('DAMAGE_PROPERTY_PARSED', 'sum'),
-                DAMAGE_CROPS=('DAMAGE_CROPS_PARSED', 'sum'),
-                INJURIES=('INJURIES', 'sum'),
-                DEATHS=('DEATHS', 'sum')
-            ).reset_index().melt(
-                id_vars=['MONTH_NAME', 'HOUR', 'YEAR'],
-                value_vars=['COUNT', 'DAMAGE_PROPERTY', 'DAMAGE_CROPS', 'INJURIES', 'DEATHS'],
-                var_name='metric',
-                value_name='value'
-            )
+    st.markdown("---")
 
-            # Sidebar controls for heatmap (replacing Altair bindings)
-            st.sidebar.header("Heatmap Settings")
-            metric = st.sidebar.selectbox(
-                "Display Metric:",
-                ['COUNT', 'DAMAGE_PROPERTY', 'DAMAGE_CROPS', 'INJURIES', 'DEATHS'],
-                format_func=lambda x: {
-                    'COUNT': 'Number of occurrences',
-                    'DAMAGE_PROPERTY': 'Damage to properties',
-                    'DAMAGE_CROPS': 'Damage to crops',
-                    'INJURIES': 'Injuries',
-                    'DEATHS': 'Deaths'
-                }[x]
-            )
-            axis_mode = st.sidebar.selectbox(
-                "Axis:",
-                ['hour_month', 'hour_year', 'year_month'],
-                format_func=lambda x: {
-                    'hour_month': 'Hour vs Month',
-                    'hour_year': 'Hour vs Year',
-                    'year_month': 'Year vs Month'
-                }[x]
-            )
-            year_range = st.sidebar.slider("Year Range", min_value=2000, max_value=2024, value=(2000, 2024))
+    # The heatmap needs all years of data; reserve its place and fill it in once the load is done
+    heatmap_slot = st.container()
+
+    # Only the heatmap depends on these controls, so they live in their own fragment
+    @st.fragment
+    @storm_profiling.traced('render_heatmap', keep_trace)
+    def render_heatmap(folds):
+        # Sidebar controls for heatmap (replacing Altair bindings)
+        st.sidebar.header("Heatmap Settings")
+        metric = st.sidebar.selectbox(
+            "Display Metric:",
+            ['COUNT', 'DAMAGE_PROPERTY', 'DAMAGE_CROPS', 'INJURIES', 'DEATHS'],
+            format_func=lambda x: {
+                'COUNT': 'Number of occurrences',
+                'DAMAGE_PROPERTY': 'Damage to properties',
+                'DAMAGE_CROPS': 'Damage to crops',
+                'INJURIES': 'Injuries',
+                'DEATHS': 'Deaths'
+            }[x]
+        )
+        axis_mode = st.sidebar.selectbox(
+            "Axis:",
+            ['hour_month', 'hour_year', 'year_month'],
+            format_func=lambda x: {
+                'hour_month': 'Hour vs Month',
+                'hour_year': 'Hour vs Year',
+                'year_month': 'Year vs Month'
+            }[x]
+        )
+        clock = st.sidebar.selectbox(
+            "Hour of Day:",
+            list(storm_data.HEATMAP_CLOCKS),
+            format_func=lambda x: {'local': 'Local time (event time zone)', 'utc': 'UTC'}[x],
+            help="Local hours mix time zones; UTC puts every event on one clock."
+        )
+        year_range = st.sidebar.slider("Year Range", min_value=2000, max_value=2024, value=(2000, 2024))
+        folded = folds[clock]
 
+        def build_heatmap_layout():
             # Define Altair selectors
             selector = alt.param(name='metric', value=metric)
             axis_selector = alt.param(name='axis_mode', value=axis_mode)
@@ -532,6 +1046,7 @@ else:
                 (folded['YEAR'] >= year_range[0]) &
                 (folded['YEAR'] <= year_range[1])
             ]
+            track_frame('filtered_data', filtered_data)
 
             # ----- Central Heatmap -----
             heatmap = alt.Chart(filtered_data).add_params(
@@ -548,7 +1063,7 @@ else:
                 groupby=['xdim', 'ydim']
             ).mark_rect().encode(
                 x=alt.X('xdim:O', title=None, axis=alt.Axis(labelAngle=0)),
-                y=alt.Y('ydim:O', sort=['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'],
+                y=alt.Y('ydim:O', sort=storm_data.MONTH_NAMES,
                         title=None, axis=alt.Axis(labels=False, ticks=False, grid=False)),
                 color=alt.Color('value:Q', scale=alt.Scale(scheme='blues'), title="Metric Value", legend=alt.Legend(orient='bottom')),
                 tooltip=[
@@ -618,7 +1133,7 @@ else:
             )
 
             bar_left = bar_left_base.mark_bar().encode(
-                y=alt.Y('ydim:O', title=None, sort=['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'],
+                y=alt.Y('ydim:O', title=None, sort=storm_data.MONTH_NAMES,
                         axis=alt.Axis(title=None, labels=False, ticks=False, grid=False)),
                 x=alt.X('total:Q', title=None, scale=alt.Scale(reverse=True), axis=alt.Axis(title=None, labels=False, ticks=False, grid=False)),
                 color=alt.Color('total:Q', scale=alt.Scale(scheme='blues'), legend=None),
@@ -656,7 +1171,7 @@ else:
             ).transform_calculate(
                 ydim="axis_mode === 'hour_month' || axis_mode === 'year_month' ? datum.MONTH_NAME : toNumber(datum.YEAR)"
             ).mark_bar(opacity=0).encode(
-                y=alt.Y('ydim:O', title=None, sort=['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'],
+                y=alt.Y('ydim:O', title=None, sort=storm_data.MONTH_NAMES,
                         axis=alt.Axis(title=None, ticks=False, grid=False, labels=True)),
                 x=alt.value(5)
             ).properties(
@@ -707,9 +1222,15 @@ else:
             ).properties(
                 title="When do tornadoes occur? What is their effect?"
             )
+            return full_layout
 
-    st.altair_chart(full_layout, use_container_width=False)
+        show_chart(('heatmap', clock, metric, axis_mode, year_range), build_heatmap_layout, use_container_width=False)
 
+    @st.fragment(run_every=1)
+    def render_load_progress(job):
+        if job.done():
+            st.rerun()  # full rerun swaps the progress bar for the heatmap
+        st.progress(job.progress, text=f"⏳ {job.message}")
 
     # Climate Change
     st.markdown('---')
@@ -729,88 +1250,202 @@ else:
     if climate_data.empty:
         st.warning("⚠️ No temperature data found.")
     else:
-        # 計算 anomaly
-        mean_temp = climate_data['TEMPERATURE'].mean()
-        climate_data['TEMP_ANOMALY'] = climate_data['TEMPERATURE'] - mean_temp
-        climate_data['POS_ANOMALY'] = climate_data['TEMP_ANOMALY'].clip(lower=0)
-        climate_data['NEG_ANOMALY'] = climate_data['TEMP_ANOMALY'].clip(upper=0)
-
-        # Base chart
-        base = alt.Chart(climate_data).encode(
-            x=alt.X('YEAR:O',
-                    title=None,
-                    axis=alt.Axis(values=list(range(1950, 2030, 5)),labelAlign='left', labelAngle=0)),
-        )
+        def build_climate_chart():
+            # 計算 anomaly
+            mean_temp = climate_data['TEMPERATURE'].mean()
+            climate_data['TEMP_ANOMALY'] = climate_data['TEMPERATURE'] - mean_temp
+            climate_data['POS_ANOMALY'] = climate_data['TEMP_ANOMALY'].clip(lower=0)
+            climate_data['NEG_ANOMALY'] = climate_data['TEMP_ANOMALY'].clip(upper=0)
+
+            # Base chart
+            base = alt.Chart(climate_data).encode(
+                x=alt.X('YEAR:O',
+                        title=None,
+                        axis=alt.Axis(values=list(range(1950, 2030, 5)),labelAlign='left', labelAngle=0)),
+            )
 
-        # 溫度 anomaly bars
-        pos_bar = base.mark_bar(color='lightblue').encode(
-            y=alt.Y('POS_ANOMALY:Q', scale=alt.Scale(domain=[-4,4]),  axis=alt.Axis(title='Temp Anomaly (°C)', titleColor='lightblue')),
-            opacity=alt.value(0.5),
-            tooltip=['YEAR','TEMP_ANOMALY']
-        )
-        neg_bar = base.mark_bar(color='lightblue').encode(
-            y=alt.Y('NEG_ANOMALY:Q', axis=alt.Axis(title='Temp Anomaly (°C)', titleColor='lightblue')),
-            opacity=alt.value(0.5),
-            tooltip=['YEAR','TEMP_ANOMALY']
-        )
+            # 溫度 anomaly bars
+            pos_bar = base.mark_bar(color='lightblue').encode(
+                y=alt.Y('POS_ANOMALY:Q', scale=alt.Scale(domain=[-4,4]),  axis=alt.Axis(title='Temp Anomaly (°C)', titleColor='lightblue')),
+                opacity=alt.value(0.5),
+                tooltip=['YEAR','TEMP_ANOMALY']
+            )
+            neg_bar = base.mark_bar(color='lightblue').encode(
+                y=alt.Y('NEG_ANOMALY:Q', axis=alt.Axis(title='Temp Anomaly (°C)', titleColor='lightblue')),
+                opacity=alt.value(0.5),
+                tooltip=['YEAR','TEMP_ANOMALY']
+            )
 
-        # y=0 虛線
-        zero_line = alt.Chart(pd.DataFrame({'y':[0]})).mark_rule(
-            strokeDash=[4,4], color='gray'
-        ).encode(y='y:Q')
+            # y=0 虛線
+            zero_line = alt.Chart(pd.DataFrame({'y':[0]})).mark_rule(
+                strokeDash=[4,4], color='gray'
+            ).encode(y='y:Q')
 
-        # 2000 以後灰底
-        highlight_bg = alt.Chart(pd.DataFrame({
-            'start':[2000],'end':[climate_data['YEAR'].max()]
-        })).mark_rect(opacity=0.25, color='gray').encode(
-            x='start:O', x2='end:O'
-        )
+            # 2000 以後灰底
+            highlight_bg = alt.Chart(pd.DataFrame({
+                'start':[2000],'end':[climate_data['YEAR'].max()]
+            })).mark_rect(opacity=0.25, color='gray').encode(
+                x='start:O', x2='end:O'
+            )
         
-        temp_anomaly_layer = alt.layer(
-            highlight_bg,
-            pos_bar,
-            neg_bar,
-            zero_line
-        ).resolve_scale(
-            y='shared'
-        )
+            temp_anomaly_layer = alt.layer(
+                highlight_bg,
+                pos_bar,
+                neg_bar,
+                zero_line
+            ).resolve_scale(
+                y='shared'
+            )
 
-        # Tornado 折線 + 點 (brush 篩選)
-        tornado_line = alt.Chart(climate_data).mark_line(
-            color='darkgreen', strokeWidth=3
-        ).encode(
-            x='YEAR:O',
-            y=alt.Y('NUM_TORNADO:Q',
-                    axis=alt.Axis(title='No. Tornadoes', titleColor='darkgreen'),
-                    scale=alt.Scale(domain=[-1000,2500]))
-        )
+            # Tornado 折線 + 點 (brush 篩選)
+            tornado_line = alt.Chart(climate_data).mark_line(
+                color='darkgreen', strokeWidth=3
+            ).encode(
+                x='YEAR:O',
+                y=alt.Y('NUM_TORNADO:Q',
+                        axis=alt.Axis(title='No. Tornadoes', titleColor='darkgreen'),
+                        scale=alt.Scale(domain=[-1000,2500]))
+            )
 
-        tornado_points = alt.Chart(climate_data).mark_point(
-            filled=True, size=80, color='white',
-            stroke='darkgreen', strokeWidth=2
-        ).encode(
-            x='YEAR:O',
-            y=alt.Y('NUM_TORNADO:Q',axis=alt.Axis(title='No. Tornadoes', titleColor='darkgreen'),
-                    scale=alt.Scale(domain=[-1000,2500])),
-            tooltip=['YEAR','NUM_TORNADO']
-        )
+            tornado_points = alt.Chart(climate_data).mark_point(
+                filled=True, size=80, color='white',
+                stroke='darkgreen', strokeWidth=2
+            ).encode(
+                x='YEAR:O',
+                y=alt.Y('NUM_TORNADO:Q',axis=alt.Axis(title='No. Tornadoes', titleColor='darkgreen'),
+                        scale=alt.Scale(domain=[-1000,2500])),
+                tooltip=['YEAR','NUM_TORNADO']
+            )
 
-        tornado_line_points = alt.layer(
-            tornado_line, tornado_points
-        ).resolve_scale('shared')
-
-        # 組合圖層並加入 brush
-        interact_chart = alt.layer(
-            temp_anomaly_layer,
-            tornado_line_points
-        ).resolve_scale(
-            y='independent'
-        ).properties(
-            width=800, height=400,
-            title=alt.TitleParams("Do higher land temperatures mean more tornadoes?", fontSize=25, anchor='middle')
-        )
+            tornado_line_points = alt.layer(
+                tornado_line, tornado_points
+            ).resolve_scale('shared')
+
+            # 組合圖層並加入 brush
+            interact_chart = alt.layer(
+                temp_anomaly_layer,
+                tornado_line_points
+            ).resolve_scale(
+                y='independent'
+            ).properties(
+                width=800, height=400,
+                title=alt.TitleParams("Do higher land temperatures mean more tornadoes?", fontSize=25, anchor='middle')
+            )
+            return interact_chart
 
-        st.altair_chart(interact_chart, use_container_width=True)
+        show_chart(('climate',), build_climate_chart, use_container_width=True)
             # Footer
         st.markdown("---")
         st.caption("Data: NOAA Storm Events | Interactive Dashboard built with Streamlit & Altair")
+
+    # ----- Heatmap: drawn last so the text and climate chart above never wait for it -----
+    with heatmap_slot:
+        heatmap_key = ('heatmap', archive_fingerprint())
+        loaded = derived_cache().get(heatmap_key)
+        job = heatmap_data_job() if loaded is None else None
+        if job is not None:
+            job.wait(0.5)  # a warm on-disk cache finishes well within this, so the heatmap draws on the first run
+        if job is not None and not job.done():
+            render_load_progress(job)
+        else:
+            try:
+                folds, issues, error = loaded or job.result()
+            except Exception as e:
+                heatmap_data_job.clear()  # retry on the next run
+                folds, issues, error = None, [], f"❌ Could not load multi-year data: {e}"
+            else:
+                if loaded is None and error is None:
+                    # Hand the folds over to the budgeted cache so the finished job doesn't pin them;
+                    # once evicted, the next run reloads them from the on-disk heatmap_folds entry
+                    derived_cache().put(heatmap_key, (folds, issues, error))
+                    heatmap_data_job.clear()
+
+            for level, message in issues:
+                getattr(st.sidebar, level)(message)
+            if error:
+                st.error(error)
+            else:
+                render_heatmap(folds)
+
+
+# ========== DEBUG PANEL (?debug=1) ==========
+def render_debug_panel():
+    traces = st.session_state.get('profile_traces', [])
+    with st.expander("🛠️ Debug: rerun profile", expanded=True):
+        labels = [f"{t.name} at {time.strftime('%H:%M:%S', time.localtime(t.started_at))} – {t.duration_ms:.0f} ms"
+                  for t in traces]
+        trace = traces[st.selectbox("Run:", range(len(traces)), index=len(traces) - 1, format_func=labels.__getitem__)]
+
+        spans = pd.DataFrame(trace.spans).sort_values('start_ms').reset_index(drop=True)
+        spans['end_ms'] = spans['start_ms'] + spans['duration_ms']
+        spans['label'] = [f"{i:02d} {'· ' * depth}{name}" for i, (depth, name) in enumerate(zip(spans['depth'], spans['name']))]
+        st.vega_lite_chart(spans[['label', 'start_ms', 'end_ms', 'duration_ms', 'depth']], {
+            'mark': 'bar',
+            'height': {'step': 14},
+            'encoding': {
+                'y': {'field': 'label', 'type': 'nominal', 'sort': None, 'title': None},
+                'x': {'field': 'start_ms', 'type': 'quantitative', 'title': 'ms since run start'},
+                'x2': {'field': 'end_ms'},
+                'color': {'field': 'depth', 'type': 'ordinal', 'legend': None},
+                'tooltip': [{'field': 'label', 'type': 'nominal'}, {'field': 'duration_ms', 'type': 'quantitative', 'format': '.1f'}],
+            },
+        }, use_container_width=True)
+
+        if 'spec_bytes' in spans:
+            st.markdown("**Payload per chart**")
+            st.dataframe(spans.loc[spans['spec_bytes'].notna(), ['name', 'duration_ms', 'spec_bytes', 'data_bytes']], hide_index=True)
+
+        st.markdown("**Cache hit rates**")
+        year_cache = year_prefetcher().cache
+        derived = derived_cache()
+        caches = [('Vega-Lite specs', spec_cache().hits, spec_cache().misses, spec_cache().evictions),
+                  ('Loaded years', year_cache.hits, year_cache.misses, year_cache.evictions),
+                  ('Derived data', derived.hits, derived.misses, derived.evictions)]
+        caches += [(f"Disk: {name}", storm_cache.stats[(name, 'hits')], storm_cache.stats[(name, 'misses')], 0)
+                   for name in sorted({name for name, _ in storm_cache.stats})]
+        caches = pd.DataFrame(caches, columns=['cache', 'hits', 'misses', 'evictions'])
+        caches['hit rate'] = caches['hits'] / (caches['hits'] + caches['misses']).where(lambda n: n > 0)
+        st.dataframe(caches, hide_index=True)
+
+        if storm_profiling.BACKGROUND:
+            st.markdown("**Background work** (prefetch, heatmap job)")
+            st.dataframe(pd.DataFrame(list(storm_profiling.BACKGROUND)[-50:]), hide_index=True)
+
+        render_memory_section()
+
+        st.download_button("Download spans (JSON lines)", trace.jsonl(), file_name=f"trace-{trace.id}.jsonl",
+                           mime='application/jsonl')
+
+
+def render_memory_section():
+    mib = lambda n: n / 2**20
+    budget = memory_budget()
+    peak = storm_memory.peak_rss_bytes()
+    st.markdown(f"**Memory** – shared caches {mib(budget.total_bytes()):.1f} of {CACHE_BUDGET_MB} MiB"
+                + (f", peak RSS {mib(peak):.0f} MiB" if peak else ""))
+
+    entries = [('Vega-Lite specs', key, nbytes) for key, nbytes in spec_cache().sizes()]
+    entries += [('Loaded years', key, nbytes) for key, nbytes in year_prefetcher().cache.sizes()]
+    # Includes the heatmap folds: the heatmap section above has already moved a finished job's result in here
+    entries += [('Derived data', key, nbytes) for key, nbytes in derived_cache().sizes()]
+    entries = pd.DataFrame(entries, columns=['cache', 'key', 'bytes'])
+    entries['key'] = entries['key'].map(str)
+    st.dataframe(entries.assign(MiB=mib(entries['bytes'])).sort_values('bytes', ascending=False), hide_index=True)
+
+    st.markdown("Derived frames per session (latest run)")
+    st.dataframe(session_memory().table().assign(MiB=lambda t: mib(t['bytes'])), hide_index=True)
+
+    if not storm_memory.TRACEMALLOC:
+        st.caption("Start the app with STORM_TRACEMALLOC=1 to take tracemalloc snapshots.")
+        return
+    if st.button("Take tracemalloc snapshot"):
+        st.session_state['tracemalloc_top'] = storm_memory.snapshot_table()
+    top = st.session_state.get('tracemalloc_top')
+    if top is not None:
+        st.caption("Top allocation sites; 'change' is relative to the previous snapshot in this process.")
+        st.dataframe(top, hide_index=True)
+
+
+keep_trace(storm_profiling.end(run_trace))
+if DEBUG:
+    render_debug_panel()
@@ -0,0 +1,39 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+import storm_data
+import export_heatmap
+
+
+def window_total(rows, m, a, part, year_min, year_max):
+    """Sum of one grid over a year window, weighting the rows the way precomputed_bases does."""
+    rows = rows[(rows['p'] == part) & rows['m'].isin([-1, m]) & (rows['a'] == a)]
+    per_year = (rows['k'] == 0) & rows['yr'].between(year_min, year_max)
+    weight = np.select(
+        [rows['k'] == 2, per_year, (rows['k'] == 1) & (rows['yr'] == year_max),
+         (rows['k'] == 1) & (rows['yr'] == year_min - 1)],
+        [1, 1, 1, -1], 0)
+    return int((rows['v'] * weight).sum())
+
+
+def test_year_windows_across_a_gap_match_the_per_year_sums():
+    # No tornadoes at all in 2001 and 2004
+    folded = pd.DataFrame({
+        'MONTH_NAME': ['Jan', 'Mar', 'Mar', 'Jul', 'Dec'],
+        'HOUR': [3, 14, 14, 18, 23],
+        'YEAR': [2000, 2002, 2003, 2003, 2005],
+        'metric': 'COUNT',
+        'value': [2, 5, 1, 7, 4],
+    })
+    csv, years = export_heatmap.precompute(folded)
+    rows = pd.read_csv(io.StringIO(csv))
+    m = storm_data.HEATMAP_METRICS.index('COUNT')
+
+    assert years.tolist() == list(range(2000, 2006))
+    for year_min, year_max in [(2000, 2005), (2001, 2003), (2002, 2002), (2001, 2001), (2000, 2001), (2004, 2005)]:
+        expected = int(folded.loc[folded['YEAR'].between(year_min, year_max), 'value'].sum())
+        for a in range(len(export_heatmap.AXIS_MODES)):
+            for part in 'ctl':
+                assert window_total(rows, m, a, part, year_min, year_max) == expected, (year_min, year_max, a, part)
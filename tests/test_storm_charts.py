@@ -0,0 +1,32 @@
+import json
+import re
+
+import altair as alt
+import pandas as pd
+import pytest
+
+import storm_charts
+
+vl_convert = pytest.importorskip('vl_convert')
+
+
+def test_animated_param_keeps_its_timer_when_compiled_to_vega():
+    year = alt.param(name='year', value=2003, bind=alt.binding_range(min=2000, max=2005, step=1))
+    chart = alt.Chart(pd.DataFrame({'YEAR': [2000, 2003, 2005], 'n': [1, 2, 3]})).mark_bar().encode(
+        x='YEAR:O', y='n:Q'
+    ).transform_filter(alt.datum.YEAR == year).add_params(year)
+    spec = storm_charts.animated(chart.to_dict(), 'year', [2000, 2003, 2005], interval_ms=500)
+
+    signals = {signal['name']: signal for signal in vl_convert.vegalite_to_vega(json.dumps(spec))['signals']}
+    assert signals['play']['bind']['input'] == 'checkbox'
+    assert signals['year']['on'][0]['events'] == 'timer{500}'
+
+    # The update steps through the values and wraps around at the end
+    update = signals['year']['on'][0]['update']
+    for start, expected in [(2000, '2003'), (2003, '2005'), (2005, '2000')]:
+        probe = {
+            'data': {'values': [{}]}, 'mark': 'text',
+            'params': [{'name': 'play', 'value': True}, {'name': 'year', 'value': start}, {'name': 'step', 'expr': update}],
+            'encoding': {'text': {'value': {'expr': 'step'}}},
+        }
+        assert re.findall(r'>(\d{4})<', vl_convert.vegalite_to_svg(json.dumps(probe))) == [expected]
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+import storm_spatial
+
+
+def grid_index(tmp_path, points):
+    df = pd.DataFrame(points, columns=['EVENT_ID', 'BEGIN_LAT', 'BEGIN_LON'])
+    df['END_LAT'], df['END_LON'] = np.nan, np.nan
+    path = tmp_path / 'grid.npz'
+    np.savez(path, **storm_spatial.build_grid_index(df))
+    return storm_spatial.GridIndex([path])
+
+
+def test_queries_touching_the_east_and_north_edges(tmp_path):
+    lat_max, lon_max = storm_spatial.LAT_RANGE[1], storm_spatial.LON_RANGE[1]
+    index = grid_index(tmp_path, [(1, 44.8, -68.8), (2, 45.0, -65.5), (3, lat_max, lon_max), (4, 35.0, -97.0)])
+
+    assert index.query_radius(44.8, -68.8, 50).tolist() == [1]
+    assert index.query_radius(44.8, -68.8, 300).tolist() == [1, 2]
+    assert index.query_bbox(40, 50, -70, -64).tolist() == [1, 2]
+    assert index.query_bbox(40, 50, -70, -65).tolist() == [1, 2]
+    assert index.query_bbox(lat_max - 1, lat_max + 5, lon_max - 1, lon_max + 5).tolist() == [3]
+    assert index.query_bbox(20, 80, -180, -60).tolist() == [1, 2, 3, 4]
+
+
+def test_queries_outside_the_grid_find_nothing(tmp_path):
+    index = grid_index(tmp_path, [(1, 44.8, -68.8)])
+
+    assert index.query_bbox(60, 70, -50, -40).tolist() == []
+    assert index.query_bbox(50, 40, -70, -64).tolist() == []